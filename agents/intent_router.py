@@ -0,0 +1,177 @@
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from agents.members import STUDY_GUIDE_BUILDER, EXISTING_STUDY_GUIDE, QUIZ_QUESTION_BUILDER, GENERAL_CHAT_AGENT
+
+# The message /explain sends, the router only looks at the question so that the selected text can't change the route
+EXPLAIN_REQUEST = ("The user selected the following text from the study guide: {selection}. "
+                   "The user asked the following question about the selected text: {query}. Respond in plain text")
+_EXPLAIN_QUERY = re.compile(r"The user asked the following question about the selected text: (?P<query>.*)\. "
+                            r"Respond in plain text$", re.DOTALL)
+
+# Intent -> rules. A request is routed locally when the rules of exactly one intent match
+RULES: dict[str, list[re.Pattern]] = {
+    STUDY_GUIDE_BUILDER: [
+        re.compile(r"\b(create|generate|make|write|build|new|another|redo|regenerate)\b.*\bstudy guide\b"),
+    ],
+    EXISTING_STUDY_GUIDE: [
+        re.compile(r"\b(show|open|see|view|read|find|load)\b.*\b(my|the|existing)\b.*\bstudy guide\b"),
+    ],
+    QUIZ_QUESTION_BUILDER: [
+        re.compile(r"\bquiz me\b"),
+        re.compile(r"\btest me\b"),
+        re.compile(r"\b(give|ask|create|generate|make)\b.*\b(quiz|practice|test|multiple choice) questions?\b"),
+    ],
+}
+# Rules that only apply to the question of an /explain request. A question about selected text is for the general
+# chat agent, but free text like "can I get a harder question?" can be a request for another worker
+EXPLAIN_RULES: dict[str, list[re.Pattern]] = {
+    GENERAL_CHAT_AGENT: [
+        re.compile(r"^(what|why|how|when|where|who|which|is|are|does|do|can|could|should|would)\b"),
+        re.compile(r"\b(explain|clarify|define|elaborate|simplify|summari[sz]e|rephrase|example|examples|mean|"
+                   r"meaning|difference|compare)\b"),
+        re.compile(r"\?$"),
+    ],
+}
+
+
+class RouteDecision(NamedTuple):
+    next: str
+    rule: str
+
+
+def explain_query(content: str) -> str | None:
+    """
+    The question of an /explain request, None when the message is not one.
+    """
+    match = _EXPLAIN_QUERY.search(content)
+    return match.group("query") if match else None
+
+
+def intent_text(content: str) -> str:
+    """
+    The part of a message that says what the user wants: the question of an /explain request, or the whole message.
+    """
+    query = explain_query(content)
+    return " ".join((content if query is None else query).lower().split())
+
+
+class IntentRouter:
+    """
+    Routes common requests to a worker with keyword rules, so they don't need an LLM call to pick the worker.
+    Requests that match no rule, or rules of more than one worker, are left to the LLM router. Counts how many
+    requests were routed locally and how long the LLM router took for the others, to estimate the latency saved.
+    Args:
+        rules: intent -> regular expressions on the lower cased intent text, RULES by default
+        explain_rules: rules that only apply to the questions of /explain requests, EXPLAIN_RULES by default
+    """
+
+    def __init__(self, rules: dict[str, list[re.Pattern]] | None = None,
+                 explain_rules: dict[str, list[re.Pattern]] | None = None):
+        self.rules = rules or RULES
+        self.explain_rules = explain_rules or EXPLAIN_RULES
+        self.local = 0
+        self.fallback = 0
+        self.fallback_seconds = 0.0
+        self.local_seconds = 0.0
+        self.routes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def match(self, content: str) -> RouteDecision | None:
+        """
+        Like route, without counting the request in the stats.
+        """
+        rules = self.rules
+        if explain_query(content) is not None:
+            rules = {**rules, **{intent: rules.get(intent, []) + patterns
+                                 for intent, patterns in self.explain_rules.items()}}
+        text = intent_text(content)
+        matches = {}
+        for intent, patterns in rules.items():
+            for pattern in patterns:
+                if pattern.search(text):
+                    matches[intent] = pattern.pattern
+                    break
+        # Asking to build something is more specific than the question words of a general question
+        if len(matches) > 1:
+            matches.pop(GENERAL_CHAT_AGENT, None)
+        return RouteDecision(*next(iter(matches.items()))) if len(matches) == 1 else None
+
+    def route(self, content: str) -> RouteDecision | None:
+        """
+        Returns:
+            the worker and the rule that picked it, or None when the LLM router has to decide
+        """
+        start = time.perf_counter()
+        decision = self.match(content)
+        self.record(decision, time.perf_counter() - start)
+        return decision
+
+    def record(self, decision: RouteDecision | None, seconds: float):
+        """
+        Count a decision of match in the stats, for requests that are answered without being routed, e.g. /explain
+        questions answered outside of the graph.
+        Args:
+            decision: what match returned
+            seconds: how long match took
+        """
+        with self._lock:
+            self.local_seconds += seconds
+            if decision:
+                self.local += 1
+                self.routes[decision.next] = self.routes.get(decision.next, 0) + 1
+
+    def record_fallback(self, seconds: float):
+        """
+        Record an LLM routing call for a request the rules could not route.
+        """
+        with self._lock:
+            self.fallback += 1
+            self.fallback_seconds += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.local + self.fallback
+            avg_fallback_seconds = self.fallback_seconds / self.fallback if self.fallback else 0.0
+            return {"requests": total, "local": self.local, "fallback": self.fallback,
+                    "hit_rate": self.local / total if total else 0.0,
+                    "avg_local_seconds": self.local_seconds / total if total else 0.0,
+                    "avg_fallback_seconds": avg_fallback_seconds,
+                    # Every local route skips one LLM routing call
+                    "seconds_saved": self.local * avg_fallback_seconds,
+                    "routes": dict(self.routes)}
+
+
+if __name__ == "__main__":
+    router = IntentRouter()
+    selection = "Quiz questions and study guides help you remember heaps."
+    cases = {
+        "What does sift down mean?": GENERAL_CHAT_AGENT,
+        "explain this like I'm five": GENERAL_CHAT_AGENT,
+        "Can you give an example": GENERAL_CHAT_AGENT,
+        "Quiz me on heaps": QUIZ_QUESTION_BUILDER,
+        "give me a practice question about this": QUIZ_QUESTION_BUILDER,
+        "Can you make a new study guide for graphs?": STUDY_GUIDE_BUILDER,
+        "show me my study guide for heaps": EXISTING_STUDY_GUIDE,
+        "heaps": None,
+        "thanks": None,
+        "quiz me and then write a new study guide": None,
+    }
+    for query, expected in cases.items():
+        # The selected text mentions quizzes and study guides, only the question decides the route
+        decision = router.route(EXPLAIN_REQUEST.format(selection=selection, query=query))
+        assert (decision.next if decision else None) == expected, f"{query}: {decision}"
+    assert router.route("Quiz me").next == QUIZ_QUESTION_BUILDER
+    # Questions outside of /explain can ask any worker for something, the LLM router decides
+    for query in ["is my study guide up to date?", "can I get a harder question?", "What does sift down mean?"]:
+        assert router.route(query) is None, query
+    assert router.match("Quiz me").next == QUIZ_QUESTION_BUILDER
+    router.record(router.match(EXPLAIN_REQUEST.format(selection=selection, query="Why?")), 0.0)
+
+    router.record_fallback(0.8)
+    stats = router.stats()
+    assert stats["local"] == 9 and stats["fallback"] == 1 and stats["routes"][GENERAL_CHAT_AGENT] == 4
+    assert stats["seconds_saved"] == 9 * 0.8
+    print("OK")
@@ -0,0 +1,8 @@
+# Workers of the study guide supervisor. Their names are the deterministic routes to them and the names of their
+# messages in the history
+STUDY_GUIDE_BUILDER = "study_guide_builder"
+EXISTING_STUDY_GUIDE = "existing_study_guide"
+QUIZ_QUESTION_BUILDER = "quiz_question_builder"
+QUIZ_GRADER = "quiz_grader"
+GENERAL_CHAT_AGENT = "general_chat_agent"
+members = [STUDY_GUIDE_BUILDER, QUIZ_QUESTION_BUILDER, QUIZ_GRADER, EXISTING_STUDY_GUIDE, GENERAL_CHAT_AGENT]
@@ -0,0 +1,154 @@
+import os
+import re
+
+from langchain_core.messages import AnyMessage, RemoveMessage, HumanMessage
+from pydantic import BaseModel
+
+from agents.members import STUDY_GUIDE_BUILDER, QUIZ_QUESTION_BUILDER, QUIZ_GRADER
+
+# Agents reply with a header message followed by the content, both carrying the agent name
+_HEADER_PREFIXES = ("The following message is from", "Below is the study guide")
+_SUBJECT_TOPIC = re.compile(r"subject: (?P<subject>.+?), topic: (?P<topic>.+)$")
+
+# Rough estimate used for OpenAI models
+CHARS_PER_TOKEN = 4
+
+
+class CompactionPolicy(BaseModel):
+    """
+    Decides which old messages are removed from a supervisor thread before the next LLM call.
+    """
+    # Sliding window over the most recent messages, 0 keeps everything
+    max_messages: int = 30
+    # Only keep the newest study guide of every subject/topic
+    latest_study_guide_per_topic: bool = True
+    # Quiz questions are no longer needed once the quiz grader has explained the answer
+    drop_graded_quiz_questions: bool = True
+
+    @classmethod
+    def from_env(cls) -> "CompactionPolicy":
+        return cls(
+            max_messages=int(os.getenv("MESSAGE_WINDOW", 30)),
+            latest_study_guide_per_topic=os.getenv("COMPACT_STUDY_GUIDES", "true").lower() == "true",
+            drop_graded_quiz_questions=os.getenv("COMPACT_GRADED_QUIZ_QUESTIONS", "true").lower() == "true",
+        )
+
+
+def _content(message: AnyMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def _group(messages: list[AnyMessage]) -> list[list[AnyMessage]]:
+    """
+    Group messages so that an agent header and the content following it are kept or removed together.
+    """
+    groups = []
+    i = 0
+    while i < len(messages):
+        message = messages[i]
+        is_header = message.name and _content(message).startswith(_HEADER_PREFIXES)
+        if is_header and i + 1 < len(messages) and messages[i + 1].name == message.name:
+            groups.append([message, messages[i + 1]])
+            i += 2
+        else:
+            groups.append([message])
+            i += 1
+    return groups
+
+
+def _study_guide_key(group: list[AnyMessage]) -> tuple[str, str] | None:
+    match = _SUBJECT_TOPIC.search(_content(group[0]))
+    return (match["subject"], match["topic"]) if match else None
+
+
+def compact_messages(messages: list[AnyMessage], policy: CompactionPolicy) -> list[RemoveMessage]:
+    """
+    Find the messages the policy would remove.
+    Args:
+        messages: the messages of a thread, oldest first
+        policy: what to remove
+    Returns:
+        RemoveMessage updates for the messages channel
+    """
+    groups = _group(messages)
+    removed: set[int] = set()
+
+    study_guides = [i for i, group in enumerate(groups) if len(group) == 2 and group[0].name == STUDY_GUIDE_BUILDER]
+    latest_study_guide = study_guides[-1] if study_guides else None
+    if policy.latest_study_guide_per_topic:
+        seen = set()
+        for i in reversed(study_guides):
+            key = _study_guide_key(groups[i])
+            if key in seen:
+                removed.add(i)
+            seen.add(key)
+
+    if policy.drop_graded_quiz_questions:
+        graded = [i for i, group in enumerate(groups) if group[0].name == QUIZ_GRADER]
+        if graded:
+            removed.update(i for i, group in enumerate(groups[:graded[-1]])
+                           if group[0].name == QUIZ_QUESTION_BUILDER)
+
+    if policy.max_messages > 0:
+        kept = 0
+        for i in reversed(range(len(groups))):
+            if i in removed:
+                continue
+            # The current study guide is what most requests are about, so it never slides out of the window
+            if i == latest_study_guide or kept + len(groups[i]) <= policy.max_messages:
+                kept += len(groups[i])
+            else:
+                removed.add(i)
+
+    return [RemoveMessage(id=message.id) for i in sorted(removed) for message in groups[i]]
+
+
+def estimate_tokens(messages: list[AnyMessage]) -> int:
+    return sum(len(_content(message)) for message in messages) // CHARS_PER_TOKEN
+
+
+def message_stats(messages: list[AnyMessage]) -> dict:
+    """
+    Size of a thread's message history, used for instrumentation.
+    """
+    return {"message_count": len(messages), "token_estimate": estimate_tokens(messages)}
+
+
+if __name__ == "__main__":
+    def agent_reply(name: str, header: str, content: str, i: int) -> list[AnyMessage]:
+        return [HumanMessage(id=f"{i}-header", content=header, name=name),
+                HumanMessage(id=f"{i}-content", content=content, name=name)]
+
+
+    history = [HumanMessage(id="0", content="existing_study_guide")]
+    history += agent_reply(STUDY_GUIDE_BUILDER,
+                           "The following message is from study_guide_builder for subject: Algorithms, topic: Sorting",
+                           "Sorting v1", 1)
+    history += agent_reply(QUIZ_QUESTION_BUILDER, "The following message is from quiz_question_builder",
+                           '{"question": "Q1"}', 2)
+    history += agent_reply(QUIZ_GRADER, "The following message is from quiz_grader", "Explanation 1", 3)
+    history += agent_reply(STUDY_GUIDE_BUILDER,
+                           "Below is the study guide for subject: Data Structures, topic: Heap", "Heap v1", 4)
+    history += agent_reply(STUDY_GUIDE_BUILDER,
+                           "The following message is from study_guide_builder for subject: Algorithms, topic: Sorting",
+                           "Sorting v2", 5)
+    history += agent_reply(QUIZ_QUESTION_BUILDER, "The following message is from quiz_question_builder",
+                           '{"question": "Q2"}', 6)
+
+    removed_ids = [m.id for m in compact_messages(history, CompactionPolicy(max_messages=0))]
+    # Old sorting guide and the graded question go, the ungraded question and the heap guide stay
+    assert removed_ids == ["1-header", "1-content", "2-header", "2-content"], removed_ids
+
+    removed_ids = [m.id for m in compact_messages(history, CompactionPolicy(max_messages=4))]
+    # Window keeps the last 4 messages, which include the latest study guide
+    assert removed_ids == ["0", "1-header", "1-content", "2-header", "2-content", "3-header", "3-content",
+                           "4-header", "4-content"], removed_ids
+
+    removed_ids = [m.id for m in compact_messages(history, CompactionPolicy(max_messages=2))]
+    # The latest study guide is kept even when it does not fit in the window
+    assert "5-content" not in removed_ids and "6-content" not in removed_ids and "4-content" in removed_ids
+
+    stats = message_stats(history)
+    assert stats["message_count"] == 13
+    assert stats["token_estimate"] > 0
+    print("OK")
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from services.governor import model_priority
+
+DEFAULT_QUIZ_POOL_SIZE = 2
+DEFAULT_QUIZ_POOL_IDLE_SECONDS = 3600
+# Questions remembered per key, so that new questions don't repeat them
+RECENT_QUESTIONS = 20
+
+PoolKey = tuple[str, str, str, int]
+# (username, subject, topic, level, questions to avoid) -> QuizQuestion
+QuizQuestionProducer = Callable[[str, str, str, int, list[str]], Any]
+
+
+class _PoolEntry:
+    """
+    Pre-generated questions of one key. Replaced by a new entry when the key is discarded, so that questions that were
+    being generated for the old entry are dropped.
+    """
+
+    def __init__(self, recent: deque[str] | None = None):
+        self.buffer: deque = deque()
+        self.in_flight = 0
+        self.served = 0
+        self.recent: deque[str] = recent if recent is not None else deque(maxlen=RECENT_QUESTIONS)
+        self.last_used = time.monotonic()
+
+
+class QuizQuestionPool:
+    """
+    Keeps a small buffer of pre-generated quiz questions per (user, subject, topic, level), so that a quiz question
+    can be served from memory. The buffer is filled lazily: after the first question of a key one question is
+    generated ahead, one more after every further question, up to size. Keys that were not used for idle_seconds are
+    evicted.
+    Args:
+        producer: generates a question
+        size: questions generated ahead per key at most, QUIZ_POOL_SIZE by default. 0 disables the pool
+        max_workers: concurrent pre-generations
+        idle_seconds: QUIZ_POOL_IDLE_SECONDS by default
+    """
+
+    def __init__(self, producer: QuizQuestionProducer, size: int | None = None, max_workers: int = 4,
+                 idle_seconds: float | None = None):
+        self.producer = producer
+        self.size = size if size is not None else int(os.getenv("QUIZ_POOL_SIZE", DEFAULT_QUIZ_POOL_SIZE))
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(
+            os.getenv("QUIZ_POOL_IDLE_SECONDS", DEFAULT_QUIZ_POOL_IDLE_SECONDS))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quiz_pool")
+        self._lock = threading.Lock()
+        self._entries: dict[PoolKey, _PoolEntry] = {}
+        self._evicted_at = time.monotonic()
+
+    def pop(self, username: str, subject: str, topic: str, level: int):
+        """
+        Get a quiz question. Served from the buffer when there is one, otherwise generated right away.
+        """
+        key = (username, subject, topic, level)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _PoolEntry()
+            entry.last_used = now
+            entry.served += 1
+            question = entry.buffer.popleft() if entry.buffer else None
+            avoid = list(entry.recent)
+
+        if question is None:
+            question = self.producer(username, subject, topic, level, avoid)
+            with self._lock:
+                entry.recent.append(question.question)
+
+        self._refill(key, entry)
+        return question
+
+    def discard(self, username: str, subject: str, topic: str):
+        """
+        Drop the buffered questions of a user's topic, e.g. because its study guide or level changed.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[:3] == (username, subject, topic)]:
+                # Questions asked before are still avoided
+                self._entries[key] = _PoolEntry(self._entries[key].recent)
+
+    def buffered(self, username: str, subject: str, topic: str, level: int) -> int:
+        with self._lock:
+            entry = self._entries.get((username, subject, topic, level))
+            return len(entry.buffer) if entry else 0
+
+    def _evict_idle(self, now: float):
+        # Checking every key on every pop would be wasteful, idle keys can stay a little longer than idle_seconds
+        if now - self._evicted_at < self.idle_seconds / 10:
+            return
+        self._evicted_at = now
+        for key in [key for key, entry in self._entries.items() if now - entry.last_used > self.idle_seconds]:
+            del self._entries[key]
+
+    def _refill(self, key: PoolKey, entry: _PoolEntry):
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return
+            missing = min(self.size, entry.served) - len(entry.buffer) - entry.in_flight
+            if missing <= 0:
+                return
+            entry.in_flight += missing
+
+        for _ in range(missing):
+            self._executor.submit(self._produce, key, entry)
+
+    def _produce(self, key: PoolKey, entry: _PoolEntry):
+        try:
+            with self._lock:
+                avoid = list(entry.recent)
+            # Nobody waits for a pre-generated question yet, /quiz calls go first
+            with model_priority("background"):
+                question = self.producer(*key, avoid)
+            with self._lock:
+                entry.recent.append(question.question)
+                # Unless the key was discarded or evicted in the meantime
+                if self._entries.get(key) is entry:
+                    entry.buffer.append(question)
+        except Exception as e:
+            print(f"Failed to pre-generate quiz question for {key}: {e}")
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+
+
+if __name__ == "__main__":
+    import itertools
+    import statistics
+
+    from pydantic import BaseModel
+
+    LLM_SECONDS = 0.3
+    THINK_SECONDS = 0.3
+    REQUESTS = 50
+
+
+    class FakeQuizQuestion(BaseModel):
+        question: str
+        level: int
+
+
+    question_numbers = itertools.count(1)
+
+
+    def slow_producer(username: str, subject: str, topic: str, level: int, avoid: list[str]):
+        time.sleep(LLM_SECONDS)
+        question = FakeQuizQuestion(question=f"{topic} question {next(question_numbers)}", level=level)
+        assert question.question not in avoid
+        return question
+
+
+    def latencies(get_question) -> list[float]:
+        timings = []
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            get_question()
+            timings.append(time.perf_counter() - start)
+            time.sleep(THINK_SECONDS)
+        return timings
+
+
+    def report(label: str, timings: list[float]):
+        percentiles = statistics.quantiles(timings, n=100)
+        print(f"{label:>12}: p50 {percentiles[49] * 1000:.1f} ms, p99 {percentiles[98] * 1000:.1f} ms")
+
+
+    report("without pool", latencies(lambda: slow_producer("alice", "Algorithms", "Sorting", 1, [])))
+
+    produced = []
+    counting_producer = lambda *args: produced.append(args[:4]) or slow_producer(*args)
+    pool = QuizQuestionPool(counting_producer, size=2)
+    # A student who leaves after the first question costs one question generated ahead
+    pool.pop("bob", "Algorithms", "Sorting", 1)
+    time.sleep(LLM_SECONDS * 2)
+    assert len(produced) == 2 and pool.buffered("bob", "Algorithms", "Sorting", 1) == 1, produced
+
+    # One more question is generated ahead for every question, up to size
+    pool.pop("alice", "Algorithms", "Sorting", 1)
+    pool.pop("alice", "Algorithms", "Sorting", 1)
+    time.sleep(LLM_SECONDS * 3)
+    assert pool.buffered("alice", "Algorithms", "Sorting", 1) == 2
+    report("with pool", latencies(lambda: pool.pop("alice", "Algorithms", "Sorting", 1)))
+
+    # A new study guide or level discards buffered questions, including the ones being generated
+    pool.discard("alice", "Algorithms", "Sorting")
+    assert pool.buffered("alice", "Algorithms", "Sorting", 1) == 0
+    time.sleep(LLM_SECONDS * 3)
+    assert pool.buffered("alice", "Algorithms", "Sorting", 1) == 0
+
+    # Keys that are not used anymore are evicted
+    pool.idle_seconds = 0.1
+    time.sleep(0.2)
+    pool.pop("carol", "Algorithms", "Sorting", 1)
+    assert set(pool._entries) == {("carol", "Algorithms", "Sorting", 1)}, set(pool._entries)
+    print("OK")
@@ -1,16 +1,21 @@
+import hashlib
+import re
 import sqlite3
 from pathlib import Path
 from typing import Literal
 
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import AnyMessage
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
 from langgraph.graph.graph import CompiledGraph
 from langgraph.prebuilt import create_react_agent
-from openai import OpenAI
 from pydantic import BaseModel, Field
 
 from agents.instruction_reader import get_instructions
+from services.db_pool import DB_PATH, read_connection
+from services.models import get_model
+from services.study_guide_cache import StudyGuideCache, cache_key
+from services.tts import get_audio_synthesizer
 
 
 class StudyGuide(BaseModel):
@@ -19,27 +24,33 @@ class StudyGuide(BaseModel):
     agent_comment: str = Field(..., description="A comment from the agent.")
 
 
+STUDY_GUIDE_REQUEST = "Search the book passages and then Generate a study guide for subject=`{subject_name}` and topic=`{topic_name}`. The study style will be {study_guide_style} and the person will read it. Make sure to update the current study guide to reflect weaknesses in the Progress summary. But don't refer to them as weaknesses, call them Focus Areas. You don't need to generate a new subsection, can address focus areas inline"
+# Study guides with a progress summary are written for one user, the agent creates the podcast's audio for them
+USER_STUDY_GUIDE_REQUEST = "For user=`{username}`, " + STUDY_GUIDE_REQUEST
+# Study guides without one are shared through the cache, so they must not depend on the user. Their audio is created
+# for every user from the study guide text
+SHARED_STUDY_GUIDE_REQUEST = STUDY_GUIDE_REQUEST + ". Don't create an audio file"
+
 study_guide_builder_agent: CompiledGraph | None = None
+study_guide_builder_model: str | None = None
+study_guide_cache: StudyGuideCache | None = None
 db_schema = None
 
 
+def write_audio_file(username: str, subject_name: str, topic_name: str, text: str) -> str:
+    """
+    Write the user's audio of a study guide, returns its location.
+    """
+    # Paragraphs that were spoken before, e.g. in the previous version of the study guide, come from the audio cache
+    speech_file_path = f"audio/{username}_{subject_name}_{topic_name}.mp3"
+    get_audio_synthesizer().synthesize(text, str(Path.cwd() / speech_file_path))
+    return speech_file_path
+
+
 @tool
 def create_audio_file(username: str, subject_name: str, topic_name: str, text: str):
     """create audio file for podcast style study guide"""
-    client = OpenAI()
-
-    with client.audio.speech.with_streaming_response.create(
-            model="gpt-4o-mini-tts",
-            voice="fable",
-            input=text,
-            instructions="Speak in an engaging way but also stay calm to give the listener confidence."
-            ,
-    ) as response:
-        # TODO: pass in a callback for writing to a file
-        speech_file_path = f"audio/{username}_{subject_name}_{topic_name}.mp3"
-        print(f"Writing audio to {speech_file_path}")
-        response.stream_to_file(Path.cwd() / speech_file_path)
-    return speech_file_path
+    return write_audio_file(username, subject_name, topic_name, text)
 
 
 @tool
@@ -52,41 +63,126 @@ def query_database(query: str):
     if not query.strip().lower().startswith("select") and not query.strip().lower().startswith("pragma"):
         raise ValueError("Only SELECT queries are allowed.")
 
-    conn = sqlite3.connect("study_material.db")
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
-    except sqlite3.Error as e:
-        print(f"SQLite error: {e}")
-        result = []
-    finally:
-        conn.close()
+    with read_connection() as conn:
+        try:
+            result = conn.execute(query).fetchall()
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+            result = []
 
     return result
 
 
-def init_study_guide_builder_agent():
+def search_passages(query: str, subject: str = "", topic: str = "", k: int = 5,
+                    db_path: str = DB_PATH) -> list[dict]:
+    """
+    Full-text search over the indexed book passages, best matches first.
+    Args:
+        query: free text search query
+        subject: optional subject to restrict the search to
+        topic: optional topic to restrict the search to
+        k: maximum number of passages to return
+        db_path: location of the study material database
+    """
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return []
+    match = " OR ".join(f'"{term}"' for term in terms)
+
+    sql = "SELECT book_title, authors, subject, topic, passage FROM passages WHERE passages MATCH ?"
+    params: list = [match]
+    if subject:
+        sql += " AND subject = ?"
+        params.append(subject)
+    if topic:
+        sql += " AND topic = ?"
+        params.append(topic)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(k)
+
+    with read_connection(db_path) as conn:
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+            rows = []
+
+    return [
+        {"book_title": book_title, "authors": authors, "subject": subject, "topic": topic, "passage": passage}
+        for book_title, authors, subject, topic, passage in rows
+    ]
+
+
+@tool
+def search_book_passages(query: str, subject: str = "", topic: str = "", k: int = 5):
+    """
+    Use this tool to get book contents. Returns the top k passages that best match the query,
+    with the book title and authors to cite. Filter by subject and topic whenever you know them.
+    """
+    return search_passages(query, subject, topic, k)
+
+
+def passages_fingerprint(subject: str, topic: str, db_path: str = DB_PATH) -> str:
+    """
+    Hash of the book passages of a topic, it changes when the study material of the topic changes.
+    """
+    digest = hashlib.sha256()
+    with read_connection(db_path) as conn:
+        rows = conn.execute("SELECT book_title, authors, passage FROM passages WHERE subject = ? AND topic = ? "
+                            "ORDER BY rowid", (subject, topic))
+        for row in rows:
+            digest.update("\0".join(str(column) for column in row).encode("utf-8"))
+            digest.update(b"\1")
+    return digest.hexdigest()
+
+
+def init_study_guide_builder_agent(llm: BaseChatModel | None = None, cache: StudyGuideCache | None = None):
     """
     Initialize the study guide builder agent by giving it llm, tools, and prompt.
     (prompt seems to be not processed correctly, so we will pass it in later as well)
+    Args:
+        llm: chat model of the agent, gpt-4o by default
+        cache: cache of study guides shared between users
     """
-    global study_guide_builder_agent, db_schema
+    global study_guide_builder_agent, study_guide_builder_model, study_guide_cache, db_schema
     db_schema = query_database("SELECT sql FROM sqlite_master WHERE type='table'")
-    tools = [create_audio_file, query_database]
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    tools = [create_audio_file, search_book_passages, query_database]
+    llm = llm or get_model("study_guide_builder")
+    study_guide_builder_model = getattr(llm, "model_name", None) or llm._llm_type
+    study_guide_cache = cache or StudyGuideCache()
     prompt = get_instructions("study_guide_builder_react_prompt")
     study_guide_builder_agent = create_react_agent(
         llm, tools, response_format=StudyGuide,
         prompt=prompt)
 
 
+def study_guide_version(subject_name: str, topic_name: str) -> str:
+    """
+    Hash of what a study guide of the topic is generated from: the model, the prompts and the book passages.
+    Study guides generated with another version are stale.
+    Args:
+        subject_name: The subject of the study guide.
+        topic_name: The topic of the study guide.
+    """
+    if study_guide_builder_agent is None:
+        init_study_guide_builder_agent()
+
+    return cache_key({
+        "model": study_guide_builder_model,
+        "prompt": get_instructions("study_guide_builder_react_prompt", db_schema=db_schema),
+        "request": [USER_STUDY_GUIDE_REQUEST, SHARED_STUDY_GUIDE_REQUEST],
+        "passages": passages_fingerprint(subject_name, topic_name),
+    })
+
+
 def invoke_study_guide_builder_agent(username: str, subject_name: str, topic_name: str, progress_summary: str,
                                      context: list[AnyMessage],
-                                     study_guide_style: Literal["textbook", "podcast"]) -> StudyGuide:
+                                     study_guide_style: Literal["textbook", "podcast"], level: int = 1) -> StudyGuide:
     """
     Invoke the study guide builder agent to generate a study guide.
+    Study guides of students without progress only depend on the topic, they are shared through the study guide cache:
+    they are generated without the user's name and conversation, and only their text is cached. Every user gets their
+    own audio of a shared podcast study guide.
     Args:
         username: The username for whom the study guide is being generated.
         subject_name: The subject of the study guide.
@@ -94,15 +190,32 @@ def invoke_study_guide_builder_agent(username: str, subject_name: str, topic_nam
         progress_summary: The progress summary of the user, subject, topic combo.
         context: The context of the conversation.
         study_guide_style: The style of the study guide (textbook or podcast).
+        level: The level of the user in the topic.
     """
     if study_guide_builder_agent is None:
         init_study_guide_builder_agent()
 
     prompt = get_instructions("study_guide_builder_react_prompt", db_schema=db_schema)
-    messages = [{"role": "system", "content": prompt}] + context + [
+    shared = not progress_summary
+    if shared:
+        key = cache_key({
+            "subject": subject_name, "topic": topic_name, "style": study_guide_style, "level": level,
+            "version": study_guide_version(subject_name, topic_name),
+        })
+        cached = study_guide_cache.get(key)
+        print(f"Study guide cache {'hit' if cached else 'miss'} for {subject_name}/{topic_name}: "
+              f"{study_guide_cache.stats()}")
+        if cached:
+            return _with_user_audio(StudyGuide(study_guide_text=cached["study_guide_text"], audio_file_location="",
+                                               agent_comment=cached.get("agent_comment", "")),
+                                    username, subject_name, topic_name, study_guide_style)
+
+    request = SHARED_STUDY_GUIDE_REQUEST if shared else USER_STUDY_GUIDE_REQUEST
+    messages = [{"role": "system", "content": prompt}] + ([] if shared else context) + [
         {"role": "user", "content": f"Progress summary: {progress_summary}"},
         {"role": "user",
-         "content": f"For user=`{username}`, Get book contents from the database and then Generate a study guide for subject=`{subject_name}` and topic=`{topic_name}`. The study style will be {study_guide_style} and the person will read it. Make sure to update the current study guide to reflect weaknesses in the Progress summary. But don't refer to them as weaknesses, call them Focus Areas. You don't need to generate a new subsection, can address focus areas inline"},
+         "content": request.format(username=username, subject_name=subject_name, topic_name=topic_name,
+                                   study_guide_style=study_guide_style)},
     ]
 
     stream = study_guide_builder_agent.stream({"messages": messages}, stream_mode="values")
@@ -111,7 +224,23 @@ def invoke_study_guide_builder_agent(username: str, subject_name: str, topic_nam
     for state_update in stream:
         state_update["messages"][-1].pretty_print()
 
-    return state_update.get("structured_response")
+    response = state_update.get("structured_response")
+    if shared and response:
+        study_guide_cache.put(key, response.model_dump(include={"study_guide_text", "agent_comment"}))
+        response = _with_user_audio(response.model_copy(update={"audio_file_location": ""}),
+                                    username, subject_name, topic_name, study_guide_style)
+    return response
+
+
+def _with_user_audio(study_guide: StudyGuide, username: str, subject_name: str, topic_name: str,
+                     study_guide_style: Literal["textbook", "podcast"]) -> StudyGuide:
+    """
+    Give the user their own audio of a shared podcast study guide.
+    """
+    if study_guide_style != "podcast":
+        return study_guide
+    audio_file_location = write_audio_file(username, subject_name, topic_name, study_guide.study_guide_text)
+    return study_guide.model_copy(update={"audio_file_location": audio_file_location})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Protocol
+
+from agents.study_guide_builder_react import study_guide_version
+from model.tutor import TutorContent
+from services.user_registry import UserRegistry, get_user_registry
+
+DEFAULT_REGENERATION_WORKERS = 4
+DEFAULT_REGENERATION_RATE = 2.0
+DEFAULT_REGENERATION_RETRIES = 2
+DEFAULT_RETRY_BACKOFF_SECONDS = 1.0
+# Only the first errors are kept for the report
+MAX_REPORTED_ERRORS = 20
+
+
+class StudyGuideOwner(Protocol):
+    """
+    What the regeneration needs from the study guide supervisor.
+    """
+
+    def get_tutor_content(self, username: str) -> TutorContent: ...
+
+    def regenerate_study_guide(self, username: str, subject: str, topic: str) -> str: ...
+
+
+class StaleStudyGuide(NamedTuple):
+    username: str
+    subject: str
+    topic: str
+
+
+class RegenerationProgress:
+    """
+    Counters of a regeneration run, safe to read while the run is going.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+        self.stopped = False
+        self.errors: list[str] = []
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, guide: StaleStudyGuide, error: Exception | None):
+        with self._lock:
+            if error is None:
+                self.done += 1
+            else:
+                self.failed += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append(f"{guide.username}/{guide.subject}/{guide.topic}: {error}")
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            finished = self.done + self.failed
+            return {"total": self.total, "done": self.done, "failed": self.failed, "retries": self.retries,
+                    "remaining": self.total - finished, "stopped": self.stopped, "elapsed_seconds": elapsed,
+                    "per_second": finished / elapsed if elapsed else 0.0, "errors": list(self.errors)}
+
+
+class _Throttle:
+    """
+    Spaces out the starts of regenerations so that there are at most rate_per_second per second, across threads.
+    """
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+class StudyGuideRegenerator:
+    """
+    Regenerates the study guides that were generated with an older study_guide_version, e.g. after the book corpus or
+    the prompts changed. Stale study guides are found by reading every registered user's agent state from the
+    checkpointer, and regenerated on a pool of max_workers threads, at most rate_per_second starting per second, each
+    retried with exponential backoff. A regenerated study guide is stored with the current version, so running again
+    after an interruption resumes with the study guides that are still stale.
+    Args:
+        supervisor: the study guide supervisor that owns the users' study guides
+        registry: registry of the users, the process wide registry by default
+        max_workers: REGENERATION_WORKERS by default
+        rate_per_second: REGENERATION_RATE by default, 0 disables the rate limit
+        retries: REGENERATION_RETRIES by default
+        retry_backoff_seconds: wait before the first retry, doubled for every further retry
+        version: current version of a subject and topic's study guides, study_guide_version by default
+    """
+
+    def __init__(self, supervisor: StudyGuideOwner, registry: UserRegistry | None = None,
+                 max_workers: int | None = None, rate_per_second: float | None = None, retries: int | None = None,
+                 retry_backoff_seconds: float = DEFAULT_RETRY_BACKOFF_SECONDS,
+                 version: Callable[[str, str], str] | None = None):
+        self.supervisor = supervisor
+        self.version = version or study_guide_version
+        self.registry = registry or get_user_registry()
+        self.max_workers = max_workers or int(os.getenv("REGENERATION_WORKERS", DEFAULT_REGENERATION_WORKERS))
+        self.rate_per_second = rate_per_second if rate_per_second is not None else float(
+            os.getenv("REGENERATION_RATE", DEFAULT_REGENERATION_RATE))
+        self.retries = retries if retries is not None else int(
+            os.getenv("REGENERATION_RETRIES", DEFAULT_REGENERATION_RETRIES))
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self._stop = threading.Event()
+
+    def find_stale(self, subjects: list[str] | None = None, topics: list[str] | None = None,
+                   force: bool = False) -> list[StaleStudyGuide]:
+        """
+        Study guides of all users that were not generated with the current version.
+        Args:
+            subjects: only these subjects, all by default
+            topics: only these topics, all by default
+            force: also study guides that are up to date
+        """
+        versions: dict[tuple[str, str], str] = {}
+        stale = []
+        for username, _ in self.registry.users():
+            tutor_content = self.supervisor.get_tutor_content(username)
+            if not tutor_content:
+                continue
+            for subject in tutor_content.subjects.values():
+                if subjects and subject.name not in subjects:
+                    continue
+                for topic in subject.topics.values():
+                    if not topic.study_guide or (topics and topic.name not in topics):
+                        continue
+                    key = (subject.name, topic.name)
+                    if key not in versions:
+                        versions[key] = self.version(*key)
+                    if force or topic.study_guide_version != versions[key]:
+                        stale.append(StaleStudyGuide(username, subject.name, topic.name))
+        return stale
+
+    def run(self, subjects: list[str] | None = None, topics: list[str] | None = None, force: bool = False,
+            on_progress: Callable[[dict], None] | None = None) -> dict:
+        """
+        Regenerate the stale study guides.
+        Args:
+            subjects: only these subjects, all by default
+            topics: only these topics, all by default
+            force: also study guides that are up to date
+            on_progress: called with the progress after every study guide
+        Returns:
+            the final progress
+        """
+        self._stop.clear()
+        stale = self.find_stale(subjects, topics, force)
+        progress = RegenerationProgress(len(stale))
+        print(f"Regenerating {len(stale)} stale study guides with {self.max_workers} workers")
+        throttle = _Throttle(self.rate_per_second)
+
+        def regenerate(guide: StaleStudyGuide):
+            if self._stop.is_set():
+                return
+            progress.record(guide, self._regenerate_with_retries(guide, throttle, progress))
+            if on_progress:
+                on_progress(progress.to_dict())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="regeneration") as executor:
+            list(executor.map(regenerate, stale))
+
+        progress.stopped = self._stop.is_set()
+        result = progress.to_dict()
+        print(f"Regenerated {result['done']} of {result['total']} study guides, {result['failed']} failed, "
+              f"in {result['elapsed_seconds']:.1f}s")
+        return result
+
+    def stop(self):
+        """
+        Stop a running regeneration after the study guides that are being regenerated.
+        """
+        self._stop.set()
+
+    def _regenerate_with_retries(self, guide: StaleStudyGuide, throttle: _Throttle,
+                                 progress: RegenerationProgress) -> Exception | None:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                progress.record_retry()
+                time.sleep(self.retry_backoff_seconds * 2 ** (attempt - 1))
+            throttle.wait()
+            try:
+                self._regenerate(guide)
+                return None
+            except Exception as e:
+                print(f"Regenerating {guide} failed (attempt {attempt + 1}): {e}")
+                error = e
+        return error
+
+    def _regenerate(self, guide: StaleStudyGuide):
+        self.supervisor.regenerate_study_guide(guide.username, guide.subject, guide.topic)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    from model.tutor import Topic, Subject
+
+    USERS = 5000
+
+
+    def current_version(subject: str, topic: str) -> str:
+        """
+        The current version, without reading the book passages.
+        """
+        return f"v2:{subject}/{topic}"
+
+
+    class FakeSupervisor:
+        def __init__(self):
+            self.contents: dict[str, TutorContent] = {}
+            self.failed: set[str] = set()
+            self.lock = threading.Lock()
+
+        def get_tutor_content(self, username: str) -> TutorContent:
+            return self.contents.get(username)
+
+        def regenerate_study_guide(self, username: str, subject: str, topic: str) -> str:
+            # The first attempt for every 7th user is rate limited
+            with self.lock:
+                fail = int(username.split("-")[1]) % 7 == 0 and username not in self.failed
+                self.failed.add(username)
+            if fail:
+                raise RuntimeError("429 Too Many Requests")
+            current_topic = self.contents[username].find_or_create_topic(subject, topic)
+            current_topic.study_guide = f"New {current_topic.study_guide_style} guide at level {current_topic.level}"
+            current_topic.study_guide_version = current_version(subject, topic)
+            return current_topic.study_guide
+
+
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = UserRegistry(str(Path(tmp) / "checkpoints.db"))
+        supervisor = FakeSupervisor()
+        for i in range(USERS):
+            registry.get_thread_id(f"user-{i}")
+            topics = {"Heap": Topic(name="Heap", study_guide="Old guide", study_guide_version="v1", level=3,
+                                    study_guide_style="podcast"),
+                      "Stack": Topic(name="Stack", study_guide="Current guide", study_guide_version="v2:DS/Stack"),
+                      "Queue": Topic(name="Queue")}
+            supervisor.contents[f"user-{i}"] = TutorContent(subjects={"DS": Subject(name="DS", topics=topics)})
+        registry.get_thread_id("user-without-state")
+
+        regenerator = StudyGuideRegenerator(supervisor, registry, max_workers=8, rate_per_second=0, retries=2,
+                                            retry_backoff_seconds=0.001, version=current_version)
+        assert len(regenerator.find_stale()) == USERS, "Only stale study guides that exist are regenerated"
+        assert len(regenerator.find_stale(force=True)) == 2 * USERS
+        assert regenerator.find_stale(topics=["Stack"]) == []
+
+        # Stopped half way, the next run resumes with the rest
+        half = USERS // 2
+        first = regenerator.run(on_progress=lambda progress: progress["done"] >= half and regenerator.stop())
+        assert first["stopped"] and half <= first["done"] < USERS and first["retries"] > 0, first
+        second = regenerator.run()
+        assert second["total"] == USERS - first["done"] and second["done"] == second["total"], second
+        assert regenerator.find_stale() == []
+        assert supervisor.contents["user-1"].subjects["DS"].topics["Heap"].study_guide == "New podcast guide at level 3"
+
+        # Study guides that keep failing are reported
+        supervisor.regenerate_study_guide = lambda username, subject, topic: 1 / 0
+        failing = StudyGuideRegenerator(supervisor, registry, max_workers=8, rate_per_second=0, retries=1,
+                                        retry_backoff_seconds=0.001, version=current_version).run(topics=["Stack"],
+                                                                                                   force=True)
+        assert failing["failed"] == USERS and failing["retries"] == USERS
+        assert len(failing["errors"]) == MAX_REPORTED_ERRORS
+
+        throttle = _Throttle(rate_per_second=100)
+        start = time.perf_counter()
+        for _ in range(11):
+            throttle.wait()
+        assert time.perf_counter() - start >= 0.1
+    print("OK")
@@ -1,33 +1,37 @@
-from typing import Literal, TypedDict, NotRequired, TypeAlias
+import os
+import threading
+import time
+from typing import Callable, Literal, TypedDict, NotRequired, TypeAlias
 
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, AIMessageChunk
+from langchain_core.runnables import RunnableConfig
 from langchain_google_vertexai import ChatVertexAI
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import END, START
 from langgraph.graph import StateGraph, MessagesState
 from langgraph.types import Command
 from pydantic import BaseModel, Field
 
 from agents.instruction_reader import get_instructions
-from agents.study_guide_builder_react import invoke_study_guide_builder_agent
+from agents.intent_router import IntentRouter, EXPLAIN_REQUEST
+from agents.members import STUDY_GUIDE_BUILDER, EXISTING_STUDY_GUIDE, QUIZ_QUESTION_BUILDER, QUIZ_GRADER, \
+    GENERAL_CHAT_AGENT, members
+from agents.quiz_pool import QuizQuestionPool
+from agents.message_compaction import CompactionPolicy, compact_messages, message_stats
+from agents.study_guide_builder_react import invoke_study_guide_builder_agent, study_guide_version
 from agents.user_store import get_thread_id, default_tutor_content
 from model.tutor import TutorContent
-from services.agent_pub_sub import update_quiz_question, QuizQuestionEvent, listen_to_study_progress, StudyProgressEvent
-
-# This will listen to study_progress topic and call the endpoint specified
-listen_to_study_progress("http://localhost:5005/agent/update_study_guides")
-
-# Define deterministic routes for each member
-STUDY_GUIDE_BUILDER = "study_guide_builder"
-EXISTING_STUDY_GUIDE = "existing_study_guide"
-QUIZ_QUESTION_BUILDER = "quiz_question_builder"
-QUIZ_GRADER = "quiz_grader"
-GENERAL_CHAT_AGENT = "general_chat_agent"
-members = [STUDY_GUIDE_BUILDER, QUIZ_QUESTION_BUILDER, QUIZ_GRADER, EXISTING_STUDY_GUIDE, GENERAL_CHAT_AGENT]
+from services.checkpointer import get_checkpointer
+from services.explanation_cache import ExplanationCache
+from services.governor import model_priority
+from services.models import get_model
+from services.single_flight import SingleFlight
+from services.agent_pub_sub import update_quiz_question, QuizQuestionEvent, StudyProgressEvent
 
 options = members + ["FINISH"]
 
+GENERAL_CHAT_SYSTEM_PROMPT = "You are a helpful assistant. You are providing responses to user inquires based on the study guide and other information that you have."
+QUIZ_QUESTION_SYSTEM_PROMPT = "You are providing a multiple choice question for a study guide mentioned earlier. You will provide 4 options and the correct answer. But do not repeat questions. Every time come up with a new question. For math questions use numbers and symbols more than words, but throw in a word problem sometimes."
+
 
 class QuizQuestion(BaseModel):
     """
@@ -68,21 +72,47 @@ class State(MessagesState):
     progress_summary: NotRequired[str]
 
 
+def _is_answer_token(message, metadata: dict, node: str, model_node: str | None = None) -> bool:
+    """
+    Whether a chunk of the graph's "messages" stream is a token of the answer written by a node. Tool calls and
+    structured responses have no text content, and other nodes' models run outside the node's namespace.
+    Args:
+        message: message chunk of the stream
+        metadata: metadata of the chunk
+        node: node of the supervisor graph that writes the answer
+        model_node: node that calls the model when node runs an agent of its own
+    """
+    return (isinstance(message, AIMessageChunk) and isinstance(message.content, str) and bool(message.content)
+            and metadata.get("langgraph_node") == (model_node or node)
+            and metadata.get("langgraph_checkpoint_ns", "").startswith(f"{node}:"))
+
+
 class StudyGuideSupervisorAgent:
     """
     This agent is responsible for creating study guides, quiz questions, and grading quiz questions.
     """
 
-    def __init__(self):
+    def __init__(self, compaction_policy: CompactionPolicy | None = None, router: IntentRouter | None = None,
+                 explanation_cache: ExplanationCache | None = None):
         self.supervisor_prompt = get_instructions("study_guide_supervisor", members=members)
-
-        # Setup persistence
-        checkpointer = MemorySaver()
-
-        self.model = ChatOpenAI(model="gpt-4o")
+        # Common requests are routed by keyword rules, LOCAL_ROUTER=false sends every request to the LLM router
+        self.router = router or (IntentRouter() if os.getenv("LOCAL_ROUTER", "true").lower() == "true" else None)
+        self.compaction_policy = compaction_policy or CompactionPolicy.from_env()
+        self.quiz_pool = QuizQuestionPool(self.generate_quiz_question)
+        self.explanation_cache = explanation_cache or ExplanationCache()
+        # Identical concurrent study guide requests share one graph run
+        self._single_flight = SingleFlight()
+        self._thread_locks: dict[int, threading.Lock] = {}
+        self._thread_locks_lock = threading.Lock()
+
+        # Setup persistence, shared with the other agents and worker processes
+        checkpointer = get_checkpointer()
+
+        self.model = get_model("supervisor")
         # self.model = ChatVertexAI(model_name="gemini-2.0-flash-001", location='us-west1')
         builder = StateGraph(State)
         builder.add_node("init_data", self.init_data)
+        builder.add_node("compact_history", self.compact_history)
         builder.add_node("supervisor", self.supervisor_node)
         builder.add_node(self.study_guide_builder)
         builder.add_node(self.existing_study_guide)
@@ -91,7 +121,8 @@ class StudyGuideSupervisorAgent:
         builder.add_node(self.general_chat_agent)
         builder.add_node(self.publish_quiz_question)
         builder.add_edge(START, "init_data")
-        builder.add_edge("init_data", "supervisor")
+        builder.add_edge("init_data", "compact_history")
+        builder.add_edge("compact_history", "supervisor")
         builder.add_edge("quiz_grader", "publish_quiz_question")
         builder.add_conditional_edges("existing_study_guide", self.has_study_guide,
                                       {True: END, False: "study_guide_builder"})
@@ -109,19 +140,42 @@ class StudyGuideSupervisorAgent:
         else:
             return {"tutor_content": default_tutor_content()}
 
+    def compact_history(self, state: State, config: RunnableConfig):
+        """
+        This node removes old messages according to the compaction policy, so that the LLM calls that follow
+        don't grow with how long the student has used the app.
+        """
+        messages = state["messages"]
+        removals = compact_messages(messages, self.compaction_policy)
+        before = message_stats(messages)
+        removed_ids = {removal.id for removal in removals}
+        after = message_stats([message for message in messages if message.id not in removed_ids])
+        print(f"Thread {config['configurable']['thread_id']}: {before['message_count']} messages "
+              f"(~{before['token_estimate']} tokens) compacted to {after['message_count']} messages "
+              f"(~{after['token_estimate']} tokens)")
+
+        return {"messages": removals}
+
     def supervisor_node(self, state: State) -> Command[Literal[*members, "__end__"]]:
         """
         This node routes our request to sub agents. Although most are just LLM driven at this point, but should probably be
         properly encapsulated agents.
         """
         # This allows using deterministic routing, but keeping
-        if state["messages"][-1].content in members:
-            goto = state["messages"][-1].content
+        content = state["messages"][-1].content
+        decision = self.router.route(content) if self.router and content not in members else None
+        if content in members:
+            goto = content
+        elif decision:
+            goto = decision.next
         else:
             messages = [
                            {"role": "system", "content": self.supervisor_prompt},
                        ] + state["messages"]
-            response = self.model.with_structured_output(Route).invoke(messages)
+            start = time.perf_counter()
+            response = get_model("supervisor", Route).invoke(messages)
+            if self.router:
+                self.router.record_fallback(time.perf_counter() - start)
             goto = response["next"]
 
         if goto == "FINISH":
@@ -165,19 +219,24 @@ class StudyGuideSupervisorAgent:
 
     def study_guide_builder(self, state: State) -> Command[Literal["supervisor", END]]:
         """Generate a study guide for a given subject and topic."""
+        # Loads up the tutor content data for the user into the state. Should move to init_data
+        tutor_content = state.get("tutor_content", TutorContent(subjects={}))
+        topic = tutor_content.find_or_create_topic(state["subject"], state["topic"])
+
+        study_guide_style = state.get("study_guide_style", "textbook")
         response = invoke_study_guide_builder_agent(
             state["username"],
             state["subject"],
             state["topic"],
             state.get("progress_summary"),
             state["messages"],
-            state.get("study_guide_style", "textbook")
+            study_guide_style,
+            state.get("level") or topic.level
         )
 
-        # Loads up the tutor content data for the user into the state. Should move to init_data
-        tutor_content = state.get("tutor_content", TutorContent(subjects={}))
-        topic = tutor_content.find_or_create_topic(state["subject"], state["topic"])
         topic.study_guide = response.study_guide_text
+        topic.study_guide_version = study_guide_version(state["subject"], state["topic"])
+        topic.study_guide_style = study_guide_style
         topic.audio_file_location = response.audio_file_location
         # Update level when building study guide after progress update
         if state.get("level"):
@@ -190,7 +249,8 @@ class StudyGuideSupervisorAgent:
                 "audio_file_location": topic.audio_file_location,
                 "level": topic.level,
                 "messages": [
-                    HumanMessage(content="The following message is from study_guide_builder",
+                    HumanMessage(content=f"The following message is from study_guide_builder for subject: "
+                                         f"{state['subject']}, topic: {state['topic']}",
                                  name="study_guide_builder"),
                     HumanMessage(content=topic.study_guide, name="study_guide_builder")
                 ]
@@ -202,15 +262,13 @@ class StudyGuideSupervisorAgent:
         """
         Generate a quiz question when requested
         """
-        system_prompt = "You are providing a multiple choice question for a study guide mentioned earlier. You will provide 4 options and the correct answer. But do not repeat questions. Every time come up with a new question. For math questions use numbers and symbols more than words, but throw in a word problem sometimes."
         messages = [
-                       {"role": "system", "content": system_prompt},
+                       {"role": "system", "content": QUIZ_QUESTION_SYSTEM_PROMPT},
                    ] + state["messages"]
         messages.append({"role": "user", "content": f"Given the study guide: {state['study_guide']}"})
         messages.append({"role": "user",
                          "content": f"Create a quiz question for the study guide. Make the difficulty level {state.get('level')} out of 10"})
-        model = ChatOpenAI(model="gpt-4o")
-        model = model.with_structured_output(QuizQuestion)
+        model = get_model("quiz_question_builder", QuizQuestion)
 
         question = model.invoke(messages)
 
@@ -234,7 +292,7 @@ class StudyGuideSupervisorAgent:
                    ] + state["messages"]
         messages.append(
             {"role": "user", "content": "Provide an explanation for this question: " + state["question_to_grade"]})
-        model = ChatOpenAI(model="gpt-4o", temperature=0)
+        model = get_model("quiz_grader")
 
         explanation_response = model.invoke(messages)
 
@@ -249,12 +307,11 @@ class StudyGuideSupervisorAgent:
 
     def general_chat_agent(self, state: State) -> Command[Literal["supervisor"]]:
         """Can respond to miscellaneous questions and other inquires"""
-        system_prompt = "You are a helpful assistant. You are providing responses to user inquires based on the study guide and other information that you have."
         messages = [
-                       {"role": "system", "content": system_prompt},
+                       {"role": "system", "content": GENERAL_CHAT_SYSTEM_PROMPT},
                    ] + state["messages"]
 
-        model = ChatOpenAI(model="gpt-4o", temperature=0.2)
+        model = get_model("general_chat_agent")
 
         chat_response = model.invoke(messages)
 
@@ -280,7 +337,8 @@ class StudyGuideSupervisorAgent:
         return Command(goto=END)
 
     def find_existing_study_guide_or_create(self, username: str, subject: str, topic: str,
-                                            style: StudyGuidStyleType) -> State:
+                                            style: StudyGuidStyleType,
+                                            on_token: Callable[[str], None] | None = None) -> State:
         """
         Entry point for deterministic route to find an existing study guide or to create it.
         Args:
@@ -288,26 +346,89 @@ class StudyGuideSupervisorAgent:
             subject: subject of the study guide
             topic: topic of the study guide
             style: style of the study guide
+            on_token: called with the tokens of a study guide while it is being created. Callers that join a request
+                already in flight only get the result
         """
-        config = {"configurable": {"thread_id": get_thread_id(username)}}
-        final_state = self.graph.invoke({
-            "username": username, "subject": subject, "topic": topic, "study_guide_style": style,
-            "messages": [{"role": "user", "content": EXISTING_STUDY_GUIDE}]
-        }, config)
+        thread_id = get_thread_id(username)
+        return self._single_flight.do((thread_id, EXISTING_STUDY_GUIDE, subject, topic),
+                                      self._find_existing_study_guide_or_create, thread_id, username, subject, topic,
+                                      style, on_token)
+
+    def _find_existing_study_guide_or_create(self, thread_id: int, username: str, subject: str, topic: str,
+                                             style: StudyGuidStyleType,
+                                             on_token: Callable[[str], None] | None = None) -> State:
+        # Waits for an update of the user's study guides, after which the study guide is found instead of rebuilt
+        with self._thread_lock(thread_id):
+            built = not self.has_existing_study_guide(username, subject, topic)
+            config = {"configurable": {"thread_id": thread_id}}
+            graph_input = {
+                "username": username, "subject": subject, "topic": topic, "study_guide_style": style,
+                "messages": [{"role": "user", "content": EXISTING_STUDY_GUIDE}]
+            }
+            # The builder's react agent calls the model from its "agent" node
+            final_state = self._invoke_streaming(graph_input, config, on_token, STUDY_GUIDE_BUILDER, "agent")
+        # Questions generated ahead, before there was a study guide, didn't have one to ask about
+        if built:
+            self.quiz_pool.discard(username, subject, topic)
         # TODO: if style == "podcast" and no audio file, ask to create one again
 
         return final_state
 
-    def build_quiz_question(self, username: str) -> QuizQuestion:
+    def _thread_lock(self, thread_id: int) -> threading.Lock:
+        """
+        Graph runs of a thread go one at a time. Parallel runs, e.g. two quiz answers graded at once, would start from
+        the same checkpoint and the last one to finish would overwrite the other's messages and study guides.
+        """
+        with self._thread_locks_lock:
+            return self._thread_locks.setdefault(thread_id, threading.Lock())
+
+    def generate_quiz_question(self, username: str, subject: str, topic: str, level: LevelType,
+                               avoid: list[str]) -> QuizQuestion:
         """
-        Entry point for deterministic route to build a quiz question
+        Generates a quiz question for the user's study guide outside of the graph. This is the producer of the quiz
+        question pool, so pre-generated questions don't end up in the message history.
         Args:
             username: need to load state of the agent
+            subject: subject of the study guide
+            topic: topic of the study guide
+            level: difficulty level of the question
+            avoid: questions that were already asked or pre-generated
         """
-        config = {"configurable": {"thread_id": get_thread_id(username)}}
-        final_state = self.graph.invoke({
-            "messages": [{"role": "user", "content": QUIZ_QUESTION_BUILDER}]
-        }, config)
+        tutor_content = self.get_tutor_content(username)
+        study_guide = tutor_content.find_or_create_topic(subject, topic).study_guide if tutor_content else ""
+        messages = [
+            {"role": "system", "content": QUIZ_QUESTION_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Given the study guide: {study_guide}"},
+        ]
+        if avoid:
+            messages.append({"role": "user", "content": "Do not repeat any of these questions:\n" + "\n".join(avoid)})
+        messages.append({"role": "user",
+                         "content": f"Create a quiz question for the study guide. Make the difficulty level {level} out of 10"})
+        model = get_model("quiz_question_builder", QuizQuestion)
+
+        return model.invoke(messages)
+
+    def build_quiz_question(self, username: str, subject: str | None = None,
+                            topic: str | None = None) -> QuizQuestion:
+        """
+        Entry point for deterministic route to build a quiz question. When subject and topic are known, the question
+        comes from the pre-generated quiz question pool.
+        Args:
+            username: need to load state of the agent
+            subject: subject of the study guide
+            topic: topic of the study guide
+        """
+        if subject and topic and self.quiz_pool.size > 0:
+            tutor_content = self.get_tutor_content(username)
+            level = tutor_content.find_or_create_topic(subject, topic).level if tutor_content else 1
+            return self.quiz_pool.pop(username, subject, topic, level)
+
+        thread_id = get_thread_id(username)
+        config = {"configurable": {"thread_id": thread_id}}
+        with self._thread_lock(thread_id):
+            final_state = self.graph.invoke({
+                "messages": [{"role": "user", "content": QUIZ_QUESTION_BUILDER}]
+            }, config)
         return final_state["quiz_question"]
 
     def invoke(self, username: str, user_input: str):
@@ -317,32 +438,104 @@ class StudyGuideSupervisorAgent:
             username: need to load state of the agent
             user_input: string query for user
         """
-        config = {"configurable": {"thread_id": get_thread_id(username)}}
-        final_state = self.graph.invoke({
-            "messages": [{"role": "user", "content": user_input}]
-        }, config)
+        thread_id = get_thread_id(username)
+        config = {"configurable": {"thread_id": thread_id}}
+        with self._thread_lock(thread_id):
+            final_state = self.graph.invoke({
+                "messages": [{"role": "user", "content": user_input}]
+            }, config)
         return final_state["messages"][-1].content
 
-    def grade_quiz_question(self, username, quiz_question: str):
+    def explain(self, username: str, selection: str, query: str) -> str:
+        """
+        Answers a question about text selected in the study guide. Questions the intent router sends to the general
+        chat agent are answered from the study guide, the selection and the question alone, outside of the graph, so
+        that the answer is the same for everyone reading the study guide and can be cached for them. These answers
+        are not added to the user's message history. Other requests, and every request before the user has a study
+        guide, go through the graph with the user's history and are not cached.
+        Args:
+            username: need to load state of the agent
+            selection: text selected in the study guide
+            query: question of the user about the selection
+        """
+        thread_id = get_thread_id(username)
+        config = {"configurable": {"thread_id": thread_id}}
+        study_guide = self.graph.get_state(config).values.get("study_guide") or ""
+        request = EXPLAIN_REQUEST.format(selection=selection, query=query)
+        start = time.perf_counter()
+        decision = self.router.match(request) if self.router and study_guide else None
+        if decision and decision.next == GENERAL_CHAT_AGENT:
+            # The graph's supervisor doesn't see the request, so its route is counted here
+            self.router.record(decision, time.perf_counter() - start)
+            return self._explain_from_study_guide(study_guide, selection, query, request)
+
+        with self._thread_lock(thread_id):
+            final_state = self.graph.invoke({"messages": [{"role": "user", "content": request}]}, config)
+        return final_state["messages"][-1].content
+
+    def _explain_from_study_guide(self, study_guide: str, selection: str, query: str, request: str) -> str:
+        cached = self.explanation_cache.get(study_guide, selection, query)
+        if cached is not None:
+            return cached
+
+        messages = [
+            {"role": "system", "content": GENERAL_CHAT_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Given the study guide: {study_guide}"},
+            {"role": "user", "content": request},
+        ]
+        answer = get_model("general_chat_agent").invoke(messages).content
+        self.explanation_cache.put(study_guide, selection, query, answer)
+        return answer
+
+    def grade_quiz_question(self, username, quiz_question: str, on_token: Callable[[str], None] | None = None):
         """
         Runs the quiz grader graph.
         We will use deterministic routing for this case as well.
         We will use string data because this is agent ot agent communication and agents don't care about structure
+        Args:
+            username: need to load state of the agent
+            quiz_question: question, answer and selected answer of the student
+            on_token: called with the tokens of the explanation while it is being written
         """
-        config = {"configurable": {"thread_id": get_thread_id(username)}}
-        final_state = self.graph.invoke({
-            "question_to_grade": quiz_question,
-            "messages": [{"role": "user", "content": QUIZ_GRADER}]
-        }, config)
+        thread_id = get_thread_id(username)
+        config = {"configurable": {"thread_id": thread_id}}
+        with self._thread_lock(thread_id):
+            final_state = self._invoke_streaming({
+                "question_to_grade": quiz_question,
+                "messages": [{"role": "user", "content": QUIZ_GRADER}]
+            }, config, on_token, QUIZ_GRADER)
         return final_state["messages"][-1].content
 
+    def _invoke_streaming(self, graph_input: dict, config: RunnableConfig, on_token: Callable[[str], None] | None,
+                          node: str, model_node: str | None = None) -> State:
+        """
+        Invokes the graph, passing the tokens of the answer written by node to on_token when it is given.
+        """
+        if on_token is None:
+            return self.graph.invoke(graph_input, config)
+
+        final_state = None
+        for mode, chunk in self.graph.stream(graph_input, config, stream_mode=["messages", "values"]):
+            if mode == "values":
+                final_state = chunk
+            elif _is_answer_token(*chunk, node, model_node):
+                on_token(chunk[0].content)
+        return final_state
+
     def update_study_guides(self, event: StudyProgressEvent) -> str:
         """
-        Entry point for updating study guides. At this time updates only the current study guide
+        Entry point for updating study guides. At this time updates only the current study guide.
+        Bursts of events for a topic are coalesced by the event dispatcher before they get here, see agent_pub_sub.
         Args:
             event (StudyProgressEvent): event containing data for our updates
         """
-        config = {"configurable": {"thread_id": get_thread_id(event.username)}}
+        thread_id = get_thread_id(event.username)
+        # Study guides are updated after progress updates and regenerations, students aren't waiting on them
+        with self._thread_lock(thread_id), model_priority("background"):
+            return self._update_study_guide_locked(thread_id, event)
+
+    def _update_study_guide_locked(self, thread_id: int, event: StudyProgressEvent) -> str:
+        config = {"configurable": {"thread_id": thread_id}}
         final_state = self.graph.invoke({
             "username": event.username, "subject": event.subject, "topic": event.topic, "level": event.level,
             "progress_summary": event.update,
@@ -350,8 +543,69 @@ class StudyGuideSupervisorAgent:
                           "content": f"When building a study guide for subject: {event.subject}, topic: {event.topic}, take into account this progress update: {event.update}"},
                          {"role": "user", "content": STUDY_GUIDE_BUILDER}]
         }, config)
+
+        # Pre-generated questions were written from the previous study guide, and maybe for the previous level
+        self.quiz_pool.discard(event.username, event.subject, event.topic)
+
         return final_state["study_guide"]
 
+    def regenerate_study_guide(self, username: str, subject: str, topic: str) -> str:
+        """
+        Rebuilds the user's study guide of a topic with the current model, prompts and books, in the style and at the
+        level it had. Only the topic in tutor_content changes: the subject, topic, study guide and messages of the
+        user's session are left alone, so regenerating doesn't interfere with what the student is doing. A study guide
+        that a progress update rebuilt while this one was generated is kept.
+        Args:
+            username: need to load state of the agent
+            subject: subject of the study guide
+            topic: topic of the study guide
+        """
+        thread_id = get_thread_id(username)
+        config = {"configurable": {"thread_id": thread_id}}
+        # Generated without the thread lock, so the student's requests don't wait for it
+        generated_from = self.get_tutor_content(username).find_or_create_topic(subject, topic)
+        previous_study_guide = generated_from.study_guide
+        with model_priority("background"):
+            response = invoke_study_guide_builder_agent(username, subject, topic, generated_from.summary, [],
+                                                        generated_from.study_guide_style, generated_from.level)
+
+        # The state is read again, other subjects and topics may have changed in the meantime, also in another
+        # process, and only this topic is written
+        with self._thread_lock(thread_id):
+            tutor_content = self.get_tutor_content(username)
+            current_topic = tutor_content.find_or_create_topic(subject, topic)
+            if current_topic.study_guide != previous_study_guide:
+                # A progress update rebuilt the study guide in the meantime, from a newer summary
+                return current_topic.study_guide
+            current_topic.study_guide = response.study_guide_text
+            current_topic.study_guide_version = study_guide_version(subject, topic)
+            current_topic.audio_file_location = response.audio_file_location
+            self.graph.update_state(config, {"tutor_content": tutor_content})
+
+        # Pre-generated questions were written from the previous study guide
+        self.quiz_pool.discard(username, subject, topic)
+        return current_topic.study_guide
+
+    def has_existing_study_guide(self, username: str, subject: str, topic: str) -> bool:
+        """
+        Cheap check whether the user already has a study guide for the topic, without running the graph.
+        Args:
+            username: need to load state of the agent
+            subject: subject of the study guide
+            topic: topic of the study guide
+        """
+        tutor_content = self.get_tutor_content(username)
+        return bool(tutor_content and tutor_content.find_or_create_topic(subject, topic).study_guide)
+
+    def get_thread_stats(self, username: str) -> dict:
+        """
+        Message count and token estimate of the user's thread.
+        Args:
+            username: need to load state of the agent
+        """
+        config = {"configurable": {"thread_id": get_thread_id(username)}}
+        return message_stats(self.graph.get_state(config).values.get("messages", []))
+
     def get_tutor_content(self, username: str) -> TutorContent:
         """
         Gets tutor content from the agent state. Since the agent is our primary data store, this is needed.
@@ -365,12 +619,11 @@ class StudyGuideSupervisorAgent:
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
-    import time
 
     load_dotenv()
 
     # start_pub_sub_consumer()
-    # listen_to_quiz_question("http://localhost:5005/echo")
+    # listen_to_quiz_question(print)
 
     agent = StudyGuideSupervisorAgent()
     response = agent.grade_quiz_question("John Doe", "What is 2+2? The answer is: 3. This is not correct.")
@@ -1,8 +1,9 @@
-from typing import Literal
+import os
+import threading
+from concurrent.futures import Future
+from typing import Callable, Literal
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph, MessagesState
 from pydantic import BaseModel
@@ -10,7 +11,13 @@ from pydantic import BaseModel
 from agents.instruction_reader import get_instructions
 from agents.user_store import get_thread_id
 from model.tutor import Subject, Topic
-from services.agent_pub_sub import update_study_progress, StudyProgressEvent, listen_to_quiz_question
+from services.checkpointer import get_checkpointer
+from services.governor import model_priority
+from services.models import get_model
+from services.quiz_archive import archive_quiz_questions
+from services.agent_pub_sub import update_study_progress, StudyProgressEvent, QuizQuestionEvent, \
+    get_event_dispatcher
+from services.event_dispatch import EventDispatcher
 
 
 class Progress(BaseModel):
@@ -21,20 +28,53 @@ class Progress(BaseModel):
 class State(MessagesState):
     username: str
     subjects: dict[str, Subject]
-    graded_quiz_question: str
+    graded_quiz_questions: list[str]
     subject: str
     topic: str
 
-
-listen_to_quiz_question("http://localhost:5005/agent/update_progress")
+DEFAULT_PROGRESS_RECENT_QUESTIONS = 10
+DEFAULT_PROGRESS_RETRIES = 2
 
 
 class StudyProgressAgent:
-    def __init__(self, ):
-        # Setup persistence
-        checkpointer = MemorySaver()
+    def __init__(self, model=None, debounce_seconds: float | None = None, max_batch_size: int | None = None,
+                 mode: Literal["incremental", "full"] | None = None, recent_questions: int | None = None,
+                 dispatcher: EventDispatcher | None = None, retries: int | None = None):
+        """
+        Args:
+            model: chat model used for the progress update, gpt-4o by default
+            debounce_seconds: graded quiz questions arriving within this delay are batched into one progress update.
+                0 updates progress on every question
+            max_batch_size: a batch is processed right away once it has this many questions
+            mode: "incremental" folds new graded questions into the previous summary and keeps only the most recent
+                questions in state, older ones are archived. "full" sends every question of the topic on each update
+            recent_questions: number of graded questions kept in state per topic in incremental mode
+            dispatcher: runs the progress updates of batches whose debounce delay passed, after the user's events that
+                are already queued. The dispatcher of the agents' events by default
+            retries: retries of a failing progress update of a batch, PROGRESS_RETRIES by default
+        """
+        # Setup persistence, shared with the other agents and worker processes
+        checkpointer = get_checkpointer()
+
+        self.debounce_seconds = debounce_seconds if debounce_seconds is not None else float(
+            os.getenv("PROGRESS_DEBOUNCE_SECONDS", 5))
+        self.max_batch_size = max_batch_size or int(os.getenv("PROGRESS_MAX_BATCH_SIZE", 10))
+        self.mode = mode or os.getenv("PROGRESS_MODE", "incremental")
+        self.recent_questions = recent_questions if recent_questions is not None else int(
+            os.getenv("PROGRESS_RECENT_QUESTIONS", DEFAULT_PROGRESS_RECENT_QUESTIONS))
+        self.dispatcher = dispatcher or get_event_dispatcher()
+        self.retries = retries if retries is not None else int(os.getenv("PROGRESS_RETRIES", DEFAULT_PROGRESS_RETRIES))
+        # (username, subject, topic) -> graded quiz questions waiting for a progress update
+        self._batches: dict[tuple[str, str, str], list[str]] = {}
+        # (username, subject, topic) -> futures done once the progress update of the batch ran
+        self._batch_futures: dict[tuple[str, str, str], list[Future]] = {}
+        self._timers: dict[tuple[str, str, str], threading.Timer] = {}
+        self._batches_lock = threading.Lock()
+        # Progress of a user is updated one batch at a time, batches of different topics share the user's thread
+        self._user_locks: dict[str, threading.Lock] = {}
 
-        self.model = ChatOpenAI(model="gpt-4o")
+        self.model = model or get_model("study_progress")
+        self.progress_model = self.model.with_structured_output(Progress)
         # self.model = ChatVertexAI(model_name="gemini-2.0-flash-001", location='us-west1')
         builder = StateGraph(State)
         builder.add_node("entry_node", self.entry_node)
@@ -49,12 +89,12 @@ class StudyProgressAgent:
 
     def entry_node(self, state: State):
         """
-        This node sets up the state for the study progress agent by adding quiz question to the state.
+        This node sets up the state for the study progress agent by adding quiz questions to the state.
         If subject and topic don't it exist, it will create them.
         """
         subject = state["subject"]
         topic = state["topic"]
-        graded_quiz_question = state["graded_quiz_question"]
+        graded_quiz_questions = state["graded_quiz_questions"]
 
         current_topic = Topic(name=topic, level=1, quiz_questions=[], summary="")
         current_subject = Subject(name=subject, topics={topic: current_topic})
@@ -63,31 +103,52 @@ class StudyProgressAgent:
         subject_obj = subjects.get(subject, current_subject)
 
         topic_obj = subject_obj.topics.setdefault(topic, current_topic)
-        topic_obj.quiz_questions += [graded_quiz_question]
+        topic_obj.quiz_questions += graded_quiz_questions
 
         subjects[subject] = subject_obj
         return {"subjects": subjects}
 
     def progress_update(self, state: State):
         """
-        This node actually performs the study progress update
+        This node actually performs the study progress update.
+        In incremental mode the prompt has the previous summary, a window of recent questions and the new questions,
+        so its size doesn't grow with the number of questions answered. Questions that slide out of the window are
+        archived and removed from state.
         :param state:
         :return:
         """
         subjects = state["subjects"]
         current_topic = subjects.get(state["subject"]).topics.get(state["topic"])
-        prompt = get_instructions("progress_update",
-                                  subject=state["subject"],
-                                  topic=state["topic"],
-                                  quiz_questions=current_topic.quiz_questions,
-                                  level=current_topic.level)
+        if self.mode == "full":
+            prompt = get_instructions("progress_update",
+                                      subject=state["subject"],
+                                      topic=state["topic"],
+                                      quiz_questions=current_topic.quiz_questions,
+                                      level=current_topic.level)
+        else:
+            new_questions = state["graded_quiz_questions"]
+            previous_questions = current_topic.quiz_questions[:len(current_topic.quiz_questions) - len(new_questions)]
+            prompt = get_instructions("progress_update",
+                                      subject=state["subject"],
+                                      topic=state["topic"],
+                                      previous_summary=current_topic.summary,
+                                      recent_quiz_questions=previous_questions[-self.recent_questions:],
+                                      quiz_questions=new_questions,
+                                      level=current_topic.level)
         messages = [{"role": "system", "content": prompt},
                     {"role": "user",
                      "content": f"Provide learning summary and next level given my last quiz questions and answers"}]
-        response = self.model.with_structured_output(Progress).invoke(messages)
+        response = self.progress_model.invoke(messages)
         current_topic.level = response.next_level
         current_topic.summary = response.progress_summary
 
+        if self.mode != "full" and len(current_topic.quiz_questions) > self.recent_questions:
+            archived = current_topic.quiz_questions[:len(current_topic.quiz_questions) - self.recent_questions]
+            # Archive before the questions are dropped from the checkpoint, so they are never lost
+            archive_quiz_questions(state["username"], state["subject"], state["topic"], archived)
+            current_topic.quiz_questions = current_topic.quiz_questions[len(archived):]
+            current_topic.archived_quiz_questions += len(archived)
+
         return {"subjects": subjects}
 
     def publish_update(self, state: State):
@@ -102,42 +163,199 @@ class StudyProgressAgent:
 
         return state
 
-    def inject_graded_quiz_question(self, username: str, graded_quiz_question: str, subject: str, topic: str):
+    def get_config(self, username: str):
         """
-        This node injects the graded quiz question into the state. The quiz questions are coming from quiz grader
+        The checkpointer is shared with the study guide supervisor, so this agent's threads get their own namespace
+        """
+        return {"configurable": {"thread_id": f"study_progress-{get_thread_id(username)}"}}
+
+    def inject_graded_quiz_question(self, username: str, graded_quiz_question: str, subject: str, topic: str,
+                                    flushed: Future | None = None):
+        """
+        This node injects the graded quiz question into the state. The quiz questions are coming from quiz grader.
+        Questions are batched per user, subject and topic: the progress update runs once the questions stop coming
+        for debounce_seconds, or once max_batch_size questions are waiting.
         Args:
             username: username used to load agent state
             graded_quiz_question: the graded quiz question that will be injected into this agent's state
             subject: subject for the graded quiz question
             topic: topic for the graded quiz question
+            flushed: when the question is batched, set once the progress update of its batch ran, or failed after its
+                retries
+        Returns:
+            The final state when the progress update ran right away (debounce_seconds is 0), None when the question
+            was batched
+        """
+        if self.debounce_seconds <= 0:
+            return self._update_progress(username, subject, topic, [graded_quiz_question])
+
+        key = (username, subject, topic)
+        with self._batches_lock:
+            batch = self._batches.setdefault(key, [])
+            batch.append(graded_quiz_question)
+            if flushed:
+                self._batch_futures.setdefault(key, []).append(flushed)
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+
+            if len(batch) < self.max_batch_size:
+                timer = threading.Timer(self.debounce_seconds, self._flush_later, args=key)
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+                return None
+
+            questions = self._batches.pop(key)
+            futures = self._batch_futures.pop(key, [])
+
+        self._dispatch_update(username, subject, topic, questions, futures)
+        return None
+
+    def handle_quiz_question(self, event: QuizQuestionEvent):
+        """
+        Handler for the quiz_question topic. A batched question returns a future that is done once the progress update
+        of its batch ran, so the event only counts as handled, and its Kafka offset is only committed, after that.
         """
-        config = {"configurable": {"thread_id": get_thread_id(username)}}
-        final_state = self.graph.invoke({
-            "username": username,
-            "subject": subject,
-            "topic": topic,
-            "graded_quiz_question": graded_quiz_question
-        }, config)
+        if self.debounce_seconds <= 0:
+            return self.inject_graded_quiz_question(event.username, event.quiz_question, event.subject, event.topic)
+        flushed = Future()
+        self.inject_graded_quiz_question(event.username, event.quiz_question, event.subject, event.topic, flushed)
+        return flushed
 
-        return final_state
+    def flush(self, username: str, subject: str, topic: str):
+        """
+        Run the progress update for the questions batched for a user, subject and topic, if there are any.
+        """
+        return self._flush(username, subject, topic, self._update_progress)
+
+    def _flush(self, username: str, subject: str, topic: str, update_progress: Callable[..., dict]):
+        key = (username, subject, topic)
+        with self._batches_lock:
+            questions = self._batches.pop(key, None)
+            futures = self._batch_futures.pop(key, [])
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+
+        if questions:
+            try:
+                final_state = update_progress(username, subject, topic, questions)
+            except Exception:
+                self._batch_flushed(futures, False)
+                raise
+            self._batch_flushed(futures, True)
+            return final_state
+
+    def _flush_later(self, username: str, subject: str, topic: str):
+        """
+        Called by the debounce timer.
+        """
+        key = (username, subject, topic)
+        with self._batches_lock:
+            questions = self._batches.pop(key, None)
+            futures = self._batch_futures.pop(key, [])
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+
+        if questions:
+            self._dispatch_update(username, subject, topic, questions, futures)
+
+    def _dispatch_update(self, username: str, subject: str, topic: str, questions: list[str], futures: list[Future]):
+        """
+        Run the progress update of a batch on the dispatcher, where it is retried when it fails. On the timer's or the
+        caller's thread a failure would lose the batch.
+        """
+        self.dispatcher.call(username, self._update_batch, (username, subject, topic, questions), retries=self.retries,
+                             on_done=lambda succeeded: self._batch_flushed(futures, succeeded))
+
+    @staticmethod
+    def _batch_flushed(futures: list[Future], succeeded: bool):
+        for future in futures:
+            if succeeded:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError("The progress update of the batch failed"))
+
+    def _update_batch(self, batch: tuple[str, str, str, list[str]]):
+        return self._update_progress(*batch)
+
+    def flush_all(self):
+        """
+        Run the progress updates for every batch, e.g. on shutdown.
+        """
+        with self._batches_lock:
+            keys = list(self._batches)
+        for key in keys:
+            self.flush(*key)
+
+    def flush_at_exit(self):
+        """
+        Run the progress updates for every batch when the process exits, registered with atexit. By then the thread
+        pools that the graph and the event dispatcher run on don't take work anymore, so the graph's nodes are called
+        on this thread. A study guide that can't be updated anymore catches up with the topic's next progress update.
+        """
+        with self._batches_lock:
+            keys = list(self._batches)
+        for key in keys:
+            try:
+                self._flush(*key, self._update_progress_in_place)
+            except Exception as error:
+                print(f"Progress update of {key} failed at exit: {error}")
+
+    def _update_progress_in_place(self, username: str, subject: str, topic: str, graded_quiz_questions: list[str]):
+        """
+        The graph run of _update_progress without the graph's thread pool: the nodes are called one after the other
+        and their state is saved as the graph's.
+        """
+        with self._batches_lock:
+            user_lock = self._user_locks.setdefault(username, threading.Lock())
+
+        with user_lock, model_priority("background"):
+            config = self.get_config(username)
+            state = {"subjects": self.graph.get_state(config).values.get("subjects", {}), "username": username,
+                     "subject": subject, "topic": topic, "graded_quiz_questions": graded_quiz_questions}
+            state.update(self.entry_node(state))
+            state.update(self.progress_update(state))
+            self.graph.update_state(config, state, as_node="publish_update")
+        try:
+            self.publish_update(state)
+        except RuntimeError as error:
+            # The event dispatcher's thread pool was shut down
+            print(f"Study progress of {username} for {subject}/{topic} not published at exit: {error}")
+        return state
+
+    def _update_progress(self, username: str, subject: str, topic: str, graded_quiz_questions: list[str]):
+        with self._batches_lock:
+            user_lock = self._user_locks.setdefault(username, threading.Lock())
+
+        with user_lock, model_priority("background"):
+            config = self.get_config(username)
+            return self.graph.invoke({
+                "username": username,
+                "subject": subject,
+                "topic": topic,
+                "graded_quiz_questions": graded_quiz_questions
+            }, config)
 
 
 if __name__ == "__main__":
     load_dotenv()
-    agent = StudyProgressAgent()
+    agent = StudyProgressAgent(debounce_seconds=0)
 
     # Test entry node
     response = agent.entry_node(
-        {"username": "John Doe", "messages": [], "subjects": {}, "graded_quiz_question": "Question 1",
+        {"username": "John Doe", "messages": [], "subjects": {}, "graded_quiz_questions": ["Question 1"],
          "subject": "Pre-Algebra", "topic": "Integers"})
     response = agent.entry_node(
-        {"username": "John Doe", "messages": [], "subjects": response["subjects"], "graded_quiz_question": "Question 2",
-         "subject": "Pre-Algebra", "topic": "Integers"})
+        {"username": "John Doe", "messages": [], "subjects": response["subjects"],
+         "graded_quiz_questions": ["Question 2"], "subject": "Pre-Algebra", "topic": "Integers"})
     response = agent.entry_node({"username": "John Doe", "messages": [], "subjects": response["subjects"],
-                                 "graded_quiz_question": "Decimals Question 1", "subject": "Pre-Algebra",
+                                 "graded_quiz_questions": ["Decimals Question 1"], "subject": "Pre-Algebra",
                                  "topic": "Decimals"})
     response = agent.entry_node({"username": "John Doe", "messages": [], "subjects": response["subjects"],
-                                 "graded_quiz_question": "Equations Question 1", "subject": "Algebra",
+                                 "graded_quiz_questions": ["Equations Question 1"], "subject": "Algebra",
                                  "topic": "Equations"})
     assert response["subjects"].get("Pre-Algebra").topics.get("Integers").quiz_questions == ["Question 1", "Question 2"]
     assert response["subjects"].get("Pre-Algebra").topics.get("Integers").level == 1
@@ -1,51 +1,44 @@
-import sqlite3
+import os
+import threading
 from collections import defaultdict
 
 from model.tutor import TutorContent, Subject, Topic
+from services.db_pool import DB_PATH, get_pool, query
+from services.user_registry import get_user_registry
 
-user_mapping: dict[str, int] = {}
+# db_path -> (db version, catalog). The catalog is shared, users get copy on write copies of it
+_catalogs: dict[str, tuple[tuple, TutorContent]] = {}
+_catalogs_lock = threading.Lock()
 
 
-def add_user(user_id: str, thread_id: int):
-    user_mapping[user_id] = thread_id
+def get_thread_id(user_id: str) -> int:
+    return get_user_registry().get_thread_id(user_id)
 
 
-def get_next_thread_id() -> int:
-    if len(user_mapping) == 0:
-        return 1
-    else:
-        return max(user_mapping.values()) + 1
+def get_user_id(thread_id: int) -> str | None:
+    return get_user_registry().get_user_id(thread_id)
 
 
-def get_thread_id(user_id: str):
-    if user_id in user_mapping:
-        return user_mapping[user_id]
-    else:
-        thread_id = get_next_thread_id()
-        add_user(user_id, thread_id)
-        return thread_id
-
-
-def get_user_id(thread_id: int):
-    for user_id, thread in user_mapping.items():
-        if thread == thread_id:
-            return user_id
-
-
-def default_tutor_content() -> TutorContent:
+def _db_version(db_path: str) -> tuple:
     """
-    Gets data for seeding agent state.
-    :return: data for seeding agent state.
+    Changes whenever the database is written to. In WAL mode commits land in the -wal file first,
+    so both files are checked. An empty -wal file is only created by opening a connection, not by a write.
     """
-    conn = sqlite3.connect("study_material.db")
-    cursor = conn.cursor()
+    version = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        version.append((stat.st_mtime_ns, stat.st_size) if stat and stat.st_size else None)
+    return tuple(version)
+
 
+def _load_catalog(db_path: str) -> TutorContent:
     # Dict to build: subject -> topic_name -> Topic instance
     subjects_dict: dict[str, Subject] = {}
 
-    cursor.execute("SELECT subject, topic FROM topics")
-    rows = cursor.fetchall()
-    conn.close()
+    rows = query("SELECT subject, topic FROM topics", db_path=db_path)
 
     # Organize into your structure
     subject_topic_map: dict[str, dict[str, Topic]] = defaultdict(dict)
@@ -58,4 +51,68 @@ def default_tutor_content() -> TutorContent:
             topics=topic_dict
         )
 
-    return TutorContent(subjects=subjects_dict)
+    return TutorContent(subjects=subjects_dict).share()
+
+
+def default_tutor_content(db_path: str = DB_PATH) -> TutorContent:
+    """
+    Gets data for seeding agent state. The catalog is loaded once per database version and every caller gets
+    a copy on write copy of it.
+    :return: data for seeding agent state.
+    """
+    # Opening the pool can switch the database to WAL mode, which would change the version
+    get_pool(db_path)
+    version = _db_version(db_path)
+    cached = _catalogs.get(db_path)
+    if cached is None or cached[0] != version:
+        with _catalogs_lock:
+            cached = _catalogs.get(db_path)
+            if cached is None or cached[0] != version:
+                cached = (version, _load_catalog(db_path))
+                _catalogs[db_path] = cached
+
+    return cached[1].copy_on_write()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    from seed_db import create_db, insert_books_to_db
+
+    loads = 0
+    load_catalog = _load_catalog
+
+
+    def counting_load_catalog(path: str) -> TutorContent:
+        global loads
+        loads += 1
+        return load_catalog(path)
+
+
+    _load_catalog = counting_load_catalog
+
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = str(Path(tmp) / "study_material.db")
+        create_db(test_db)
+        insert_books_to_db(Path("books"), test_db)
+
+        # 1000 logins, each user changes their own copy
+        for i in range(1000):
+            content = default_tutor_content(test_db)
+            content.find_or_create_topic("Algorithms", "Sorting").study_guide = f"Guide for user {i}"
+        assert loads == 1, f"Expected catalog to be loaded once, loaded {loads} times"
+        assert default_tutor_content(test_db).find_or_create_topic("Algorithms", "Sorting").study_guide == ""
+
+        # Seeding a new book makes the catalog reload
+        new_books = Path(tmp) / "books"
+        (new_books / "Graphs").mkdir(parents=True)
+        (new_books / "Graphs" / "1 - Shortest Paths.txt").write_text("Dijkstra's algorithm.", encoding="utf-8")
+        insert_books_to_db(new_books, test_db)
+
+        content = default_tutor_content(test_db)
+        assert loads == 2, f"Expected catalog to be reloaded after seeding, loaded {loads} times"
+        assert "Shortest Paths" in content.subjects["Graphs"].topics
+        default_tutor_content(test_db)
+        assert loads == 2
+    print("OK")
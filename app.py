@@ -1,14 +1,22 @@
-import io
+import atexit
+import hmac
 import json
+import os
+from typing import Any, Callable
 
 import markdown
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, session, jsonify, send_file
+from flask import Flask, render_template, request, session, jsonify, Response, url_for, \
+    send_from_directory
 
+from agents.study_guide_regeneration import StudyGuideRegenerator
 from agents.study_guide_supervisor import StudyGuideSupervisorAgent
 from agents.study_progress import StudyProgressAgent
 from agents.user_store import default_tutor_content
-from services.agent_pub_sub import start_pub_sub_consumer, StudyProgressEvent
+from services.agent_pub_sub import start_pub_sub_consumer, StudyProgressEvent, listen_to_quiz_question, \
+    listen_to_study_progress
+from services.jobs import Job, JobRunner
+from services.models import get_model_registry
 
 load_dotenv()
 app = Flask(__name__)
@@ -17,9 +25,23 @@ app.secret_key = 'your-secret-key-123'
 
 study_guide_supervisor_instance: StudyGuideSupervisorAgent = StudyGuideSupervisorAgent()
 progress_agent: StudyProgressAgent = StudyProgressAgent()
-
+# Study guide generation can take tens of seconds, so it runs here instead of on a web worker
+study_guide_jobs = JobRunner(max_workers=int(os.getenv("STUDY_GUIDE_WORKERS", 4)), name="study_guide")
+# Quiz answers are graded here, the student sees whether they were right before the explanation is written
+grading_jobs = JobRunner(max_workers=int(os.getenv("QUIZ_GRADER_WORKERS", 8)), name="quiz_grader")
+# Bulk regeneration of stale study guides, one run at a time
+study_guide_regenerator = StudyGuideRegenerator(study_guide_supervisor_instance)
+regeneration_jobs = JobRunner(max_workers=1, name="regeneration")
+# Study guide audio is written to audio/ in the working directory, see create_audio_file
+AUDIO_DIRECTORY = os.path.abspath("audio")
+
+# Agents listen to each other's events, handlers are called on the event dispatcher's threads
+listen_to_quiz_question(progress_agent.handle_quiz_question)
+listen_to_study_progress(study_guide_supervisor_instance.update_study_guides)
 # Start the pub sub consumer so that agents can listen to and publish to events
 start_pub_sub_consumer()
+# Batched quiz answers get their progress update before the process exits
+atexit.register(progress_agent.flush_at_exit)
 
 
 @app.route("/")
@@ -30,7 +52,8 @@ def tutor():
     username = session.get('username', None)
     teaching_style = session.get('teaching_style', None)
 
-    stored_tutor_content = study_guide_supervisor_instance.get_tutor_content(username)
+    # Visitors who haven't logged in see the catalog, they have no agent state
+    stored_tutor_content = study_guide_supervisor_instance.get_tutor_content(username) if username else None
     tutor_content = stored_tutor_content or default_tutor_content()
 
     return render_template(
@@ -61,13 +84,22 @@ def login():
 @app.route("/study_guide")
 def study_guide():
     """
-    This endpoint displays the study guide. Both textbook style and podcast style study guides are supported
+    This endpoint displays the study guide. Both textbook style and podcast style study guides are supported.
+    When the study guide does not exist yet, it is generated in the background and a page that shows it while it is
+    being written is returned.
     """
     subject = request.args.get("subject", "Unknown Subject")
     topic = request.args.get("topic", "Unknown Topic")
     username = session.get('username', "Anonymous")
     style = session['teaching_style']
 
+    if not study_guide_supervisor_instance.has_existing_study_guide(username, subject, topic):
+        job = study_guide_jobs.submit_streaming((username, subject, topic, style),
+                                                study_guide_supervisor_instance.find_existing_study_guide_or_create,
+                                                username, subject, topic, style)
+        if job.status != "done":
+            return render_template("study_guide_loading.html", subject=subject, topic=topic, job_id=job.id)
+
     response = study_guide_supervisor_instance.find_existing_study_guide_or_create(username, subject, topic, style)
     if style == "textbook":
         guide_markdown = response["study_guide"]
@@ -80,6 +112,54 @@ def study_guide():
         return render_template("audio.html", subject=subject, topic=topic, file_path=audio_file_path, text=guide_html)
 
 
+@app.route("/study_guide/jobs/<job_id>")
+def study_guide_job(job_id):
+    """
+    This endpoint returns the status of a study guide generation job, so that the waiting page knows when to reload.
+    """
+    job = study_guide_jobs.get(job_id)
+    if job is None or job.key[0] != session.get('username', "Anonymous"):
+        return jsonify({"error": "Unknown job"}), 404
+
+    return jsonify(job.to_dict())
+
+
+@app.route("/study_guide/jobs/<job_id>/stream")
+def study_guide_job_stream(job_id):
+    """
+    This endpoint streams the tokens of a study guide as Server-Sent Events while it is generated. A "token" event is
+    sent for every token, followed by a "done" or "failed" event with the job status.
+    """
+    job = study_guide_jobs.get(job_id)
+    if job is None or job.key[0] != session.get('username', "Anonymous"):
+        return jsonify({"error": "Unknown job"}), 404
+    return job_event_stream(job)
+
+
+def job_event_stream(job: Job, result_to_dict: Callable[[Any], dict] | None = None) -> Response:
+    """
+    Streams the output of a job as Server-Sent Events: a "token" event for every token, followed by a "done" or
+    "failed" event with the job status.
+    Args:
+        job: job that writes its output with on_token
+        result_to_dict: adds the result of a finished job to the last event
+    """
+
+    def events():
+        for token in job.iter_output():
+            yield f"event: token\ndata: {json.dumps(token)}\n\n"
+        yield f"event: {job.status}\ndata: {json.dumps(job_to_dict(job, result_to_dict))}\n\n"
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def job_to_dict(job: Job, result_to_dict: Callable[[Any], dict] | None = None) -> dict:
+    if job.status == "done" and result_to_dict:
+        return {**job.to_dict(), **result_to_dict(job.result)}
+    return job.to_dict()
+
+
 @app.route("/quiz")
 def quiz():
     """
@@ -90,7 +170,8 @@ def quiz():
     topic = request.args.get("topic", "Unknown Topic")
 
     if study_guide_supervisor_instance:
-        quiz_question = study_guide_supervisor_instance.build_quiz_question(session.get('username', "Anonymous"))
+        quiz_question = study_guide_supervisor_instance.build_quiz_question(session.get('username', "Anonymous"),
+                                                                            subject, topic)
         quiz_questions = [quiz_question]
         return render_template("quiz.html", quiz_questions=quiz_questions, subject=subject, topic=topic)
     else:
@@ -100,22 +181,52 @@ def quiz():
 @app.route("/grade_quiz", methods=["POST"])
 def grade_quiz():
     """
-    This endpoint provides correctness of the user answer and an explanation.
+    This endpoint provides correctness of the user answer right away. The explanation is written in the background,
+    it can be streamed from explanation_stream_url or polled at explanation_url.
     """
     data = request.get_json()
+    username = session.get('username', "Anonymous")
+    correct = data["selected"] == data["answer"]
 
-    explanation = study_guide_supervisor_instance.grade_quiz_question(session.get('username', "Anonymous"), json.dumps({
-        **data,
-        "correct": data["selected"] == data["answer"],
-    }))
-
-    explanation_md = markdown.markdown(explanation)
+    # Grading also publishes the quiz question to the other agents, which happens after the response is sent
+    job = grading_jobs.submit_streaming((username, data["question"], data["selected"]),
+                                        study_guide_supervisor_instance.grade_quiz_question, username,
+                                        json.dumps({**data, "correct": correct}))
     return jsonify({
         **data,
-        "correct": data["selected"] == data["answer"], "explanation": explanation_md
+        "correct": correct,
+        "explanation_url": url_for("grade_quiz_job", job_id=job.id),
+        "explanation_stream_url": url_for("grade_quiz_job_stream", job_id=job.id),
     })
 
 
+@app.route("/grade_quiz/jobs/<job_id>")
+def grade_quiz_job(job_id):
+    """
+    This endpoint returns the status of a quiz explanation, with the explanation as HTML once it is written.
+    """
+    job = grading_jobs.get(job_id)
+    if job is None or job.key[0] != session.get('username', "Anonymous"):
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job_to_dict(job, explanation_to_dict))
+
+
+@app.route("/grade_quiz/jobs/<job_id>/stream")
+def grade_quiz_job_stream(job_id):
+    """
+    This endpoint streams the tokens of a quiz explanation as Server-Sent Events while it is written. The final "done"
+    event has the explanation as HTML.
+    """
+    job = grading_jobs.get(job_id)
+    if job is None or job.key[0] != session.get('username', "Anonymous"):
+        return jsonify({"error": "Unknown job"}), 404
+    return job_event_stream(job, explanation_to_dict)
+
+
+def explanation_to_dict(explanation: str) -> dict:
+    return {"explanation": markdown.markdown(explanation)}
+
+
 @app.route("/explain", methods=["POST"])
 def explain():
     """
@@ -123,12 +234,9 @@ def explain():
     DANGER: hidden from user capabilities may be accessed
     """
     data = request.get_json()
-    query = data.get("query")
-    selection = data.get("selection")
-    message = (f"The user selected the following text from the study guide: {selection}. "
-               f"The user asked the following question about the selected text: {query}. Respond in plain text")
-
-    response = study_guide_supervisor_instance.invoke(session.get('username', "Anonymous"), message)
+    query = data.get("query") or ""
+    selection = data.get("selection") or ""
+    response = study_guide_supervisor_instance.explain(session.get('username', "Anonymous"), selection, query)
     html = markdown.markdown(response)
 
     return jsonify({"response": html})
@@ -137,13 +245,48 @@ def explain():
 @app.route('/audio/files/<path:file_name>')
 def serve_audio(file_name):
     """
-    This endpoint returns an audio file at the specified location.
-    :param file_name: location of the audio file
+    This endpoint returns an audio file at the specified location. Files are streamed from disk, with Range requests
+    so that players can seek, and with an ETag so that players can revalidate instead of downloading again.
+    Only files in the audio directory are served.
+    :param file_name: location of the audio file, as stored in audio_file_location (audio/...)
     :return:
     """
-    with open(f"{file_name}", "rb") as f:
-        audio_data = f.read()
-    return send_file(io.BytesIO(audio_data), mimetype="audio/mpeg")
+    return send_from_directory(AUDIO_DIRECTORY, file_name.removeprefix("audio/"), mimetype="audio/mpeg",
+                               conditional=True, etag=True, max_age=0)
+
+
+@app.route("/metrics/models")
+def model_metrics():
+    """
+    This endpoint returns the call, error, latency and token counters of every model the agents used.
+    """
+    return jsonify(get_model_registry().metrics())
+
+
+@app.route("/metrics/governor")
+def governor_metrics():
+    """
+    This endpoint returns the live queue depth per priority, the calls in flight and the rate limit retries of every
+    model the agents call.
+    """
+    return jsonify(get_model_registry().governor.stats())
+
+
+@app.route("/metrics/router")
+def router_metrics():
+    """
+    This endpoint returns how many requests the local intent router routed without an LLM call.
+    """
+    router = study_guide_supervisor_instance.router
+    return jsonify(router.stats() if router else {})
+
+
+@app.route("/metrics/explanations")
+def explanation_metrics():
+    """
+    This endpoint returns the hit rate of the cache of answers to questions about the study guide.
+    """
+    return jsonify(study_guide_supervisor_instance.explanation_cache.stats())
 
 
 @app.route('/agent/update_progress', methods=["POST"])
@@ -179,6 +322,93 @@ def update_study_guides():
     return "OK", 200
 
 
+def regeneration_access_error() -> tuple[Response, int] | None:
+    """
+    A regeneration calls the model for every user's study guides, so the regeneration endpoints are only for admins
+    that send "Authorization: Bearer <REGENERATION_ADMIN_TOKEN>". Without the token they are off,
+    regenerate_study_guides.py works either way.
+    """
+    token = os.getenv("REGENERATION_ADMIN_TOKEN")
+    if not token:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode("utf-8"),
+                               f"Bearer {token}".encode("utf-8")):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@app.route('/agent/regenerate_study_guides', methods=["POST"])
+def regenerate_study_guides():
+    """
+    This endpoint starts regenerating the study guides of all users that are stale, e.g. after the books or prompts
+    changed. While a regeneration is running, the running one is returned. Admins only, see regeneration_access_error.
+    data.args:
+        subjects (list[str]): Optional, only regenerate these subjects
+        topics (list[str]): Optional, only regenerate these topics
+        force (bool): Optional, also regenerate study guides that are up to date
+    """
+    error = regeneration_access_error()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    job = regeneration_jobs.submit_streaming("regeneration", run_study_guide_regeneration, data.get("subjects"),
+                                             data.get("topics"), bool(data.get("force")))
+    return jsonify({
+        **job.to_dict(),
+        "status_url": url_for("regeneration_job", job_id=job.id),
+        "stream_url": url_for("regeneration_job_stream", job_id=job.id),
+    }), 202
+
+
+@app.route('/agent/regenerate_study_guides', methods=["DELETE"])
+def stop_regenerating_study_guides():
+    """
+    This endpoint stops the running regeneration after the study guides that are being regenerated.
+    Running it again resumes with the study guides that are still stale. Admins only.
+    """
+    error = regeneration_access_error()
+    if error:
+        return error
+    study_guide_regenerator.stop()
+    return "OK", 200
+
+
+@app.route("/agent/regenerate_study_guides/<job_id>")
+def regeneration_job(job_id):
+    """
+    This endpoint returns the status and latest progress of a regeneration. Admins only.
+    """
+    error = regeneration_access_error()
+    if error:
+        return error
+    job = regeneration_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    progress = job.result if job.status == "done" else json.loads(job.output[-1]) if job.output else None
+    return jsonify({**job.to_dict(), "progress": progress})
+
+
+@app.route("/agent/regenerate_study_guides/<job_id>/stream")
+def regeneration_job_stream(job_id):
+    """
+    This endpoint streams the progress of a regeneration as Server-Sent Events, a "token" event with the progress
+    after every study guide, followed by a "done" or "failed" event. Admins only.
+    """
+    error = regeneration_access_error()
+    if error:
+        return error
+    job = regeneration_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return job_event_stream(job, lambda progress: {"progress": progress})
+
+
+def run_study_guide_regeneration(subjects: list[str] | None, topics: list[str] | None, force: bool,
+                                 on_token: Callable[[str], None]) -> dict:
+    return study_guide_regenerator.run(subjects, topics, force,
+                                       on_progress=lambda progress: on_token(json.dumps(progress)))
+
+
 @app.route("/echo", methods=["POST"])
 def echo():
     text = request.get_data().decode("utf-8")
@@ -0,0 +1,76 @@
+"""
+Memory per concurrent listener of /audio/files, when the whole mp3 is read into memory for every request (before) and
+when it is streamed from disk (after). Every listener has started playing and reads the first block of the response,
+the Python memory allocated while they are all listening is measured with tracemalloc.
+Also checks Range requests, ETag revalidation and that only files in the audio directory are served.
+
+Run from the repository root:
+    python -m benchmarks.audio_serving
+"""
+import io
+import os
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from flask import send_file
+
+import app as app_module
+from app import app
+
+LISTENERS = 20
+FILE_BYTES = 10 * 1024 * 1024
+
+
+def serve_audio_before(file_name):
+    """
+    The handler before: reads the whole file for every request.
+    """
+    with open(os.path.join(app_module.AUDIO_DIRECTORY, file_name.removeprefix("audio/")), "rb") as f:
+        audio_data = f.read()
+    return send_file(io.BytesIO(audio_data), mimetype="audio/mpeg")
+
+
+def memory_per_listener(client, url: str) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    listening = []
+    for _ in range(LISTENERS):
+        response = client.get(url, buffered=False)
+        next(iter(response.response))
+        listening.append(response)
+    during = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for response in listening:
+        response.close()
+    return (during - before) / LISTENERS
+
+
+if __name__ == "__main__":
+    app.add_url_rule("/benchmark/audio_before/<path:file_name>", view_func=serve_audio_before)
+    client = app.test_client()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_module.AUDIO_DIRECTORY = os.path.join(tmp, "audio")
+        os.mkdir(app_module.AUDIO_DIRECTORY)
+        Path(app_module.AUDIO_DIRECTORY, "guide.mp3").write_bytes(os.urandom(FILE_BYTES))
+        Path(tmp, "secret.txt").write_text("secret")
+
+        # Seeking fetches only the requested bytes, players revalidate with the ETag
+        response = client.get("/audio/files/audio/guide.mp3", headers={"Range": "bytes=1000-1999"})
+        assert response.status_code == 206 and len(response.data) == 1000
+        assert response.headers["Content-Range"] == f"bytes 1000-1999/{FILE_BYTES}"
+        etag = response.headers["ETag"]
+        assert client.get("/audio/files/audio/guide.mp3", headers={"If-None-Match": etag}).status_code == 304
+        assert client.get("/audio/files/../secret.txt").status_code == 404
+        assert client.get("/audio/files/audio/../secret.txt").status_code == 404
+
+        before = memory_per_listener(client, "/benchmark/audio_before/audio/guide.mp3")
+        after = memory_per_listener(client, "/audio/files/audio/guide.mp3")
+
+    print(f"{LISTENERS} listeners of a {FILE_BYTES // 1024 // 1024} MB file")
+    print(f"   before (read into memory): {before / 1024:,.0f} KB per listener")
+    print(f"  after (streamed from disk): {after / 1024:,.0f} KB per listener")
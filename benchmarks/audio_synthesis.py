@@ -0,0 +1,46 @@
+"""
+Time to create the audio of a podcast style study guide with one speech request for the whole text (before), and per
+paragraph with the paragraph audio cache (after): cold, and after an update that rewrote two Focus Area paragraphs.
+The speech client is a fake whose latency grows with the length of the text, like a real speech API.
+
+Run from the repository root:
+    python -m benchmarks.audio_synthesis
+"""
+import tempfile
+import time
+
+from services.tts import AudioSynthesizer
+
+PARAGRAPHS = 12
+REQUEST_SECONDS = 0.2
+SECONDS_PER_CHAR = 0.0002
+
+
+def fake_speech(text: str, voice: str, model: str, instructions: str) -> bytes:
+    time.sleep(REQUEST_SECONDS + SECONDS_PER_CHAR * len(text))
+    return text.encode("utf-8")
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    paragraphs = [f"Section {i}. " + "A heap keeps its smallest element at the root, so it is found in constant time. "
+                  * 5 for i in range(PARAGRAPHS)]
+    guide = "\n\n".join(paragraphs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthesizer = AudioSynthesizer(fake_speech, cache_dir=f"{tmp}/cache")
+        whole_text = timed(fake_speech, guide, synthesizer.voice, synthesizer.model, synthesizer.instructions)
+        cold = timed(synthesizer.synthesize, guide, f"{tmp}/guide.mp3")
+
+        paragraphs[4] = "Focus Area: after removing the root, the last element sifts down to restore the heap."
+        paragraphs[9] = "Focus Area: inserting bubbles the new element up while it is smaller than its parent."
+        updated = timed(synthesizer.synthesize, "\n\n".join(paragraphs), f"{tmp}/guide.mp3")
+
+    print(f"  before, one request for {len(guide)} chars: {whole_text:.2f} s")
+    print(f"  after, {PARAGRAPHS} paragraphs in parallel (cold): {cold:.2f} s")
+    print(f"  after, update that changed 2 paragraphs: {updated:.2f} s")
@@ -0,0 +1,81 @@
+"""
+Compares the prompt size and query time of pulling whole topic rows (what the agent does with query_database)
+against the full-text search over passages, on the books/ corpus replicated REPLICAS times.
+
+Run from the repository root:
+    python -m benchmarks.book_search
+"""
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from seed_db import create_db, index_topic
+
+REPLICAS = 100
+RUNS = 20
+# Rough estimate used for OpenAI models
+CHARS_PER_TOKEN = 4
+
+QUERIES = [
+    ("Data Structures", "Heap", "heap insertion and removal"),
+    ("Data Structures", "Binary Search Tree", "binary search tree traversal"),
+    ("Data Structures", "Linked Lists", "doubly linked list deletion"),
+    ("Algorithms", "Sorting", "quick sort partition"),
+    ("Algorithms", "Searching", "sequential search probability"),
+    ("Algorithms", "Numeric", "primality test"),
+]
+
+
+def build_replicated_db(db_path: str, source_db: str = "study_material.db"):
+    create_db(db_path)
+    source = sqlite3.connect(source_db)
+    rows = source.execute("SELECT subject, topic, text, authors, book_title FROM topics").fetchall()
+    source.close()
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    for replica in range(REPLICAS):
+        for subject, topic, text, authors, book_title in rows:
+            title = f"{book_title or subject} (edition {replica + 1})"
+            cursor.execute("INSERT INTO topics (subject, topic, text, authors, book_title) VALUES (?, ?, ?, ?, ?)",
+                           (subject, topic, text, authors, title))
+            index_topic(cursor, cursor.lastrowid, subject, topic, text, authors, title)
+    conn.commit()
+    conn.close()
+
+
+def whole_rows(db_path: str, subject: str, topic: str, _query: str) -> list:
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT text FROM topics WHERE subject = ? AND topic = ?", (subject, topic)).fetchall()
+    conn.close()
+    return rows
+
+
+def ranked_passages(db_path: str, subject: str, topic: str, query: str) -> list:
+    from agents.study_guide_builder_react import search_passages
+    return search_passages(query, subject, topic, k=5, db_path=db_path)
+
+
+def measure(fn, db_path: str) -> tuple[float, float]:
+    tokens = []
+    timings = []
+    for subject, topic, query in QUERIES:
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            result = fn(db_path, subject, topic, query)
+            timings.append(time.perf_counter() - start)
+        tokens.append(len(str(result)) / CHARS_PER_TOKEN)
+    return statistics.mean(tokens), statistics.median(timings) * 1000
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "study_material.db")
+        build_replicated_db(db_path)
+
+        print(f"Corpus replicated {REPLICAS}x")
+        for name, fn in [("whole rows", whole_rows), ("fts top-5", ranked_passages)]:
+            tokens, latency = measure(fn, db_path)
+            print(f"{name:>12}: ~{tokens:,.0f} tokens per lookup, {latency:.2f} ms median query time")
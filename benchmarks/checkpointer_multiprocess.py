@@ -0,0 +1,96 @@
+"""
+Load test for the SQLite checkpointer shared by worker processes. Every worker writes the state of its own users
+through a LangGraph graph, then reads the state every other worker wrote and checks it.
+
+Run from the repository root:
+    python -m benchmarks.checkpointer_multiprocess
+"""
+import tempfile
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from typing import NotRequired
+
+from langgraph.constants import START, END
+from langgraph.graph import StateGraph, MessagesState
+
+from model.tutor import TutorContent
+from services.checkpointer import SqliteCheckpointSaver
+
+WORKERS = 4
+USERS_PER_WORKER = 50
+UPDATES_PER_USER = 5
+
+
+class State(MessagesState):
+    username: str
+    tutor_content: NotRequired[TutorContent]
+    update: int
+
+
+def write_study_guide(state: State):
+    tutor_content = state.get("tutor_content") or TutorContent(subjects={})
+    topic = tutor_content.find_or_create_topic("Algorithms", "Sorting")
+    topic.study_guide = f"Study guide {state['update']} for {state['username']}"
+    topic.level = min(state["update"] + 1, 10)
+    return {"tutor_content": tutor_content, "messages": [f"update {state['update']}"]}
+
+
+def build_graph(db_path: str):
+    builder = StateGraph(State)
+    builder.add_node(write_study_guide)
+    builder.add_edge(START, "write_study_guide")
+    builder.add_edge("write_study_guide", END)
+    return builder.compile(checkpointer=SqliteCheckpointSaver(db_path))
+
+
+def username(worker: int, user: int) -> str:
+    return f"worker{worker}-user{user}"
+
+
+def write(args: tuple[str, int]) -> float:
+    db_path, worker = args
+    graph = build_graph(db_path)
+    start = time.perf_counter()
+    for update in range(UPDATES_PER_USER):
+        for user in range(USERS_PER_WORKER):
+            name = username(worker, user)
+            graph.invoke({"username": name, "update": update}, {"configurable": {"thread_id": name}})
+    return time.perf_counter() - start
+
+
+def read(args: tuple[str, int]) -> int:
+    db_path, worker = args
+    graph = build_graph(db_path)
+    checked = 0
+    for other in range(WORKERS):
+        if other == worker:
+            continue
+        for user in range(USERS_PER_WORKER):
+            name = username(other, user)
+            values = graph.get_state({"configurable": {"thread_id": name}}).values
+            topic = values["tutor_content"].subjects["Algorithms"].topics["Sorting"]
+            assert topic.study_guide == f"Study guide {UPDATES_PER_USER - 1} for {name}", topic.study_guide
+            assert topic.level == UPDATES_PER_USER
+            assert len(values["messages"]) == UPDATES_PER_USER
+            checked += 1
+    return checked
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "checkpoints.db")
+        SqliteCheckpointSaver(db_path)
+        args = [(db_path, worker) for worker in range(WORKERS)]
+
+        with Pool(WORKERS) as pool:
+            start = time.perf_counter()
+            pool.map(write, args)
+            elapsed = time.perf_counter() - start
+            invocations = WORKERS * USERS_PER_WORKER * UPDATES_PER_USER
+            print(f"{WORKERS} workers wrote {invocations} graph invocations in {elapsed:.2f}s "
+                  f"({invocations / elapsed:.0f}/s)")
+
+        with Pool(WORKERS) as pool:
+            checked = sum(pool.map(read, args))
+        print(f"Every worker read the state written by the others: {checked} threads checked")
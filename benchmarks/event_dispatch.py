@@ -0,0 +1,66 @@
+"""
+Measures agent event throughput (events per second, from publish until the handler returns) for the in-process
+transport and for the Kafka transport running against an in-memory broker.
+Handlers sleep to stand in for agent work, the broker charges a round trip on every batch the producer sends.
+
+Run from the repository root:
+    python -m benchmarks.event_dispatch
+"""
+import threading
+import time
+
+from services.agent_pub_sub import InProcessTransport, KafkaTransport, QuizQuestionEvent, QUIZ_QUESTION_TOPIC
+from services.event_dispatch import EventDispatcher
+from services.memory_broker import MemoryBroker
+
+EVENTS = 2000
+USERS = 50
+PUBLISHERS = 8
+HANDLER_SECONDS = 0.005
+BROKER_ROUND_TRIP_SECONDS = 0.001
+
+
+def run(label: str, make_transport, workers: int, handler_seconds: float):
+    dispatcher = EventDispatcher(max_workers=workers, max_pending=500)
+    handled = []
+    done = threading.Event()
+
+    def handler(event: QuizQuestionEvent):
+        if handler_seconds:
+            time.sleep(handler_seconds)
+        handled.append(event)
+        if len(handled) == EVENTS:
+            done.set()
+
+    dispatcher.subscribe(QUIZ_QUESTION_TOPIC, handler)
+    transport = make_transport(dispatcher)
+    transport.start()
+
+    def publish(publisher: int):
+        for i in range(publisher, EVENTS, PUBLISHERS):
+            transport.publish(QUIZ_QUESTION_TOPIC, QuizQuestionEvent(
+                username=f"user-{i % USERS}", subject="Algorithms", topic="Sorting", quiz_question=f"Question {i}"))
+
+    start = time.perf_counter()
+    publishers = [threading.Thread(target=publish, args=(p,)) for p in range(PUBLISHERS)]
+    [p.start() for p in publishers]
+    [p.join() for p in publishers]
+    assert done.wait(120), f"{label}: only {len(handled)} of {EVENTS} events were handled"
+    elapsed = time.perf_counter() - start
+    transport.stop()
+    print(f"{label:>40}: {EVENTS / elapsed:8.0f} events/s")
+
+
+def kafka_transport(dispatcher: EventDispatcher) -> KafkaTransport:
+    broker = MemoryBroker(latency_seconds=BROKER_ROUND_TRIP_SECONDS)
+    return KafkaTransport(dispatcher, producer_factory=broker.producer, consumer_factory=broker.consumer,
+                          admin_factory=broker.admin)
+
+
+if __name__ == "__main__":
+    for handler_seconds in [HANDLER_SECONDS, 0]:
+        print(f"Handlers taking {handler_seconds * 1000:.0f} ms")
+        # The Kafka to HTTP loopback handled one event at a time
+        run("kafka, one event at a time (before)", kafka_transport, 1, handler_seconds)
+        run("kafka, 8 workers", kafka_transport, 8, handler_seconds)
+        run("in process, 8 workers", InProcessTransport, 8, handler_seconds)
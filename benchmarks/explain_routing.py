@@ -0,0 +1,99 @@
+"""
+Latency of /explain requests when every request is routed by the LLM supervisor (before) and when common requests are
+routed by the local intent router (after). The models are local fakes: the LLM router takes ROUTER_SECONDS to pick a
+worker and the worker takes ANSWER_SECONDS to answer. Runs without network access.
+
+Run from the repository root:
+    python -m benchmarks.explain_routing
+"""
+import os
+import statistics
+import time
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from agents.intent_router import IntentRouter
+from services.explanation_cache import ExplanationCache
+from services.models import get_model_registry
+
+ROUTER_SECONDS = 0.3
+ANSWER_SECONDS = 0.1
+SELECTION = "A binary heap is a complete binary tree. Quiz questions on heaps often ask about sift down."
+QUERIES = [
+    "What does complete mean here?",
+    "explain sift down",
+    "Why is it stored in an array?",
+    "Can you give an example?",
+    "how fast is insert",
+    "what is the difference to a BST",
+    "simplify this",
+    "heaps",
+]
+
+
+class FakeRouterModel:
+    """
+    Stands in for the supervisor's ChatOpenAI, always routes to the general chat agent.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        return RunnableLambda(self._route)
+
+    def _route(self, messages):
+        self.calls += 1
+        time.sleep(ROUTER_SECONDS)
+        return {"reason": "The user asked a question", "next": "general_chat_agent"}
+
+
+class FakeChatModel:
+    def invoke(self, messages):
+        time.sleep(ANSWER_SECONDS)
+        return AIMessage(content="A complete tree has every level filled except maybe the last.")
+
+
+def measure(client) -> list[float]:
+    timings = []
+    for query in QUERIES:
+        start = time.perf_counter()
+        response = client.post("/explain", json={"query": query, "selection": SELECTION})
+        assert response.status_code == 200 and "complete tree" in response.json["response"]
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+if __name__ == "__main__":
+    router_model = FakeRouterModel()
+    get_model_registry().set("supervisor", router_model)
+    get_model_registry().set("general_chat_agent", FakeChatModel())
+
+    from app import app, study_guide_supervisor_instance
+
+    client = app.test_client()
+    # Every question is asked twice, the explanation cache would answer the second time
+    study_guide_supervisor_instance.explanation_cache = ExplanationCache(max_entries=0)
+    study_guide_supervisor_instance.router = None
+    before = measure(client)
+    before_calls = router_model.calls
+
+    router = study_guide_supervisor_instance.router = IntentRouter()
+    router_model.calls = 0
+    after = measure(client)
+    # "heaps" matches no rule and is left to the LLM router
+    assert router_model.calls == 1, router_model.calls
+    assert client.get("/metrics/router").json["local"] == router.stats()["local"]
+    stats = router.stats()
+    assert stats["local"] == len(QUERIES) - 1 and stats["fallback"] == 1
+
+    print(f"{len(before)} /explain questions, LLM router {ROUTER_SECONDS * 1000:.0f} ms, "
+          f"answer {ANSWER_SECONDS * 1000:.0f} ms")
+    print(f"   before (LLM router): p50 {statistics.median(before) * 1000:.0f} ms, {before_calls} routing calls")
+    print(f"  after (local router): p50 {statistics.median(after) * 1000:.0f} ms, {router_model.calls} routing calls")
+    print(f"  router: {stats['local']} of {stats['requests']} routed locally ({stats['hit_rate']:.0%}, "
+          f"{stats['avg_local_seconds'] * 1e6:.0f} us each), {stats['seconds_saved']:.1f} s saved")
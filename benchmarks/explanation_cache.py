@@ -0,0 +1,103 @@
+"""
+Latency of /explain for a cohort of STUDENTS students who highlight the same paragraphs of the same study guide and
+ask the same few questions, without the explanation cache (before) and with it (after). The chat model is a local fake
+that takes ANSWER_SECONDS to answer. Also checks that cached answers are generated without the student's message
+history and not added to it, and that questions asked before there is a study guide are not cached.
+
+Run from the repository root:
+    python -m benchmarks.explanation_cache
+"""
+import os
+import statistics
+import time
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_core.messages import AIMessage
+
+from services.explanation_cache import ExplanationCache
+from services.models import get_model_registry
+
+STUDENTS = 20
+ANSWER_SECONDS = 0.3
+STUDY_GUIDE = "# Heaps\nA binary heap is a complete binary tree.\n\nHeaps are stored in arrays."
+SELECTIONS = ["A binary heap is a complete binary tree.", "Heaps are stored in arrays."]
+QUERIES = ["What does this mean?", "what does this mean", "Can you give an example?"]
+
+
+class FakeChatModel:
+    def __init__(self):
+        self.calls = 0
+        self.messages = []
+
+    def invoke(self, messages):
+        self.calls += 1
+        self.messages = messages
+        time.sleep(ANSWER_SECONDS)
+        return AIMessage(content="Every level of the tree is full, except maybe the last.")
+
+
+def supervisor_config(username: str) -> dict:
+    from agents.user_store import get_thread_id
+    return {"configurable": {"thread_id": get_thread_id(username)}}
+
+
+def measure(client, supervisor) -> list[float]:
+    timings = []
+    for student in range(STUDENTS):
+        username = f"student-{student}"
+        with client.session_transaction() as session:
+            session["username"] = username
+        supervisor.graph.update_state(supervisor_config(username),
+                                      {"username": username, "study_guide": STUDY_GUIDE})
+        for selection in SELECTIONS:
+            for query in QUERIES:
+                start = time.perf_counter()
+                response = client.post("/explain", json={"query": query, "selection": selection})
+                assert response.status_code == 200 and "Every level" in response.json["response"]
+                timings.append(time.perf_counter() - start)
+    return timings
+
+
+if __name__ == "__main__":
+    chat_model = FakeChatModel()
+    get_model_registry().set("general_chat_agent", chat_model)
+
+    from app import app, study_guide_supervisor_instance as supervisor
+
+    client = app.test_client()
+    supervisor.explanation_cache = ExplanationCache(max_entries=0)
+    before = measure(client, supervisor)
+    before_calls = chat_model.calls
+
+    supervisor.explanation_cache = ExplanationCache(max_entries=1000, ttl_seconds=60)
+    chat_model.calls = 0
+    history = len(supervisor.graph.get_state(supervisor_config("student-1")).values["messages"])
+    routed = supervisor.router.stats()["routes"].get("general_chat_agent", 0)
+    after = measure(client, supervisor)
+    # Student 0 asked first, every other student got cached answers
+    after_calls = chat_model.calls
+    assert after_calls == len(SELECTIONS) * 2, after_calls
+    assert len(supervisor.graph.get_state(supervisor_config("student-1")).values["messages"]) == history, \
+        "Cached answers are not added to the message history"
+    assert len(chat_model.messages) == 3, "Cached answers only depend on the study guide, selection and question"
+    stats = client.get("/metrics/explanations").json
+    assert stats["misses"] == len(SELECTIONS) * 2, stats
+    # Answered outside of the graph, and still counted as routed locally
+    router_stats = client.get("/metrics/router").json
+    assert router_stats["routes"]["general_chat_agent"] - routed == STUDENTS * len(SELECTIONS) * len(QUERIES), \
+        router_stats
+
+    # Without a study guide the answer depends on the student's history, it is neither looked up nor cached
+    with client.session_transaction() as session:
+        session["username"] = "new-student"
+    response = client.post("/explain", json={"query": QUERIES[0], "selection": SELECTIONS[0]})
+    assert response.status_code == 200 and client.get("/metrics/explanations").json == stats
+
+    print(f"{STUDENTS} students x {len(SELECTIONS) * len(QUERIES)} /explain questions, "
+          f"answer {ANSWER_SECONDS * 1000:.0f} ms")
+    print(f"   before (no cache): mean {statistics.mean(before) * 1000:.0f} ms, {before_calls} chat calls")
+    print(f"  after (cached): mean {statistics.mean(after) * 1000:.0f} ms, "
+          f"p50 {statistics.median(after) * 1000:.1f} ms, {after_calls} chat calls, "
+          f"hit rate {stats['hit_rate']:.0%}")
@@ -0,0 +1,110 @@
+"""
+Time to grade a quiz answer, until its background grading job is done, when graded quiz questions are published to
+Kafka with a flush after every event (before) and with the batched fire-and-forget producer (after). The broker is an in-memory stand-in with a round trip delay and the
+grading LLM answers right away, so the difference is the time spent publishing.
+Only the producer side is measured, nothing consumes the events.
+
+Run from the repository root:
+    python -m benchmarks.grade_quiz_latency
+"""
+import os
+import statistics
+import threading
+import time
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_core.messages import AIMessage
+
+from services import agent_pub_sub
+from services.agent_pub_sub import KafkaTransport
+from services.memory_broker import MemoryBroker
+from services.models import get_model_registry
+
+REQUESTS = 200
+BROKER_ROUND_TRIP_SECONDS = 0.01
+
+
+class FakeGraderModel:
+    """
+    Stands in for the quiz grader's ChatOpenAI, recording how many gradings ran at once.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.active = 0
+        self.most_active = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages):
+        with self._lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.active -= 1
+        return AIMessage(content="4 is correct because 2 + 2 = 4.")
+
+
+class ProducerOnlyTransport(KafkaTransport):
+    def start(self):
+        pass
+
+
+class FlushEveryEventTransport(ProducerOnlyTransport):
+    """
+    Publishes the way the events were published before: send, then wait for the broker.
+    """
+
+    def publish(self, topic, event):
+        super().publish(topic, event)
+        self.flush()
+
+
+def measure(client, grading_jobs) -> list[float]:
+    answer = {"question": "What is 2+2?", "answer": "4", "selected": "4", "subject": "Math", "topic": "Addition"}
+    timings = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        response = client.post("/grade_quiz", json=answer)
+        assert response.status_code == 200
+        job = grading_jobs.get(response.json["explanation_url"].rsplit("/", 1)[1])
+        assert job.wait(5) and job.status == "done"
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+if __name__ == "__main__":
+    grader = FakeGraderModel()
+    get_model_registry().set("quiz_grader", grader)
+    broker = MemoryBroker(latency_seconds=BROKER_ROUND_TRIP_SECONDS)
+    agent_pub_sub.set_transport(ProducerOnlyTransport(agent_pub_sub._dispatcher, producer_factory=broker.producer,
+                                                      admin_factory=broker.admin))
+
+    from app import app, grading_jobs, study_guide_supervisor_instance
+    from agents.user_store import get_thread_id
+
+    # The student has opened a study guide before taking the quiz
+    study_guide_supervisor_instance.graph.update_state(
+        {"configurable": {"thread_id": get_thread_id("Anonymous")}},
+        {"username": "Anonymous", "subject": "Math", "topic": "Addition"})
+    client = app.test_client()
+    for label, transport_type in [("before (flush per event)", FlushEveryEventTransport),
+                                  ("after (batched, no flush)", ProducerOnlyTransport)]:
+        transport = transport_type(agent_pub_sub._dispatcher, producer_factory=broker.producer,
+                                   admin_factory=broker.admin)
+        agent_pub_sub.set_transport(transport)
+        timings = measure(client, grading_jobs)
+        transport.flush()
+        percentiles = statistics.quantiles(timings, n=100)
+        print(f"{label:>26}: p50 {percentiles[49] * 1000:.1f} ms, p99 {percentiles[98] * 1000:.1f} ms")
+
+    # Answers submitted in a burst are graded on parallel jobs, but the graph runs of one student's thread don't
+    # overlap, otherwise they would start from the same checkpoint and overwrite each other's messages
+    grader.seconds = 0.02
+    answer = {"question": "What is 2+2?", "answer": "4", "selected": "4", "subject": "Math", "topic": "Addition"}
+    responses = [client.post("/grade_quiz", json={**answer, "question": f"What is 2+{i}?"}) for i in range(16)]
+    jobs = [grading_jobs.get(response.json["explanation_url"].rsplit("/", 1)[1]) for response in responses]
+    assert all(job.wait(10) and job.status == "done" for job in jobs)
+    assert grader.most_active == 1, grader.most_active
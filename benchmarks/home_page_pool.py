@@ -0,0 +1,70 @@
+"""
+Requests per second on the home page with and without the SQLite connection pool, under a threaded WSGI server.
+The page is served the way "/" serves an anonymous user: the catalog is read from study_material.db and rendered.
+app.py itself is not imported, so that the agents and their models are not created.
+
+Run from the repository root:
+    python -m benchmarks.home_page_pool
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CLIENTS = 16
+DURATION_SECONDS = 5
+PORT = 5099
+
+
+def serve_and_measure() -> float:
+    import logging
+
+    from flask import Flask, render_template
+    from werkzeug.serving import make_server
+
+    from agents.user_store import default_tutor_content
+
+    app = Flask(__name__, template_folder=os.path.join(os.getcwd(), "templates"))
+
+    @app.route("/")
+    def tutor():
+        tutor_content = default_tutor_content()
+        return render_template("tutor.html", subjects=tutor_content.subjects, username=None, teaching_style=None)
+
+    # Only linked to from the page
+    app.add_url_rule("/study_guide", "study_guide", lambda: "")
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", PORT, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    deadline = time.perf_counter() + DURATION_SECONDS
+
+    def client() -> int:
+        count = 0
+        while time.perf_counter() < deadline:
+            with urllib.request.urlopen(f"http://127.0.0.1:{PORT}/") as response:
+                response.read()
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CLIENTS) as executor:
+        total = sum(executor.map(lambda _: client(), range(CLIENTS)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    return total / elapsed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(f"{serve_and_measure():.1f}")
+    else:
+        for label, pool_size in [("without pool", "0"), ("with pool", "8")]:
+            env = {**os.environ, "STUDY_MATERIAL_DB_POOL_SIZE": pool_size}
+            output = subprocess.run([sys.executable, "-m", "benchmarks.home_page_pool", "--child"], env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            print(f"{label:>12}: {output.strip().splitlines()[-1]} requests/second")
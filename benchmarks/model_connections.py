@@ -0,0 +1,119 @@
+"""
+TCP connections opened to an OpenAI compatible server by 8 threads making 10 chat and speech calls each, with a new
+ChatOpenAI and OpenAI client per call (before) and with the shared clients of the model registry (after).
+The server is a local stub that answers every chat completion with the same message and counts accepted connections.
+Also checks the per model call and token counters of the registry.
+
+Run from the repository root:
+    python -m benchmarks.model_connections
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+THREADS = 8
+CALLS_PER_THREAD = 10
+COMPLETION = {
+    "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "4 is correct because 2 + 2 = 4."}}],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 9, "total_tokens": 21},
+}
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(0.005)
+        if self.path.endswith("/audio/speech"):
+            body, content_type = b"ID3 fake mp3", "audio/mpeg"
+        else:
+            body, content_type = json.dumps(COMPLETION).encode("utf-8"), "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Clients that open a connection per call connect faster than the default backlog of 5 is accepted
+    request_queue_size = 128
+
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = StubOpenAIServer(("127.0.0.1", 0), StubOpenAIHandler)
+    server.connections = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def count_connections(server: ThreadingHTTPServer, call) -> int:
+    before = server.connections
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        for future in [executor.submit(call) for _ in range(THREADS * CALLS_PER_THREAD)]:
+            future.result()
+    return server.connections - before
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+
+    from langchain_openai import ChatOpenAI
+    from openai import OpenAI
+
+    from services.governor import ModelGovernor, ModelLimits
+    from services.models import ModelRegistry
+    from services.tts import OpenAISpeech
+
+    messages = [{"role": "user", "content": "What is 2+2?"}]
+
+
+    def call_before():
+        assert ChatOpenAI(model="gpt-4o", temperature=0).invoke(messages).content.startswith("4")
+        OpenAISpeech(OpenAI())("Heaps are trees.", "fable", "gpt-4o-mini-tts", "Speak calmly.")
+
+
+    # Only connections are compared here, the calls are not throttled
+    registry = ModelRegistry(governor=ModelGovernor(default_limits=ModelLimits(0, 0, 0)))
+
+
+    def call_after():
+        assert registry.get("quiz_grader").invoke(messages).content.startswith("4")
+        OpenAISpeech(registry.openai_client())("Heaps are trees.", "fable", "gpt-4o-mini-tts", "Speak calmly.")
+
+
+    # The openai package builds its response models on first use, which is not thread safe
+    call_before()
+    before = count_connections(server, call_before)
+    after = count_connections(server, call_after)
+    assert after <= THREADS, after
+    metrics = registry.metrics()["quiz_grader"]
+    assert metrics["calls"] == THREADS * CALLS_PER_THREAD and metrics["errors"] == 0, metrics
+    assert metrics["input_tokens"] == 12 * metrics["calls"] and metrics["output_tokens"] == 9 * metrics["calls"]
+
+    print(f"{THREADS * CALLS_PER_THREAD} chat and speech calls from {THREADS} threads")
+    print(f"   before (new clients per call): {before} connections")
+    print(f"  after (shared registry clients): {after} connections")
+    print(f"              quiz_grader metrics: {metrics}")
+    server.shutdown()
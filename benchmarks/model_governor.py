@@ -0,0 +1,181 @@
+"""
+A burst of background model calls (progress updates, study guide rebuilds) with interactive calls (quiz grading)
+arriving while it runs, against a local stub of the OpenAI API that enforces LIMIT_RPS requests per second and
+LIMIT_CONCURRENCY concurrent requests per model and answers 429 beyond that. Compares calls made directly with the
+OpenAI client's own retries (before) to calls that go through the governor of the model registry (after): failed
+calls, 429s and the latency of interactive and background calls, and the queue depth sampled while they run.
+
+Run from the repository root:
+    python -m benchmarks.model_governor
+"""
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+LIMIT_RPS = 40
+LIMIT_CONCURRENCY = 4
+RESPONSE_SECONDS = 0.05
+BACKGROUND_CALLS = 100
+INTERACTIVE_CALLS = 20
+INTERACTIVE_INTERVAL_SECONDS = 0.05
+COMPLETION = {
+    "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "4 is correct because 2 + 2 = 4."}}],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 9, "total_tokens": 21},
+}
+
+
+class LimitedOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Answers chat completions like a rate limited model: a bucket of LIMIT_RPS requests that refills LIMIT_RPS per
+    second, and at most LIMIT_CONCURRENCY requests at a time.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server.lock:
+            now = time.monotonic()
+            server.tokens = min(LIMIT_RPS, server.tokens + (now - server.updated) * LIMIT_RPS)
+            server.updated = now
+            allowed = server.tokens >= 1 and server.in_flight < LIMIT_CONCURRENCY
+            if allowed:
+                server.tokens -= 1
+                server.in_flight += 1
+            else:
+                server.rejected += 1
+        if not allowed:
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests",
+                                         "code": "rate_limit_exceeded"}}).encode("utf-8")
+            self.send_response(429)
+        else:
+            time.sleep(RESPONSE_SECONDS)
+            with server.lock:
+                server.in_flight -= 1
+            body = json.dumps(COMPLETION).encode("utf-8")
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LimitedOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_stub_server() -> LimitedOpenAIServer:
+    server = LimitedOpenAIServer(("127.0.0.1", 0), LimitedOpenAIHandler)
+    server.lock = threading.Lock()
+    server.tokens = LIMIT_RPS
+    server.updated = time.monotonic()
+    server.in_flight = 0
+    server.rejected = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_burst(registry) -> dict:
+    """
+    Background calls all start at once, interactive calls arrive one by one while they run.
+    """
+    from services.governor import model_priority
+
+    messages = [{"role": "user", "content": "What is 2+2?"}]
+    latencies = {"interactive": [], "background": []}
+    failures = {"interactive": 0, "background": 0}
+    lock = threading.Lock()
+
+    def call(priority: str, model_name: str):
+        start = time.perf_counter()
+        try:
+            with model_priority(priority):
+                registry.get(model_name).invoke(messages)
+            with lock:
+                latencies[priority].append(time.perf_counter() - start)
+        except Exception:
+            with lock:
+                failures[priority] += 1
+
+    max_queued = 0
+    done = threading.Event()
+
+    def sample_queue():
+        nonlocal max_queued
+        while not done.wait(0.01):
+            for stats in registry.governor.stats().values():
+                max_queued = max(max_queued, sum(stats["queued"].values()))
+
+    sampler = threading.Thread(target=sample_queue)
+    sampler.start()
+    with ThreadPoolExecutor(max_workers=BACKGROUND_CALLS + INTERACTIVE_CALLS) as executor:
+        futures = [executor.submit(call, "background", "study_progress") for _ in range(BACKGROUND_CALLS)]
+        for _ in range(INTERACTIVE_CALLS):
+            time.sleep(INTERACTIVE_INTERVAL_SECONDS)
+            futures.append(executor.submit(call, "interactive", "quiz_grader"))
+        for future in futures:
+            future.result()
+    done.set()
+    sampler.join()
+    return {"latencies": latencies, "failures": failures, "max_queued": max_queued}
+
+
+def report(label: str, result: dict, rejected: int):
+    latencies, failures = result["latencies"], result["failures"]
+    p50 = {priority: statistics.median(values) * 1000 if values else float("nan")
+           for priority, values in latencies.items()}
+    print(f"{label:>30}: {sum(failures.values())} failed ({failures['interactive']} interactive), "
+          f"{rejected} 429s, interactive p50 {p50['interactive']:.0f} ms, background p50 {p50['background']:.0f} ms, "
+          f"max queue depth {result['max_queued']}")
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+
+    import httpx
+
+    from services.governor import ModelGovernor, ModelLimits
+    from services.models import ModelRegistry
+
+    # Both models are gpt-4o, so they share the model's limits
+    limits = ModelLimits(requests_per_minute=LIMIT_RPS * 60, tokens_per_minute=0, max_concurrency=LIMIT_CONCURRENCY)
+    ungoverned = ModelRegistry(http_client=httpx.Client(), governor=ModelGovernor(default_limits=limits),
+                               max_retries=2)
+    governed = ModelRegistry(governor=ModelGovernor(default_limits=limits, backoff_seconds=0.05))
+    # The openai package builds its response models on first use, which is not thread safe
+    ungoverned.get("quiz_grader").invoke("Hi")
+    time.sleep(1)
+
+    rejected = server.rejected
+    before = run_burst(ungoverned)
+    before_rejected, rejected = server.rejected - rejected, server.rejected
+    time.sleep(1)
+    after = run_burst(governed)
+    after_rejected = server.rejected - rejected
+
+    assert sum(after["failures"].values()) == 0, after["failures"]
+    assert statistics.median(after["latencies"]["interactive"]) < statistics.median(after["latencies"]["background"])
+    assert after["max_queued"] > 0
+    stats = governed.governor.stats()["gpt-4o"]
+    assert stats["calls"] >= BACKGROUND_CALLS + INTERACTIVE_CALLS and stats["in_flight"] == 0, stats
+
+    print(f"{BACKGROUND_CALLS} background and {INTERACTIVE_CALLS} interactive gpt-4o calls, "
+          f"limits {LIMIT_RPS} requests/s and {LIMIT_CONCURRENCY} concurrent")
+    report("before (client retries only)", before, before_rejected)
+    report("after (governor)", after, after_rejected)
+    server.shutdown()
@@ -0,0 +1,112 @@
+"""
+Counts the progress LLM calls and study guide regenerations of a scripted session where a student answers 20 quiz
+questions in a row, with and without batching of graded quiz questions in the study progress agent.
+
+Run from the repository root:
+    python -m benchmarks.progress_debounce
+"""
+import atexit
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+
+import agents.study_progress as study_progress
+import services.event_dispatch as event_dispatch
+from agents.study_progress import StudyProgressAgent, Progress
+from services.agent_pub_sub import KafkaTransport, QuizQuestionEvent, QUIZ_QUESTION_TOPIC
+from services.event_dispatch import EventDispatcher
+from services.memory_broker import MemoryBroker
+
+ANSWERS = 20
+SECONDS_BETWEEN_ANSWERS = 0.05
+LLM_SECONDS = 0.02
+
+
+class FakeProgressModel:
+    """
+    Stands in for gpt-4o with structured output, counting calls.
+    """
+
+    def __init__(self, failures: int = 0):
+        self.calls = 0
+        self.failures = failures
+
+    def with_structured_output(self, schema):
+        return self
+
+    def invoke(self, messages):
+        self.calls += 1
+        time.sleep(LLM_SECONDS)
+        if self.calls <= self.failures:
+            raise RuntimeError("Error code: 500 - The server had an error")
+        return Progress(next_level=2, progress_summary="Knows the basics")
+
+
+def run_session(debounce_seconds: float, failures: int = 0) -> tuple[int, int]:
+    published = []
+    study_progress.update_study_progress = published.append
+
+    model = FakeProgressModel(failures)
+    agent = StudyProgressAgent(model=model, debounce_seconds=debounce_seconds, max_batch_size=10)
+    for i in range(ANSWERS):
+        agent.inject_graded_quiz_question("alice", f"Question {i}: answered correctly", "Algorithms", "Sorting")
+        time.sleep(SECONDS_BETWEEN_ANSWERS)
+    time.sleep(debounce_seconds + 0.5)
+    agent.flush_all()
+    agent.dispatcher.join(10)
+    return model.calls, len(published)
+
+
+def exit_with_batch():
+    """
+    Exits while a batch waits for its debounce delay, with the progress update registered with atexit like app.py.
+    """
+    agent = StudyProgressAgent(model=FakeProgressModel(), debounce_seconds=60)
+    # atexit calls the last registered function first, the summary is printed after the progress update
+    atexit.register(lambda: print(agent.graph.get_state(agent.get_config("alice")).values["subjects"]["Algorithms"]
+                                  .topics["Sorting"].summary))
+    atexit.register(agent.flush_at_exit)
+    agent.inject_graded_quiz_question("alice", "Question 0: answered correctly", "Algorithms", "Sorting")
+
+
+if __name__ == "__main__" and sys.argv[1:] == ["--exit-with-batch"]:
+    exit_with_batch()
+elif __name__ == "__main__":
+    for label, debounce_seconds in [("before (no batching)", 0), ("after (1s debounce)", 1.0)]:
+        llm_calls, regenerations = run_session(debounce_seconds)
+        print(f"{label:>22}: {llm_calls} progress LLM calls, {regenerations} study guide regenerations "
+              f"for {ANSWERS} answers")
+
+    # A failing progress update of a batch is retried on the event dispatcher instead of being lost
+    event_dispatch.RETRY_BACKOFF_SECONDS = 0
+    llm_calls, regenerations = run_session(1.0, failures=1)
+    assert (llm_calls, regenerations) == (3, 2), (llm_calls, regenerations)
+
+    # Over Kafka, the offsets of batched quiz answers are only committed once their batch was flushed, so answers that
+    # were consumed but not flushed yet are consumed again after a crash
+    broker = MemoryBroker()
+    dispatcher = EventDispatcher(name="progress_kafka")
+    agent = StudyProgressAgent(model=FakeProgressModel(), debounce_seconds=1.0, dispatcher=dispatcher)
+    dispatcher.subscribe(QUIZ_QUESTION_TOPIC, agent.handle_quiz_question)
+    transport = KafkaTransport(dispatcher, producer_factory=broker.producer, consumer_factory=broker.consumer,
+                               admin_factory=broker.admin, partitions=1)
+    transport.start()
+    for i in range(3):
+        transport.publish(QUIZ_QUESTION_TOPIC, QuizQuestionEvent(username="alice", subject="Algorithms",
+                                                                 topic="Sorting", quiz_question=f"Question {i}"))
+    time.sleep(0.5)
+    assert broker.committed("study_progress_forwarder", QUIZ_QUESTION_TOPIC) == 0
+    time.sleep(1.5)
+    assert broker.committed("study_progress_forwarder", QUIZ_QUESTION_TOPIC) == 3
+    transport.stop()
+
+    # A batch that is still waiting when the process exits gets its progress update, and it is checkpointed
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "CHECKPOINTER": "sqlite", "CHECKPOINT_DB_PATH": os.path.join(tmp, "checkpoints.db")}
+        output = subprocess.run([sys.executable, "-m", "benchmarks.progress_debounce", "--exit-with-batch"], env=env,
+                                capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == "Knows the basics", output
@@ -0,0 +1,65 @@
+"""
+Measures the size of the progress update prompt as a student keeps answering quiz questions on one topic, with the
+full quiz history in the prompt and with incremental summarization.
+
+Run from the repository root:
+    python -m benchmarks.progress_prompt_size
+"""
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+
+import agents.study_progress as study_progress
+from agents.message_compaction import CHARS_PER_TOKEN
+from agents.study_progress import StudyProgressAgent, Progress
+from services.quiz_archive import get_archived_quiz_questions
+
+ANSWERS = 200
+REPORT_EVERY = 50
+
+
+class FakeProgressModel:
+    """
+    Stands in for gpt-4o with structured output, recording the size of every prompt.
+    """
+
+    def __init__(self):
+        self.prompt_tokens: list[int] = []
+
+    def with_structured_output(self, schema):
+        return self
+
+    def invoke(self, messages):
+        self.prompt_tokens.append(sum(len(message["content"]) for message in messages) // CHARS_PER_TOKEN)
+        return Progress(next_level=2, progress_summary="Knows how merge sort splits and merges, unsure about "
+                                                       "the stability of quick sort.")
+
+
+def run_session(mode: str, username: str) -> list[int]:
+    study_progress.update_study_progress = lambda event: None
+    model = FakeProgressModel()
+    agent = StudyProgressAgent(model=model, debounce_seconds=0, mode=mode, recent_questions=10)
+    for i in range(ANSWERS):
+        agent.inject_graded_quiz_question(
+            username, f'{{"question": "Sorting question {i}", "answer": "Answer {i}", "correct": {i % 3 != 0}}}',
+            "Algorithms", "Sorting")
+    return model.prompt_tokens
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CHECKPOINT_DB_PATH"] = str(Path(tmp) / "checkpoints.db")
+        for mode in ["full", "incremental"]:
+            # The checkpointer is shared between agents, so every run gets its own student
+            username = f"alice-{mode}"
+            prompt_tokens = run_session(mode, username)
+            sizes = ", ".join(f"answer {i}: {prompt_tokens[i - 1]}" for i in range(REPORT_EVERY, ANSWERS + 1,
+                                                                                       REPORT_EVERY))
+            print(f"{mode:>12}: prompt tokens {sizes}")
+
+            agent = StudyProgressAgent(model=FakeProgressModel(), debounce_seconds=0)
+            topic = agent.graph.get_state(agent.get_config(username)).values["subjects"]["Algorithms"].topics["Sorting"]
+            archived = get_archived_quiz_questions(username, "Algorithms", "Sorting")
+            print(f"{'':>12}  {len(topic.quiz_questions)} questions checkpointed, {len(archived)} archived")
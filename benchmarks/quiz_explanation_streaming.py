@@ -0,0 +1,116 @@
+"""
+Latency of /grade_quiz, which returns whether the answer is correct right away, compared to the first token and the
+end of the explanation streamed from its explanation_stream_url. Before, the response waited for the whole explanation.
+The quiz grader runs with a fake chat model that streams its explanation token by token after a delay.
+
+Run from the repository root:
+    python -m benchmarks.quiz_explanation_streaming
+"""
+import os
+import re
+import statistics
+import time
+from typing import Any, Iterator
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+# The progress update of the graded questions is awaited on the in-process event dispatcher
+os.environ["EVENT_TRANSPORT"] = "inprocess"
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import agents.study_progress as study_progress
+from agents.study_progress import Progress
+from services import agent_pub_sub
+from services.models import get_model_registry
+
+ANSWERS = 10
+MODEL_SECONDS = 0.3
+TOKEN_SECONDS = 0.01
+EXPLANATION = ("The sum of 2 and 2 is 4, so the selected answer 3 is not correct. Adding two to two means counting two "
+               "more after two: three, four. ") * 3
+
+
+class FakeGraderModel(BaseChatModel):
+    """
+    Stands in for the quiz grader's ChatOpenAI, streams EXPLANATION one word at a time.
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-grader"
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(MODEL_SECONDS + TOKEN_SECONDS * len(EXPLANATION.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=EXPLANATION))])
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager: CallbackManagerForLLMRun | None = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(MODEL_SECONDS)
+        for token in re.findall(r"\S+\s*", EXPLANATION):
+            time.sleep(TOKEN_SECONDS)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeProgressModel:
+    """
+    Stands in for the study progress agent's gpt-4o with structured output.
+    """
+
+    def with_structured_output(self, schema):
+        return self
+
+    def invoke(self, messages):
+        return Progress(next_level=2, progress_summary="Adds small numbers")
+
+
+if __name__ == "__main__":
+    get_model_registry().set("quiz_grader", FakeGraderModel())
+    get_model_registry().set("study_progress", FakeProgressModel())
+    # Only the progress updates are checked, study guides are not rebuilt from them
+    progress_updates = []
+    study_progress.update_study_progress = progress_updates.append
+
+    from app import app, study_guide_supervisor_instance
+    from agents.user_store import get_thread_id
+
+    # The student has opened a study guide before taking the quiz
+    study_guide_supervisor_instance.graph.update_state(
+        {"configurable": {"thread_id": get_thread_id("Anonymous")}},
+        {"username": "Anonymous", "subject": "Math", "topic": "Addition"})
+    client = app.test_client()
+
+    responses, first_tokens, explanations = [], [], []
+    for i in range(ANSWERS):
+        answer = {"question": f"What is 2+2? ({i})", "answer": "4", "selected": "3", "subject": "Math",
+                  "topic": "Addition"}
+        start = time.perf_counter()
+        response = client.post("/grade_quiz", json=answer)
+        responses.append(time.perf_counter() - start)
+        assert response.status_code == 200 and response.json["correct"] is False
+
+        stream = client.get(response.json["explanation_stream_url"], buffered=False)
+        tokens = []
+        for chunk in stream.response:
+            text = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if text.startswith("event: token"):
+                if not tokens:
+                    first_tokens.append(time.perf_counter() - start)
+                tokens.append(text)
+            elif text.startswith("event: done"):
+                assert "The sum of 2 and 2 is 4" in text
+                break
+        explanations.append(time.perf_counter() - start)
+        assert len(tokens) == len(EXPLANATION.split())
+    # The graded questions were published to the progress agent, which updated the progress once for the batch
+    assert agent_pub_sub._dispatcher.join(5) and len(progress_updates) == 1, progress_updates
+
+    print(f"  correctness: p50 {statistics.median(responses) * 1000:.1f} ms")
+    print(f"  first token: p50 {statistics.median(first_tokens) * 1000:.0f} ms")
+    print(f"  explanation: p50 {statistics.median(explanations) * 1000:.0f} ms (what the response waited for before)")
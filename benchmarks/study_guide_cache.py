@@ -0,0 +1,89 @@
+"""
+Time for new students to get the study guide of a topic, when the first one generates it and the others get it from
+the shared study guide cache. A change to the builder's prompt template invalidates the cached study guides.
+The study guide builder runs with the fake chat model of the streaming benchmark.
+Also checks that shared study guides are generated without the student's name, and that every student of a podcast
+study guide gets their own audio.
+
+Run from the repository root:
+    python -m benchmarks.study_guide_cache
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import agents.instruction_reader as instruction_reader
+import agents.study_guide_builder_react as study_guide_builder_react
+from agents.study_guide_supervisor import StudyGuideSupervisorAgent
+from benchmarks.study_guide_streaming import FakeStreamingChatModel
+from services.study_guide_cache import StudyGuideCache
+from services.tts import set_audio_synthesizer
+
+STUDENTS = 5
+builder_requests = []
+
+
+class RecordingModel(FakeStreamingChatModel):
+    """
+    Records the messages the study guide builder was called with in builder_requests.
+    """
+
+    def _respond(self, messages):
+        builder_requests.append(" ".join(str(message.content) for message in messages))
+        return super()._respond(messages)
+
+
+class RecordingSynthesizer:
+    """
+    Stands in for the audio synthesizer, records the audio files written.
+    """
+
+    def __init__(self):
+        self.paths = []
+
+    def synthesize(self, text: str, path: str):
+        self.paths.append(Path(path).relative_to(Path.cwd()).as_posix())
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = StudyGuideCache(str(Path(tmp) / "cache.db"))
+        study_guide_builder_react.init_study_guide_builder_agent(llm=RecordingModel(), cache=cache)
+        supervisor = StudyGuideSupervisorAgent()
+
+
+        def new_student(username: str) -> float:
+            start = time.perf_counter()
+            state = supervisor.find_existing_study_guide_or_create(username, "Data Structures", "Heap", "textbook")
+            assert "A heap is a complete binary tree" in state["study_guide"]
+            return time.perf_counter() - start
+
+
+        timings = [new_student(f"student-{i}") for i in range(STUDENTS)]
+        assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == STUDENTS - 1, cache.stats()
+        assert builder_requests and not any("student-0" in request for request in builder_requests)
+
+        # Podcast students share the text, the audio is their own
+        synthesizer = RecordingSynthesizer()
+        set_audio_synthesizer(synthesizer)
+        podcasts = [supervisor.find_existing_study_guide_or_create(f"listener-{i}", "Data Structures", "Stack",
+                                                                   "podcast") for i in range(3)]
+        assert cache.stats()["misses"] == 2, cache.stats()
+        assert [state["audio_file_location"] for state in podcasts] == synthesizer.paths == [
+            f"audio/listener-{i}_Data Structures_Stack.mp3" for i in range(3)], synthesizer.paths
+
+        # Changing the prompt template makes the next student generate a new study guide
+        name = "study_guide_builder_react_prompt"
+        source, _, _ = instruction_reader.env.loader.get_source(instruction_reader.env, f"{name}.jinja2")
+        instruction_reader.template_dict[name] = instruction_reader.env.from_string(
+            source + "\nInclude a worked example.")
+        changed_prompt = new_student("student-after-prompt-change")
+        assert cache.stats()["misses"] == 3, cache.stats()
+
+        print(f"        first student: {timings[0]:.2f} s (generated)")
+        print(f"       other students: {max(timings[1:]) * 1000:.0f} ms at most (cached)")
+        print(f"after a prompt change: {changed_prompt:.2f} s (generated)")
+        print(f"                stats: {cache.stats()}")
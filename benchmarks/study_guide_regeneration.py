@@ -0,0 +1,188 @@
+"""
+Time to regenerate the stale study guides of USERS synthetic users (two topics each) after a prompt change, one graph
+invocation after the other (before) and with the bulk regenerator (after). The study guide builder runs with a fake
+chat model that takes LLM_SECONDS per answer and fails every FAILURE_EVERY-th call with a rate limit error.
+Students without progress share study guides through the study guide cache, the others get their own.
+The bulk run is interrupted half way and resumed, and afterwards no study guide is stale while the students'
+conversations and current topics are left as they were.
+
+Run from the repository root:
+    python -m benchmarks.study_guide_regeneration
+"""
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+tmp = tempfile.TemporaryDirectory()
+os.environ["CHECKPOINT_DB_PATH"] = str(Path(tmp.name) / "checkpoints.db")
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+import agents.study_guide_builder_react as study_guide_builder_react
+from agents.study_guide_builder_react import StudyGuide, study_guide_version
+from agents.study_guide_regeneration import StaleStudyGuide, StudyGuideRegenerator
+from agents.study_guide_supervisor import StudyGuideSupervisorAgent
+from agents.user_store import get_thread_id
+from model.tutor import Subject, Topic, TutorContent
+from services.study_guide_cache import StudyGuideCache
+
+USERS = 2000
+SERIAL_SAMPLE = 200
+LLM_SECONDS = 0.05
+FAILURE_EVERY = 50
+WORKERS = 16
+TOPICS = [("Data Structures", "Heap"), ("Algorithms", "Sorting")]
+lock = threading.Lock()
+
+
+class FakeStudyGuideModel(BaseChatModel):
+    """
+    Answers with a study guide right away, without searching the book passages.
+    """
+
+    calls: int = 0
+    # Called while a study guide is generated
+    on_generate: Callable[[], None] | None = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-study-guide"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def with_structured_output(self, schema, **kwargs):
+        def structured_response(messages: list[BaseMessage]) -> StudyGuide:
+            answer = next(m.content for m in reversed(messages) if isinstance(m, AIMessage) and m.content)
+            return StudyGuide(study_guide_text=answer, audio_file_location="", agent_comment="")
+
+        return RunnableLambda(structured_response)
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        with lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(LLM_SECONDS)
+        if self.on_generate:
+            self.on_generate()
+        if calls % FAILURE_EVERY == 0:
+            raise RuntimeError("Error code: 429 - Rate limit reached")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="# New study guide"))])
+
+
+def seed_users(supervisor: StudyGuideSupervisorAgent):
+    for i in range(USERS):
+        username = f"student-{i}"
+        subjects = {}
+        for subject, topic in TOPICS:
+            # Every fourth student has made progress and has a study guide of their own
+            summary = f"Student {i} confuses the order of operations" if i % 4 == 0 else ""
+            subjects.setdefault(subject, Subject(name=subject, topics={}))
+            subjects[subject].topics[topic] = Topic(name=topic, study_guide="# Old study guide", summary=summary,
+                                                    study_guide_version="old prompt")
+        # The student is in the middle of a conversation about another topic
+        supervisor.graph.update_state({"configurable": {"thread_id": get_thread_id(username)}},
+                                      {"username": username, "tutor_content": TutorContent(subjects=subjects),
+                                       "subject": "Algorithms", "topic": "Graphs", "study_guide": "# Graphs",
+                                       "messages": [HumanMessage(content="What is a spanning tree?")]})
+
+
+def regenerate_serially(supervisor: StudyGuideSupervisorAgent, stale: list[StaleStudyGuide]) -> int:
+    """
+    Regenerating before: one study guide after the other, a failure stops the loop.
+    """
+    for guide in stale:
+        supervisor.regenerate_study_guide(guide.username, guide.subject, guide.topic)
+    return len(stale)
+
+
+if __name__ == "__main__":
+    model = FakeStudyGuideModel()
+    study_guide_builder_react.init_study_guide_builder_agent(llm=model, cache=StudyGuideCache())
+    supervisor = StudyGuideSupervisorAgent()
+    start = time.perf_counter()
+    seed_users(supervisor)
+    print(f"Seeded {USERS} users in {time.perf_counter() - start:.1f}s")
+
+    regenerator = StudyGuideRegenerator(supervisor, max_workers=WORKERS, rate_per_second=0, retries=3,
+                                        retry_backoff_seconds=0.01)
+    stale = regenerator.find_stale()
+    assert len(stale) == USERS * len(TOPICS), len(stale)
+
+    # Serially, on a sample, without failures so that the loop gets through
+    failure_every, FAILURE_EVERY = FAILURE_EVERY, 10 ** 9
+    start = time.perf_counter()
+    regenerate_serially(supervisor, stale[:SERIAL_SAMPLE])
+    serial = (time.perf_counter() - start) / SERIAL_SAMPLE * len(stale)
+    FAILURE_EVERY = failure_every
+
+    # Interrupted half way, then resumed
+    start = time.perf_counter()
+    first = regenerator.run(on_progress=lambda progress: progress["done"] >= len(stale) // 2 and regenerator.stop())
+    second = regenerator.run()
+    bulk = time.perf_counter() - start
+    assert first["stopped"] and second["total"] == len(stale) - SERIAL_SAMPLE - first["done"], (first, second)
+    assert first["failed"] == second["failed"] == 0 and first["retries"] + second["retries"] > 0
+    assert regenerator.find_stale() == []
+    heap = supervisor.get_tutor_content("student-1").find_or_create_topic(*TOPICS[0])
+    assert heap.study_guide == "# New study guide" and heap.study_guide_version == study_guide_version(*TOPICS[0])
+    state = supervisor.graph.get_state({"configurable": {"thread_id": get_thread_id("student-1")}}).values
+    assert (state["subject"], state["topic"], state["study_guide"]) == ("Algorithms", "Graphs", "# Graphs"), state
+    assert [message.content for message in state["messages"]] == ["What is a spanning tree?"], state["messages"]
+
+    # While a study guide is generated, the student's requests don't wait for it, and what they change in the meantime
+    # is kept
+    config = {"configurable": {"thread_id": get_thread_id("student-0")}}
+
+
+    def student_moves_on():
+        thread_lock = supervisor._thread_lock(get_thread_id("student-0"))
+        assert thread_lock.acquire(blocking=False), "The student's requests wait for the regeneration"
+        try:
+            tutor_content = supervisor.get_tutor_content("student-0")
+            tutor_content.find_or_create_topic(*TOPICS[1]).level = 3
+            supervisor.graph.update_state(config, {"tutor_content": tutor_content})
+            generations.append("student-0")
+        finally:
+            thread_lock.release()
+
+
+    generations = []
+    model.on_generate = student_moves_on
+    failure_every, FAILURE_EVERY = FAILURE_EVERY, 10 ** 9
+    supervisor.regenerate_study_guide("student-0", *TOPICS[0])
+    model.on_generate, FAILURE_EVERY = None, failure_every
+    assert generations == ["student-0"], generations
+    assert supervisor.get_tutor_content("student-0").find_or_create_topic(*TOPICS[1]).level == 3
+
+    # The API runs the same regeneration in the background, there is nothing stale left
+    from app import app, regeneration_jobs
+
+    client = app.test_client()
+    # Only admins can start it, and only when the endpoints were turned on with an admin token
+    os.environ.pop("REGENERATION_ADMIN_TOKEN", None)
+    assert client.post("/agent/regenerate_study_guides", json={}).status_code == 404
+    os.environ["REGENERATION_ADMIN_TOKEN"] = "benchmark-admin"
+    assert client.post("/agent/regenerate_study_guides", json={}).status_code == 401
+    assert client.delete("/agent/regenerate_study_guides", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    admin = {"Authorization": "Bearer benchmark-admin"}
+    response = client.post("/agent/regenerate_study_guides", json={"topics": ["Heap"]}, headers=admin)
+    assert response.status_code == 202 and regeneration_jobs.get(response.json["id"]).wait(60)
+    assert client.get(response.json["status_url"]).status_code == 401
+    status = client.get(response.json["status_url"], headers=admin).json
+    assert status["status"] == "done" and status["progress"]["total"] == 0, status
+
+    print(f"{len(stale)} stale study guides of {USERS} users, {LLM_SECONDS * 1000:.0f} ms per LLM call, "
+          f"a 429 every {FAILURE_EVERY} calls")
+    print(f"   before (serial, {SERIAL_SAMPLE} measured): ~{serial:.0f}s for all")
+    print(f"  after (bulk, {WORKERS} workers, interrupted and resumed): {bulk:.1f}s, "
+          f"{first['retries'] + second['retries']} retries, {model.calls} LLM calls")
+    tmp.cleanup()
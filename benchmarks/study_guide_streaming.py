@@ -0,0 +1,117 @@
+"""
+Time to first token of a cold study guide, streamed from /study_guide/jobs/<job_id>/stream, compared to the time until
+the whole study guide is ready (what the page waited for before).
+The study guide builder runs with a fake chat model that searches the book passages first and then streams its answer
+token by token, with a delay before every model response.
+
+Run from the repository root:
+    python -m benchmarks.study_guide_streaming
+"""
+import os
+import re
+import time
+from typing import Any, Iterator
+
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+import agents.study_guide_builder_react as study_guide_builder_react
+from agents.study_guide_builder_react import StudyGuide
+from services.study_guide_cache import StudyGuideCache
+
+MODEL_HOP_SECONDS = 0.5
+TOKEN_SECONDS = 0.01
+STUDY_GUIDE = ("# Heap\n\nA heap is a complete binary tree where every parent is smaller than its children. "
+               "Insertions bubble up and removals sift down, both in O(log n). ") * 10
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Calls the passage search tool, then answers with STUDY_GUIDE one word at a time.
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def with_structured_output(self, schema, **kwargs):
+        def structured_response(messages: list[BaseMessage]) -> StudyGuide:
+            answer = next(m.content for m in reversed(messages) if isinstance(m, AIMessage) and m.content)
+            return StudyGuide(study_guide_text=answer, audio_file_location="", agent_comment="")
+
+        return RunnableLambda(structured_response)
+
+    def _respond(self, messages: list[BaseMessage]) -> AIMessage:
+        time.sleep(MODEL_HOP_SECONDS)
+        if not isinstance(messages[-1], ToolMessage):
+            return AIMessage(content="", tool_calls=[
+                {"name": "search_book_passages", "args": {"query": "heap"}, "id": "call-1", "type": "tool_call"}])
+        return AIMessage(content=STUDY_GUIDE)
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager: CallbackManagerForLLMRun | None = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        message = self._respond(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": '{"query": "heap"}', "id": call["id"], "index": 0}
+                for call in message.tool_calls]))
+            return
+        for token in re.findall(r"\S+\s*", message.content):
+            time.sleep(TOKEN_SECONDS)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+if __name__ == "__main__":
+    # Without the study guide cache, so that the study guide is generated on every run
+    study_guide_builder_react.init_study_guide_builder_agent(llm=FakeStreamingChatModel(),
+                                                             cache=StudyGuideCache(max_entries=0))
+
+    from app import app
+
+    client = app.test_client()
+    # The home page works before anyone logged in
+    assert client.get("/").status_code == 200
+    with client.session_transaction() as session:
+        session["username"] = "alice"
+        session["teaching_style"] = "textbook"
+
+    start = time.perf_counter()
+    page = client.get("/study_guide?subject=Data Structures&topic=Heap")
+    page_seconds = time.perf_counter() - start
+    job_id = re.search(r"/study_guide/jobs/(\w+)/stream", page.get_data(as_text=True))[1]
+
+    first_token_seconds = None
+    tokens = []
+    response = client.get(f"/study_guide/jobs/{job_id}/stream", buffered=False)
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if text.startswith("event: token"):
+            first_token_seconds = first_token_seconds or time.perf_counter() - start
+            tokens.append(text)
+        elif text.startswith("event: done"):
+            break
+    done_seconds = time.perf_counter() - start
+
+    assert tokens, "Expected the study guide to be streamed"
+    assert first_token_seconds < done_seconds / 2, (first_token_seconds, done_seconds)
+    page = client.get("/study_guide?subject=Data Structures&topic=Heap").get_data(as_text=True)
+    assert "A heap is a complete binary tree" in page
+
+    print(f"     loading page: {page_seconds * 1000:.0f} ms")
+    print(f"      first token: {first_token_seconds:.2f} s")
+    print(f"full study guide: {done_seconds:.2f} s ({len(tokens)} token events)")
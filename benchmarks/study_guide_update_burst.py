@@ -0,0 +1,54 @@
+"""
+Counts the study guide builder LLM calls made for a burst of study progress events: 5 students each publish 20
+progress updates for 2 topics in quick succession while the study guide updates take a while, with and without the
+coalescing of waiting progress events in the event dispatcher.
+
+Run from the repository root:
+    python -m benchmarks.study_guide_update_burst
+"""
+import threading
+import time
+
+from services.agent_pub_sub import InProcessTransport, StudyProgressEvent, STUDY_PROGRESS_TOPIC, \
+    get_event_dispatcher
+from services.event_dispatch import EventDispatcher
+
+USERS = 5
+UPDATES_PER_TOPIC = 20
+TOPICS = ["Sorting", "Heap"]
+BUILDER_SECONDS = 0.05
+
+
+def run_burst(dispatcher: EventDispatcher) -> tuple[int, dict]:
+    builder_calls = []
+    lock = threading.Lock()
+    latest: dict[tuple[str, str], str] = {}
+
+    def update_study_guides(event: StudyProgressEvent):
+        # Stands in for StudyGuideSupervisorAgent.update_study_guides, which makes one builder LLM call
+        time.sleep(BUILDER_SECONDS)
+        with lock:
+            builder_calls.append(event)
+            latest[(event.username, event.topic)] = event.update
+
+    dispatcher.subscribe(STUDY_PROGRESS_TOPIC, update_study_guides)
+    transport = InProcessTransport(dispatcher)
+    for update in range(UPDATES_PER_TOPIC):
+        for user in range(USERS):
+            for topic in TOPICS:
+                transport.publish(STUDY_PROGRESS_TOPIC, StudyProgressEvent(
+                    username=f"user-{user}", subject="Algorithms", topic=topic, update=f"Progress {update}"))
+    assert dispatcher.join(60)
+    return len(builder_calls), latest
+
+
+if __name__ == "__main__":
+    events = USERS * len(TOPICS) * UPDATES_PER_TOPIC
+    for label, dispatcher in [("before (every event)", EventDispatcher(name="burst")),
+                              ("after (coalesced)", get_event_dispatcher())]:
+        start = time.perf_counter()
+        builder_calls, latest = run_burst(dispatcher)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>20}: {builder_calls} builder LLM calls for {events} progress events, {elapsed:.2f} s")
+        # Whatever was skipped, every study guide ends up built from the latest progress update
+        assert set(latest.values()) == {f"Progress {UPDATES_PER_TOPIC - 1}"}, latest
@@ -0,0 +1,74 @@
+"""
+Cost of registering USERS users and looking up their thread ids and user ids, with the in-memory dict that scanned all
+users to allocate a thread id and to find the user of a thread (before), and with the SQLite backed registry (after).
+Also checks that 10,000 concurrent registrations from threads get distinct thread ids.
+
+Run from the repository root:
+    python -m benchmarks.user_registry
+"""
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from services.user_registry import UserRegistry
+
+USERS = 10_000
+LOOKUPS = 1_000
+
+
+class DictUserStore:
+    """
+    The user store before: thread ids are max + 1 of all thread ids, user ids are found by a linear scan.
+    """
+
+    def __init__(self):
+        self.user_mapping: dict[str, int] = {}
+
+    def get_thread_id(self, user_id: str) -> int:
+        if user_id not in self.user_mapping:
+            self.user_mapping[user_id] = max(self.user_mapping.values(), default=0) + 1
+        return self.user_mapping[user_id]
+
+    def get_user_id(self, thread_id: int) -> str | None:
+        for user_id, thread in self.user_mapping.items():
+            if thread == thread_id:
+                return user_id
+
+
+def measure(store, users: list[str]) -> tuple[float, float, float]:
+    start = time.perf_counter()
+    thread_ids = [store.get_thread_id(user) for user in users]
+    registered = time.perf_counter() - start
+
+    sample = range(0, len(users), len(users) // LOOKUPS)
+    start = time.perf_counter()
+    for i in sample:
+        assert store.get_thread_id(users[i]) == thread_ids[i]
+    thread_lookup = (time.perf_counter() - start) / len(sample)
+    start = time.perf_counter()
+    for i in sample:
+        assert store.get_user_id(thread_ids[i]) == users[i]
+    user_lookup = (time.perf_counter() - start) / len(sample)
+    return registered, thread_lookup, user_lookup
+
+
+if __name__ == "__main__":
+    users = [f"user-{i}" for i in range(USERS)]
+    with tempfile.TemporaryDirectory() as tmp:
+        before = measure(DictUserStore(), users)
+        after = measure(UserRegistry(str(Path(tmp) / "checkpoints.db")), users)
+
+        registry = UserRegistry(str(Path(tmp) / "concurrent.db"))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            thread_ids = list(executor.map(registry.get_thread_id, users))
+        concurrent = time.perf_counter() - start
+        assert len(set(thread_ids)) == USERS, "Concurrent registrations must not share thread ids"
+
+    print(f"{USERS:,} users")
+    print(f"                   {'register all':>14} {'thread id':>12} {'user id':>12}")
+    for label, (registered, thread_lookup, user_lookup) in (("before (dict scan)", before),
+                                                             ("after (registry)", after)):
+        print(f"{label:>18} {registered:>13.2f}s {thread_lookup * 1e6:>10.1f}us {user_lookup * 1e6:>10.1f}us")
+    print(f"{USERS:,} concurrent registrations from 32 threads: {concurrent:.2f}s, no collisions")
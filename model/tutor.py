@@ -1,6 +1,6 @@
 from typing import Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 # TODO: get study progress agent to use the same models
@@ -9,26 +9,61 @@ class Topic(BaseModel):
     quiz_questions: list[str] = []
     level: Literal[1, 2, 3, 4, 5, 6, 7, 8, 9, 10] = 1
     summary: str = ""
+    # Number of graded quiz questions moved out of quiz_questions into the archive
+    archived_quiz_questions: int = 0
     study_guide: str = ""
+    # study_guide_version the study guide was generated with, see agents/study_guide_builder_react.py
+    study_guide_version: str = ""
+    # Style the study guide was generated in, a regeneration keeps it
+    study_guide_style: Literal["podcast", "textbook"] = "textbook"
     audio_file_location: str = ""
+    # Set on topics that belong to the shared catalog, they are copied before the first change
+    _shared: bool = PrivateAttr(default=False)
 
 
 class Subject(BaseModel):
     name: str
     topics: dict[str, Topic]
+    _shared: bool = PrivateAttr(default=False)
 
 
 class TutorContent(BaseModel):
     subjects: dict[str, Subject]
 
+    def share(self) -> "TutorContent":
+        """
+        Mark every subject and topic as shared, so that copy_on_write copies can hand them out without copying.
+        """
+        for subject in self.subjects.values():
+            subject._shared = True
+            for topic in subject.topics.values():
+                topic._shared = True
+        return self
+
+    def copy_on_write(self) -> "TutorContent":
+        """
+        Cheap copy of shared content. Subjects and topics are only copied when find_or_create_topic hands them out,
+        because that is where they get changed.
+        """
+        return TutorContent.model_construct(subjects=dict(self.subjects))
+
     def find_or_create_topic(self, subject_name: str, topic_name: str):
         subject = self.subjects.get(subject_name)
         if subject is None:
             subject = Subject(name=subject_name, topics={})
             self.subjects[subject_name] = subject
+        elif subject._shared:
+            subject = subject.model_copy(update={"topics": dict(subject.topics)})
+            subject._shared = False
+            self.subjects[subject_name] = subject
 
-        if subject.topics.get(topic_name) is None:
+        topic = subject.topics.get(topic_name)
+        if topic is None:
             topic = Topic(name=topic_name)
             subject.topics[topic_name] = topic
+        elif topic._shared:
+            topic = topic.model_copy(deep=True)
+            topic._shared = False
+            subject.topics[topic_name] = topic
 
-        return subject.topics.get(topic_name)
+        return topic
@@ -0,0 +1,39 @@
+"""
+Regenerates the study guides of all users that were generated from older books or prompts.
+Running it again after an interruption resumes with the study guides that are still stale.
+
+    python regenerate_study_guides.py [--subject Algorithms] [--topic Sorting] [--force] [--workers 4] [--rate 2]
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    from agents.study_guide_regeneration import StudyGuideRegenerator
+    from agents.study_guide_supervisor import StudyGuideSupervisorAgent
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subject", action="append", help="only this subject, can be repeated")
+    parser.add_argument("--topic", action="append", help="only this topic, can be repeated")
+    parser.add_argument("--force", action="store_true", help="also regenerate study guides that are up to date")
+    parser.add_argument("--workers", type=int, help="concurrent regenerations, REGENERATION_WORKERS by default")
+    parser.add_argument("--rate", type=float, help="regenerations started per second, REGENERATION_RATE by default")
+    parser.add_argument("--dry-run", action="store_true", help="only list the stale study guides")
+    args = parser.parse_args()
+
+    regenerator = StudyGuideRegenerator(StudyGuideSupervisorAgent(), max_workers=args.workers,
+                                        rate_per_second=args.rate)
+    if args.dry_run:
+        for guide in regenerator.find_stale(args.subject, args.topic, args.force):
+            print(f"{guide.username}: {guide.subject}/{guide.topic}")
+    else:
+        def print_progress(progress: dict):
+            finished = progress["done"] + progress["failed"]
+            if finished % 100 == 0 or progress["remaining"] == 0:
+                print(f"{finished}/{progress['total']} study guides, {progress['failed']} failed, "
+                      f"{progress['per_second']:.1f}/s")
+
+
+        regenerator.run(args.subject, args.topic, args.force, on_progress=print_progress)
@@ -2,6 +2,11 @@ import os
 import sqlite3
 from pathlib import Path
 
+# Passages are built from whole lines and capped at roughly this many characters
+PASSAGE_MAX_CHARS = 1200
+# Files of a subject's book directory that are not topics
+BOOK_METADATA_FILES = {"authors.txt", "title.txt"}
+
 
 def create_db(db_path='study_material.db'):
     # Connect to (or create) the database
@@ -15,17 +20,118 @@ def create_db(db_path='study_material.db'):
         subject TEXT NOT NULL,
         topic TEXT NOT NULL,
         text TEXT NOT NULL,
-        authors TEXT NOT NULL
+        authors TEXT NOT NULL,
+        book_title TEXT
     )
     """)
+    migrate_topics_table(cursor)
+    create_passages_index(cursor)
     # Save and close
     conn.commit()
     conn.close()
 
 
+def migrate_topics_table(cursor: sqlite3.Cursor):
+    """
+    Add the columns that databases created by older versions of create_db don't have.
+    """
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(topics)")}
+    if "book_title" not in columns:
+        cursor.execute("ALTER TABLE topics ADD COLUMN book_title TEXT")
+
+
+def create_passages_index(cursor: sqlite3.Cursor):
+    """
+    Create the full-text index over book passages. Only the passage text is indexed, the rest is used for filtering
+    and citing sources.
+    """
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+        passage,
+        subject UNINDEXED,
+        topic UNINDEXED,
+        book_title UNINDEXED,
+        authors UNINDEXED,
+        topic_id UNINDEXED,
+        tokenize = 'porter unicode61'
+    )
+    """)
+
+
+def chunk_text(text: str, max_chars: int = PASSAGE_MAX_CHARS) -> list[str]:
+    """
+    Split book text into passages. Lines are kept whole and merged until the passage reaches max_chars,
+    preferring to end a passage at the end of a sentence.
+    """
+    passages = []
+    current = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        current = f"{current}\n{line}" if current else line
+        if len(current) >= max_chars or (len(current) >= max_chars * 3 // 4 and line.endswith(".")):
+            passages.append(current)
+            current = ""
+    if current:
+        passages.append(current)
+    return passages
+
+
+def index_topic(cursor: sqlite3.Cursor, topic_id: int, subject: str, topic: str, text: str, authors: str,
+                book_title: str):
+    cursor.executemany("""
+            INSERT INTO passages (passage, subject, topic, book_title, authors, topic_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(passage, subject, topic, book_title, authors, topic_id) for passage in chunk_text(text)])
+
+
+def rebuild_passages_index(db_path='study_material.db'):
+    """
+    Rebuild the passages index from the topics table. Useful for databases seeded before the index existed.
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    migrate_topics_table(cursor)
+    create_passages_index(cursor)
+    cursor.execute("DELETE FROM passages")
+    rows = cursor.execute("SELECT id, subject, topic, text, authors, book_title FROM topics").fetchall()
+    for topic_id, subject, topic, text, authors, book_title in rows:
+        index_topic(cursor, topic_id, subject, topic, text, authors, book_title or "Unknown")
+    conn.commit()
+    conn.close()
+
+
+def update_book_titles(base_path=Path('books'), db_path='study_material.db'):
+    """
+    Set the book titles of the seeded topics from the books' title.txt files and rebuild the passages index, for
+    databases seeded before the titles were read.
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    migrate_topics_table(cursor)
+    for subject_path in base_path.iterdir():
+        if subject_path.is_dir():
+            cursor.execute("UPDATE topics SET book_title = ? WHERE subject = ?",
+                           (read_book_file(subject_path, "title.txt"), subject_path.name))
+    conn.commit()
+    conn.close()
+    rebuild_passages_index(db_path)
+
+
+def read_book_file(subject_path: Path, name: str) -> str:
+    """
+    Contents of a metadata file of a subject's book directory, "Unknown" if it is missing.
+    """
+    file_path = subject_path / name
+    return file_path.read_text(encoding="utf-8").strip() if file_path.exists() else "Unknown"
+
+
 def insert_books_to_db(base_path=Path('books'), db_path='study_material.db'):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    migrate_topics_table(cursor)
+    create_passages_index(cursor)
 
     for subject_path in base_path.iterdir():
         if not subject_path.is_dir():
@@ -33,27 +139,30 @@ def insert_books_to_db(base_path=Path('books'), db_path='study_material.db'):
 
         subject = subject_path.name
 
-        # Read authors.txt (default to "Unknown" if missing)
-        authors_file = subject_path / "authors.txt"
-        authors = authors_file.read_text(encoding="utf-8").strip() if authors_file.exists() else "Unknown"
+        # Read authors.txt and title.txt (default to "Unknown" if missing)
+        authors = read_book_file(subject_path, "authors.txt")
+        book_title = read_book_file(subject_path, "title.txt")
 
         # Read topic files
         for file_path in subject_path.glob("*.txt"):
-            if file_path.name == "authors.txt":
+            if file_path.name in BOOK_METADATA_FILES:
                 continue
 
             topic = file_path.stem.split(" - ", 1)[1] if " - " in file_path.stem else file_path.stem
             text = file_path.read_text(encoding="utf-8").strip()
 
             cursor.execute("""
-                    INSERT INTO topics (subject, topic, text, authors)
-                    VALUES (?, ?, ?, ?)
-                """, (subject, topic, text, authors))
+                    INSERT INTO topics (subject, topic, text, authors, book_title)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (subject, topic, text, authors, book_title))
+            index_topic(cursor, cursor.lastrowid, subject, topic, text, authors, book_title)
 
     conn.commit()
     conn.close()
 
-# create_db()
 
-# Call the function
-insert_books_to_db()
\ No newline at end of file
+if __name__ == "__main__":
+    # create_db()
+
+    # Call the function
+    insert_books_to_db()
@@ -1,28 +1,42 @@
 import asyncio
+import atexit
 import json
+import os
 import threading
 import time
-from typing import List, Literal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Literal
 
-import aiohttp
 from kafka import KafkaConsumer, KafkaProducer
+from kafka.admin import KafkaAdminClient, NewTopic
+from kafka.errors import KafkaTimeoutError, TopicAlreadyExistsError
+from kafka.partitioner.default import DefaultPartitioner
+from kafka.structs import TopicPartition, OffsetAndMetadata
 from pydantic import BaseModel
 
+from services.event_dispatch import EventDispatcher
+from services.memory_broker import MemoryBroker
+
 # Constants
 KAFKA_BROKER = 'localhost:9092'
 STUDY_PROGRESS_TOPIC = 'study_progress'
 QUIZ_QUESTION_TOPIC = 'quiz_question'
+POLL_TIMEOUT_MS = 100
+MAX_POLL_RECORDS = 100
+DEFAULT_KAFKA_MAX_IN_FLIGHT = 64
+DEFAULT_KAFKA_HANDLER_RETRIES = 2
+DEFAULT_KAFKA_LINGER_MS = 5
+DEFAULT_KAFKA_PARTITIONS = 6
+DEFAULT_KAFKA_MAX_BLOCK_MS = 1000
+# Backoff between attempts to connect the producer, doubling up to the maximum
+PRODUCER_RETRY_SECONDS = 0.5
+PRODUCER_MAX_RETRY_SECONDS = 30
+# How long buffered events may take to reach the broker when the process exits
+SHUTDOWN_FLUSH_SECONDS = 10
 
 _topics = [STUDY_PROGRESS_TOPIC, QUIZ_QUESTION_TOPIC]
-
-# Global subscriber list
-_subscribers: dict[str, List[str]] = {}
-
-# Kafka Producer
-_producer = KafkaProducer(
-    bootstrap_servers=KAFKA_BROKER,
-    value_serializer=lambda v: json.dumps(v).encode('utf-8')
-)
+_partitioner = DefaultPartitioner()
 
 
 class StudyProgressEvent(BaseModel):
@@ -40,91 +54,414 @@ class QuizQuestionEvent(BaseModel):
     quiz_question: str
 
 
-def start_pub_sub_consumer():
+_event_types: dict[str, type[BaseModel]] = {
+    STUDY_PROGRESS_TOPIC: StudyProgressEvent,
+    QUIZ_QUESTION_TOPIC: QuizQuestionEvent,
+}
+
+# Handlers of every transport run here, so that events of one user are handled in order
+_dispatcher = EventDispatcher(name="agent_events")
+# A progress event carries the whole progress summary of its topic, so a newer one makes the waiting ones obsolete and
+# a burst of them rebuilds the study guide once
+_dispatcher.coalesce(STUDY_PROGRESS_TOPIC, lambda event: (event.subject, event.topic))
+
+
+class InProcessTransport:
     """
-    Start the consumer in a background thread.
+    Hands published events straight to the handlers registered in this process. Used for single node deployments.
     """
-    t = threading.Thread(target=_start_async_consumer, daemon=True)
-    t.start()
+
+    def __init__(self, dispatcher: EventDispatcher):
+        self.dispatcher = dispatcher
+
+    def start(self):
+        pass
+
+    def stop(self, timeout: float | None = None):
+        pass
+
+    def flush(self, timeout: float | None = None):
+        pass
+
+    def publish(self, topic: str, event: BaseModel):
+        self.dispatcher.dispatch(topic, event.username, event)
 
 
-def listen_to_study_progress(endpoint: str) -> None:
+def partition_for_user(username: str, partitions: int) -> int:
     """
-    Register an endpoint to receive updates from the STUDY_PROGRESS_TOPIC.
+    The partition that a user's events are published to. Events are keyed by username, so this is the partition
+    Kafka's default partitioner picks, and it is the same for every topic.
     """
-    if endpoint not in _subscribers:
-        # Get or Initialize the list of subscribers for this topic and append endpoint
-        _subscribers.setdefault(STUDY_PROGRESS_TOPIC, []).append(endpoint)
+    all_partitions = list(range(partitions))
+    return _partitioner(username.encode('utf-8'), all_partitions, all_partitions)
 
 
-def update_study_progress(event: StudyProgressEvent) -> None:
+def owned_partitions(partitions: int, worker_index: int, worker_count: int) -> list[int]:
     """
-    Publish a new event to the 'study_progress' Kafka topic.
+    The partitions consumed by a worker when partitions are split between worker_count workers.
     """
-    _producer.send(STUDY_PROGRESS_TOPIC, event.model_dump())
-    _producer.flush()
+    return [partition for partition in range(partitions) if partition % worker_count == worker_index]
 
 
-def listen_to_quiz_question(endpoint: str) -> None:
+def worker_for_user(username: str, partitions: int, worker_count: int) -> int:
     """
-    Register an endpoint to receive updates from the QUIZ_QUESTION_TOPIC.
+    The worker that handles a user's events, requests of the user can be routed to it so that user state stays on one
+    worker.
     """
-    if endpoint not in _subscribers:
-        # Get or Initialize the list of subscribers for this topic and append endpoint
-        _subscribers.setdefault(QUIZ_QUESTION_TOPIC, []).append(endpoint)
+    return partition_for_user(username, partitions) % worker_count
 
 
-def update_quiz_question(event: QuizQuestionEvent) -> None:
+class _PartitionOffsets:
     """
-    Publish a new event to the 'study_progress' Kafka topic.
+    Tracks the records of one partition that were handed to handlers, so that the committed offset never moves past
+    a record that is still being handled.
     """
-    _producer.send(QUIZ_QUESTION_TOPIC, event.model_dump())
-    _producer.flush()
 
+    def __init__(self):
+        self.in_flight: set[int] = set()
+        self.next_offset: int | None = None
+        self.committed: int | None = None
 
-def _start_async_consumer():
-    asyncio.run(_consume_and_forward_async())
+    def committable(self) -> int | None:
+        offset = min(self.in_flight) if self.in_flight else self.next_offset
+        return offset if offset != self.committed else None
 
 
-async def _consume_and_forward_async():
-    consumer = KafkaConsumer(
-        bootstrap_servers=KAFKA_BROKER,
-        value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-        group_id='study_progress_forwarder'
-    )
-    consumer.subscribe(topics=_topics)
+class KafkaTransport:
+    """
+    Publishes events to Kafka and hands the consumed events to the handlers registered in this process. Used when
+    agents run on multiple nodes.
+    The consumer polls batches on its own thread, off the event loop. Events of different users are handled in
+    parallel by the dispatcher, events of one user in order, and at most max_in_flight events are handled at a time.
+    Offsets are committed once every earlier record of the partition was handled, including the work that handlers put
+    off, like the progress update of batched quiz questions, so that a crash redelivers the events of that work.
+    Publishing doesn't wait for the broker: the producer connects on a background thread, started by start() or the
+    first publish, and retries with backoff while the broker is down. It batches events for linger_ms and is flushed
+    when the process exits. Events that can't be sent, because the producer isn't connected within max_block_ms or
+    the broker rejects them, are reported through _delivery_failed instead of raising in the publisher.
+    Events are keyed by username, so a user's events stay in order on one partition. With worker_count set, every
+    worker process consumes its own share of the partitions (see owned_partitions), otherwise the consumer group
+    balances the partitions between consumers.
+    Args:
+        dispatcher: runs the handlers of consumed events
+        producer_factory: creates the producer, called with KafkaProducer's arguments
+        consumer_factory: creates the consumer, called with KafkaConsumer's arguments
+        max_in_flight: consumed events handed to handlers and not handled yet, KAFKA_MAX_IN_FLIGHT by default
+        handler_retries: retries of a failing handler before its event is skipped, KAFKA_HANDLER_RETRIES by default
+        linger_ms: how long the producer waits for more events to batch, KAFKA_LINGER_MS by default
+        admin_factory: creates the admin client used to create the topics, called with KafkaAdminClient's arguments
+        partitions: partitions of the topics when they are created, KAFKA_PARTITIONS by default
+        worker_index: which share of the partitions this worker consumes, KAFKA_WORKER_INDEX by default
+        worker_count: number of workers sharing the partitions, KAFKA_WORKER_COUNT by default. 0 uses the consumer
+            group instead
+        max_block_ms: how long publishing waits for the producer to connect or for room in its buffer,
+            KAFKA_MAX_BLOCK_MS by default
+    """
+
+    def __init__(self, dispatcher: EventDispatcher, bootstrap_servers: str = KAFKA_BROKER,
+                 producer_factory: Callable = KafkaProducer, consumer_factory: Callable = KafkaConsumer,
+                 max_in_flight: int | None = None, handler_retries: int | None = None, linger_ms: int | None = None,
+                 admin_factory: Callable = KafkaAdminClient, partitions: int | None = None,
+                 worker_index: int | None = None, worker_count: int | None = None, max_block_ms: int | None = None):
+        self.dispatcher = dispatcher
+        self.bootstrap_servers = bootstrap_servers
+        self.producer_factory = producer_factory
+        self.consumer_factory = consumer_factory
+        self.admin_factory = admin_factory
+        self.partitions = partitions or int(os.getenv("KAFKA_PARTITIONS", DEFAULT_KAFKA_PARTITIONS))
+        self.worker_index = worker_index if worker_index is not None else int(os.getenv("KAFKA_WORKER_INDEX", 0))
+        self.worker_count = worker_count if worker_count is not None else int(os.getenv("KAFKA_WORKER_COUNT", 0))
+        self.max_in_flight = max_in_flight or int(os.getenv("KAFKA_MAX_IN_FLIGHT", DEFAULT_KAFKA_MAX_IN_FLIGHT))
+        self.handler_retries = handler_retries if handler_retries is not None else int(
+            os.getenv("KAFKA_HANDLER_RETRIES", DEFAULT_KAFKA_HANDLER_RETRIES))
+        self.linger_ms = linger_ms if linger_ms is not None else int(os.getenv("KAFKA_LINGER_MS",
+                                                                              DEFAULT_KAFKA_LINGER_MS))
+        self.max_block_ms = max_block_ms if max_block_ms is not None else int(
+            os.getenv("KAFKA_MAX_BLOCK_MS", DEFAULT_KAFKA_MAX_BLOCK_MS))
+        self.delivery_failures = 0
+        self._producer = None
+        self._producer_lock = threading.Lock()
+        self._producer_ready = threading.Event()
+        self._producer_thread: threading.Thread | None = None
+        self._topics_created = False
+        self._stopped = threading.Event()
+        self._consumer_thread: threading.Thread | None = None
+
+    def start(self):
+        """
+        Start the consumer in a background thread, and connect the producer in another.
+        """
+        self._consumer_thread = threading.Thread(target=self._start_async_consumer, daemon=True)
+        self._consumer_thread.start()
+        self._connect_producer()
+
+    def stop(self, timeout: float | None = None):
+        """
+        Stop consuming and send the buffered events. Events that were already handed to handlers finish and their
+        offsets are committed.
+        """
+        self._stopped.set()
+        if self._consumer_thread:
+            self._consumer_thread.join(timeout)
+        self.flush(timeout)
+
+    def publish(self, topic: str, event: BaseModel):
+        """
+        Buffer the event for sending, failures to deliver it are logged by _delivery_failed.
+        """
+        try:
+            future = self._get_producer().send(topic, event.model_dump(), key=event.username)
+        except Exception as e:
+            self._delivery_failed(topic, event, e)
+            return
+        future.add_errback(self._delivery_failed, topic, event)
+
+    def flush(self, timeout: float | None = None):
+        """
+        Wait until the buffered events were sent.
+        """
+        if self._producer is not None:
+            self._producer.flush(timeout)
+
+    def _get_producer(self):
+        """
+        The connected producer, waits up to max_block_ms for it to connect.
+        """
+        if self._producer is None:
+            self._connect_producer()
+            if not self._producer_ready.wait(self.max_block_ms / 1000):
+                raise KafkaTimeoutError(f"The producer did not connect to {self.bootstrap_servers} within "
+                                        f"{self.max_block_ms} ms")
+        return self._producer
+
+    def _connect_producer(self):
+        """
+        Start connecting the producer in a background thread, unless that already started.
+        """
+        with self._producer_lock:
+            if self._producer_thread is None:
+                self._producer_thread = threading.Thread(target=self._create_producer, daemon=True,
+                                                         name="kafka_producer")
+                self._producer_thread.start()
+
+    def _create_producer(self):
+        retry_seconds = PRODUCER_RETRY_SECONDS
+        while not self._stopped.is_set():
+            try:
+                self._create_topics()
+                self._producer = self.producer_factory(
+                    bootstrap_servers=self.bootstrap_servers,
+                    key_serializer=lambda k: k.encode('utf-8'),
+                    value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+                    linger_ms=self.linger_ms,
+                    max_block_ms=self.max_block_ms
+                )
+            except Exception as e:
+                print(f"Failed to connect the Kafka producer, retrying in {retry_seconds}s: {e}")
+                self._stopped.wait(retry_seconds)
+                retry_seconds = min(retry_seconds * 2, PRODUCER_MAX_RETRY_SECONDS)
+                continue
+            atexit.register(self.flush, SHUTDOWN_FLUSH_SECONDS)
+            self._producer_ready.set()
+            return
+
+    def _create_topics(self):
+        """
+        Create the topics with their partitions. Topics that Kafka creates on first use have a single partition, so
+        they could not be shared between workers.
+        """
+        if self._topics_created:
+            return
+        try:
+            admin = self.admin_factory(bootstrap_servers=self.bootstrap_servers)
+            try:
+                for topic in _topics:
+                    try:
+                        admin.create_topics([NewTopic(topic, self.partitions, 1)])
+                    except TopicAlreadyExistsError:
+                        pass
+            finally:
+                admin.close()
+            self._topics_created = True
+        except Exception as e:
+            print(f"Failed to create topics {_topics}: {e}")
+
+    def _assign_partitions(self, consumer):
+        if self.worker_count <= 0:
+            consumer.subscribe(topics=_topics)
+            return
+        partitions = []
+        for topic in _topics:
+            partition_count = len(consumer.partitions_for_topic(topic) or []) or self.partitions
+            partitions += [TopicPartition(topic, partition)
+                           for partition in owned_partitions(partition_count, self.worker_index, self.worker_count)]
+        consumer.assign(partitions)
+
+    def _delivery_failed(self, topic: str, event: BaseModel, exception: Exception):
+        self.delivery_failures += 1
+        print(f"Failed to deliver {topic} event for {event.username}: {exception}")
+
+    def _start_async_consumer(self):
+        asyncio.run(self._consume_and_forward_async())
+
+    async def _consume_and_forward_async(self):
+        loop = asyncio.get_running_loop()
+        # Kafka consumers are not thread safe, so polls and commits all run on this one thread
+        consumer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kafka_consumer")
+        await loop.run_in_executor(consumer_executor, self._create_topics)
+        consumer = await loop.run_in_executor(consumer_executor, lambda: self.consumer_factory(
+            bootstrap_servers=self.bootstrap_servers,
+            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
+            group_id='study_progress_forwarder',
+            enable_auto_commit=False
+        ))
+        await loop.run_in_executor(consumer_executor, lambda: self._assign_partitions(consumer))
+
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        offsets: dict[TopicPartition, _PartitionOffsets] = {}
+
+        def handled(partition: TopicPartition, offset: int, succeeded: bool):
+            if not succeeded:
+                print(f"Skipping {partition.topic} event at offset {offset}, its handlers failed")
+            offsets[partition].in_flight.discard(offset)
+
+        async def commit():
+            to_commit = {}
+            for partition, partition_offsets in offsets.items():
+                offset = partition_offsets.committable()
+                if offset is not None:
+                    to_commit[partition] = OffsetAndMetadata(offset, None, -1)
+            if not to_commit:
+                return
+            try:
+                await loop.run_in_executor(consumer_executor, lambda: consumer.commit(offsets=to_commit))
+                for partition, offset in to_commit.items():
+                    offsets[partition].committed = offset.offset
+            except Exception as e:
+                print(f"Failed to commit offsets: {e}")
+
+        try:
+            while not self._stopped.is_set():
+                batch = await loop.run_in_executor(
+                    consumer_executor, lambda: consumer.poll(timeout_ms=POLL_TIMEOUT_MS, max_records=MAX_POLL_RECORDS))
+                for partition, records in batch.items():
+                    partition_offsets = offsets.setdefault(partition, _PartitionOffsets())
+                    for record in records:
+                        await in_flight.acquire()
+                        partition_offsets.in_flight.add(record.offset)
+                        partition_offsets.next_offset = record.offset + 1
+                        # The next records are consumed once the handlers returned, the offset waits for put off work
+                        on_handled = partial(loop.call_soon_threadsafe, in_flight.release)
+                        on_done = partial(loop.call_soon_threadsafe, handled, partition, record.offset)
+                        try:
+                            event = _event_types[record.topic](**record.value)
+                        except Exception as e:
+                            print(f"Skipping malformed {record.topic} event at offset {record.offset}: {e}")
+                            handled(partition, record.offset, True)
+                            in_flight.release()
+                            continue
+                        # Dispatching waits when the dispatcher is full, so it must not run on the event loop
+                        await loop.run_in_executor(None, lambda: self.dispatcher.dispatch(
+                            record.topic, event.username, event, retries=self.handler_retries, on_done=on_done,
+                            on_handled=on_handled))
+                await commit()
+
+            # Let the handlers of the events already handed to them return before the last commit, the events of work
+            # they put off and that isn't done yet stay uncommitted and are consumed again after a restart
+            for _ in range(self.max_in_flight):
+                await in_flight.acquire()
+            await commit()
+        finally:
+            await loop.run_in_executor(consumer_executor, consumer.close)
+            consumer_executor.shutdown()
+
+
+_transport: InProcessTransport | KafkaTransport | None = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> InProcessTransport | KafkaTransport:
+    """
+    The transport is picked with EVENT_TRANSPORT: "inprocess" (default), "kafka" for multi node deployments, or
+    "memory" to run the Kafka transport against an in-memory broker, e.g. in tests.
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                transport = os.getenv("EVENT_TRANSPORT", "inprocess")
+                if transport == "kafka":
+                    _transport = KafkaTransport(_dispatcher)
+                elif transport == "memory":
+                    broker = MemoryBroker()
+                    _transport = KafkaTransport(_dispatcher, producer_factory=broker.producer,
+                                                consumer_factory=broker.consumer, admin_factory=broker.admin)
+                elif transport == "inprocess":
+                    _transport = InProcessTransport(_dispatcher)
+                else:
+                    raise ValueError(f"Unknown EVENT_TRANSPORT: {transport}")
+    return _transport
+
+
+def set_transport(transport: InProcessTransport | KafkaTransport):
+    """
+    Replace the transport, e.g. with one running against a MemoryBroker in tests and benchmarks.
+    """
+    global _transport
+    with _transport_lock:
+        _transport = transport
 
-    async with aiohttp.ClientSession() as session:
-        for msg in consumer:
-            event = msg.value
-            subscribers = _subscribers.get(msg.topic, [])
-            tasks = [
-                _post_event(session, endpoint, event)
-                for endpoint in subscribers
-            ]
-            await asyncio.gather(*tasks)
 
+def get_event_dispatcher() -> EventDispatcher:
+    """
+    The dispatcher that runs the handlers of every transport in this process.
+    """
+    return _dispatcher
 
-async def _post_event(session: aiohttp.ClientSession, endpoint: str, event: dict):
-    try:
-        async with session.post(endpoint, json=event, timeout=30) as resp:
-            if resp.status != 200:
-                print(f"Failed to post to {endpoint}, status code: {resp.status}")
-            else:
-                response_text = await resp.text()
-                print(f"Successfully posted to {endpoint}, {response_text}")
-    except Exception as e:
-        print(f"Failed to post to {endpoint}: {e}")
+
+def start_pub_sub_consumer():
+    """
+    Start receiving events for the handlers registered in this process.
+    """
+    get_transport().start()
+
+
+def listen_to_study_progress(handler: Callable[[StudyProgressEvent], object]) -> None:
+    """
+    Register a handler to receive updates from the STUDY_PROGRESS_TOPIC.
+    """
+    _dispatcher.subscribe(STUDY_PROGRESS_TOPIC, handler)
+
+
+def update_study_progress(event: StudyProgressEvent) -> None:
+    """
+    Publish a new event to the 'study_progress' topic.
+    """
+    get_transport().publish(STUDY_PROGRESS_TOPIC, event)
+
+
+def listen_to_quiz_question(handler: Callable[[QuizQuestionEvent], object]) -> None:
+    """
+    Register a handler to receive updates from the QUIZ_QUESTION_TOPIC.
+    """
+    _dispatcher.subscribe(QUIZ_QUESTION_TOPIC, handler)
+
+
+def update_quiz_question(event: QuizQuestionEvent) -> None:
+    """
+    Publish a new event to the 'quiz_question' topic.
+    """
+    get_transport().publish(QUIZ_QUESTION_TOPIC, event)
 
 
 if __name__ == "__main__":
+    received = []
     start_pub_sub_consumer()
-    listen_to_study_progress("http://localhost:5005/echo")
-    listen_to_quiz_question("http://localhost:5005/echo")
-    # This tests that we will send the same message to multiple endpoints
-    listen_to_study_progress("http://localhost:5005/echo")
+    listen_to_study_progress(lambda event: received.append(("progress 1", event.username)))
+    listen_to_quiz_question(lambda event: received.append(("quiz", event.username)))
+    # This tests that we will send the same message to multiple handlers
+    listen_to_study_progress(lambda event: received.append(("progress 2", event.username)))
 
-    time.sleep(2)
     event = StudyProgressEvent(username="Study Progress Alice", subject="math", topic="algebra",
                                update="completed quiz 1")
     update_study_progress(event)
@@ -139,4 +476,182 @@ if __name__ == "__main__":
     event = QuizQuestionEvent(username="Quiz Alice", subject="math", topic="algebra", quiz_question="What is 2+3?")
     update_quiz_question(event)
 
-    time.sleep(10)
+    deadline = time.time() + 10
+    while len(received) < 6 and time.time() < deadline:
+        time.sleep(0.1)
+    assert sorted(received) == sorted([("progress 1", "Study Progress Alice"), ("progress 2", "Study Progress Alice"),
+                                       ("progress 1", "Study Progress Dave"), ("progress 2", "Study Progress Dave"),
+                                       ("quiz", "Quiz Dave"), ("quiz", "Quiz Alice")]), received
+
+    # Kafka consumer against an in-memory broker: users are handled concurrently, each user's events in order, and
+    # offsets are committed once handled
+    USERS = 10
+    EVENTS_PER_USER = 3
+    HANDLER_SECONDS = 0.2
+    broker = MemoryBroker()
+    dispatcher = EventDispatcher(max_workers=USERS, name="kafka_test")
+    handled_events: list[QuizQuestionEvent] = []
+    in_progress: set[str] = set()
+    most_in_progress = 0
+
+
+    def slow_handler(event: QuizQuestionEvent):
+        global most_in_progress
+        assert event.username not in in_progress
+        in_progress.add(event.username)
+        most_in_progress = max(most_in_progress, len(in_progress))
+        time.sleep(HANDLER_SECONDS)
+        handled_events.append(event)
+        in_progress.discard(event.username)
+
+
+    dispatcher.subscribe(QUIZ_QUESTION_TOPIC, slow_handler)
+    kafka_transport = KafkaTransport(dispatcher, producer_factory=broker.producer, consumer_factory=broker.consumer,
+                                     admin_factory=broker.admin)
+    kafka_transport.start()
+    started = time.perf_counter()
+    for number in range(EVENTS_PER_USER):
+        for user in range(USERS):
+            kafka_transport.publish(QUIZ_QUESTION_TOPIC, QuizQuestionEvent(
+                username=f"user-{user}", subject="math", topic="algebra", quiz_question=f"Question {number}"))
+    while len(handled_events) < USERS * EVENTS_PER_USER and time.perf_counter() - started < 10:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    kafka_transport.stop()
+
+    assert len(handled_events) == USERS * EVENTS_PER_USER
+    # One at a time this would take USERS * EVENTS_PER_USER * HANDLER_SECONDS = 6 seconds
+    assert elapsed < EVENTS_PER_USER * HANDLER_SECONDS * 2, elapsed
+    assert most_in_progress > 1, most_in_progress
+    for user in range(USERS):
+        assert [e.quiz_question for e in handled_events if e.username == f"user-{user}"] == \
+               [f"Question {number}" for number in range(EVENTS_PER_USER)]
+    assert broker.committed("study_progress_forwarder", QUIZ_QUESTION_TOPIC) == USERS * EVENTS_PER_USER
+    print(f"{USERS} users, {USERS * EVENTS_PER_USER} events handled in {elapsed:.2f}s, "
+          f"{most_in_progress} users at a time")
+
+    # The committed offset stays behind an event that is still being handled
+    release = threading.Event()
+    dispatcher.subscribe(STUDY_PROGRESS_TOPIC, lambda event: event.username == "slow" and release.wait(5))
+    broker = MemoryBroker()
+    kafka_transport = KafkaTransport(dispatcher, producer_factory=broker.producer, consumer_factory=broker.consumer,
+                                     admin_factory=broker.admin, partitions=1)
+    kafka_transport.start()
+    for username in ["fast-1", "slow", "fast-2"]:
+        kafka_transport.publish(STUDY_PROGRESS_TOPIC, StudyProgressEvent(username=username, subject="math",
+                                                                         topic="algebra", update="Knows the basics"))
+    time.sleep(0.5)
+    assert broker.committed("study_progress_forwarder", STUDY_PROGRESS_TOPIC) == 1
+    release.set()
+    kafka_transport.stop()
+    assert broker.committed("study_progress_forwarder", STUDY_PROGRESS_TOPIC) == 3
+
+    # Work that a handler put off holds the offset back, but not the events after it
+    from concurrent.futures import Future
+
+    put_off = Future()
+    dispatcher.subscribe(QUIZ_QUESTION_TOPIC, lambda event: put_off if event.username == "batched" else None)
+    broker = MemoryBroker()
+    kafka_transport = KafkaTransport(dispatcher, producer_factory=broker.producer, consumer_factory=broker.consumer,
+                                     admin_factory=broker.admin, partitions=1)
+    kafka_transport.start()
+    handled_events.clear()
+    for username in ["batched", "next"]:
+        kafka_transport.publish(QUIZ_QUESTION_TOPIC, QuizQuestionEvent(username=username, subject="math",
+                                                                       topic="algebra", quiz_question="What is 2+2?"))
+    time.sleep(0.5 + 2 * HANDLER_SECONDS)
+    assert sorted(event.username for event in handled_events) == ["batched", "next"]
+    assert broker.committed("study_progress_forwarder", QUIZ_QUESTION_TOPIC) == 0
+    put_off.set_result(None)
+    time.sleep(0.5)
+    assert broker.committed("study_progress_forwarder", QUIZ_QUESTION_TOPIC) == 2
+    kafka_transport.stop()
+
+    # Publishing doesn't wait for the broker, failed deliveries are reported
+    broker.available = False
+    kafka_transport.publish(STUDY_PROGRESS_TOPIC, StudyProgressEvent(username="alice", subject="math", topic="algebra",
+                                                                     update="Knows the basics"))
+    assert kafka_transport.delivery_failures == 0
+    kafka_transport.flush()
+    assert kafka_transport.delivery_failures == 1
+
+    # While the broker can't be reached, publishing reports the events as failed instead of raising, and the producer
+    # keeps trying to connect in the background
+    from kafka.errors import NoBrokersAvailable
+
+    PRODUCER_RETRY_SECONDS = 0.05
+    broker = MemoryBroker()
+    connects = []
+
+
+    def unreachable_producer(**kwargs):
+        connects.append(kwargs["max_block_ms"])
+        if len(connects) < 3:
+            raise NoBrokersAvailable()
+        return broker.producer(**kwargs)
+
+
+    kafka_transport = KafkaTransport(dispatcher, producer_factory=unreachable_producer,
+                                     consumer_factory=broker.consumer, admin_factory=broker.admin, partitions=1,
+                                     max_block_ms=50)
+    kafka_transport.publish(STUDY_PROGRESS_TOPIC, StudyProgressEvent(username="alice", subject="math", topic="algebra",
+                                                                     update="Knows the basics"))
+    assert kafka_transport.delivery_failures == 1
+    time.sleep(0.5)
+    kafka_transport.publish(STUDY_PROGRESS_TOPIC, StudyProgressEvent(username="alice", subject="math", topic="algebra",
+                                                                     update="Knows more"))
+    kafka_transport.flush()
+    assert kafka_transport.delivery_failures == 1 and connects == [50, 50, 50], connects
+    assert len(broker.read(TopicPartition(STUDY_PROGRESS_TOPIC, 0), 0)) == 1
+
+    # Several workers, each consuming its own partitions: every user's quiz answers and progress updates are handled
+    # by one worker, in the order they were published
+    import random
+
+    PARTITIONS = 6
+    WORKERS = 3
+    broker = MemoryBroker()
+    handled_by: dict[str, list[tuple[int, str, str]]] = {}
+    handled_lock = threading.Lock()
+    workers = []
+    for worker_index in range(WORKERS):
+        def record(event: BaseModel, worker_index=worker_index):
+            time.sleep(random.uniform(0, 0.01))
+            step = event.quiz_question if isinstance(event, QuizQuestionEvent) else event.update
+            with handled_lock:
+                handled_by.setdefault(event.username, []).append((worker_index, type(event).__name__, step))
+
+
+        worker_dispatcher = EventDispatcher(max_workers=4, name=f"worker_{worker_index}")
+        worker_dispatcher.subscribe(QUIZ_QUESTION_TOPIC, record)
+        worker_dispatcher.subscribe(STUDY_PROGRESS_TOPIC, record)
+        worker = KafkaTransport(worker_dispatcher, producer_factory=broker.producer, consumer_factory=broker.consumer,
+                                admin_factory=broker.admin, partitions=PARTITIONS, worker_index=worker_index,
+                                worker_count=WORKERS)
+        worker.start()
+        workers.append(worker)
+
+    usernames = [f"student-{i}" for i in range(20)]
+    publisher = workers[0]
+    for step in range(10):
+        for username in usernames:
+            publisher.publish(QUIZ_QUESTION_TOPIC, QuizQuestionEvent(username=username, subject="math",
+                                                                     topic="algebra", quiz_question=str(step)))
+            publisher.publish(STUDY_PROGRESS_TOPIC, StudyProgressEvent(username=username, subject="math",
+                                                                       topic="algebra", update=str(step)))
+    publisher.flush()
+    deadline = time.time() + 10
+    while sum(len(events) for events in handled_by.values()) < 400 and time.time() < deadline:
+        time.sleep(0.05)
+    [worker.stop() for worker in workers]
+
+    assert len({worker_for_user(username, PARTITIONS, WORKERS) for username in usernames}) == WORKERS
+    for username in usernames:
+        events = handled_by[username]
+        assert {worker_index for worker_index, _, _ in events} == {worker_for_user(username, PARTITIONS, WORKERS)}
+        for event_type in ["QuizQuestionEvent", "StudyProgressEvent"]:
+            steps = [step for _, handled_type, step in events if handled_type == event_type]
+            assert steps == [str(step) for step in range(10)], (username, event_type, steps)
+    assert broker.committed("study_progress_forwarder", QUIZ_QUESTION_TOPIC) == 200
+    print(f"{len(usernames)} users on {PARTITIONS} partitions and {WORKERS} workers, per user order kept")
+    print("OK")
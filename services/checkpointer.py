@@ -0,0 +1,291 @@
+import os
+import random
+import threading
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.types import TASKS, ChannelProtocol
+
+from services.db_pool import ConnectionPool
+
+DEFAULT_CHECKPOINTER = "sqlite"
+DEFAULT_CHECKPOINT_DB_PATH = "checkpoints.db"
+DEFAULT_CHECKPOINT_POOL_SIZE = 4
+
+_checkpointer: BaseCheckpointSaver | None = None
+_checkpointer_lock = threading.Lock()
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    Checkpoint saver that keeps agent state in a SQLite database, so that state survives restarts and is shared by
+    every worker process pointing at the same file. Connections come from a pool, and the writes of a task are
+    saved in a single batched transaction.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CHECKPOINT_DB_PATH, pool_size: int = DEFAULT_CHECKPOINT_POOL_SIZE,
+                 *, serde: Optional[SerializerProtocol] = None):
+        super().__init__(serde=serde)
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size, read_only=False)
+        self.setup()
+
+    def setup(self):
+        with self.pool.connection() as conn:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                task_path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """)
+
+    def _load_writes(self, conn, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list[tuple]:
+        return conn.execute("""
+            SELECT task_id, channel, type, value, task_path, idx FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_path, task_id, idx
+        """, (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+
+    def _to_tuple(self, conn, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._load_writes(conn, thread_id, checkpoint_ns, checkpoint_id)
+        if parent_checkpoint_id:
+            sends = [w for w in self._load_writes(conn, thread_id, checkpoint_ns, parent_checkpoint_id)
+                     if w[1] == TASKS]
+        else:
+            sends = []
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **self.serde.loads_typed((type_, checkpoint)),
+                "pending_sends": [self.serde.loads_typed((s[2], s[3])) for s in sends],
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v, _, _ in
+                            writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """
+        Get the checkpoint for config["configurable"]["checkpoint_id"], or the latest one for the thread.
+        """
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        sql = """
+            SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ?
+        """
+        params: list = [thread_id, checkpoint_ns]
+        if checkpoint_id := get_checkpoint_id(config):
+            sql += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            sql += " ORDER BY checkpoint_id DESC LIMIT 1"
+
+        with self.pool.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+            if row is None:
+                return None
+            return self._to_tuple(conn, thread_id, checkpoint_ns, row)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        """
+        List checkpoints newest first. Without a config, checkpoints of every thread are listed.
+        """
+        sql = """
+            SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type,
+                   metadata
+            FROM checkpoints
+        """
+        where = []
+        params: list = []
+        if config:
+            where.append("thread_id = ?")
+            params.append(str(config["configurable"]["thread_id"]))
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC"
+
+        checkpoint_tuples = []
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(checkpoint_tuples) >= limit:
+                    break
+                checkpoint_tuple = self._to_tuple(conn, thread_id, checkpoint_ns, tuple(row))
+                if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                checkpoint_tuples.append(checkpoint_tuple)
+
+        # Connection goes back to the pool before yielding, callers may use the checkpointer while iterating
+        yield from checkpoint_tuples
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        """
+        Save a checkpoint. Pending sends are not stored with it, they are rebuilt from the writes of the parent.
+        """
+        c = checkpoint.copy()
+        c.pop("pending_sends")  # type: ignore[misc]
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, serialized_checkpoint = self.serde.dumps_typed(c)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self.pool.connection() as conn, conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO checkpoints
+                (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type,
+                 metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"), type_,
+                  serialized_checkpoint, metadata_type, serialized_metadata))
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        """
+        Save the writes of a task in one transaction. Special writes (errors, interrupts) may be replaced,
+        regular writes are only saved once.
+        """
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        special_rows = []
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized_value = self.serde.dumps_typed(value)
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            row = (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, serialized_value, task_path)
+            (special_rows if idx < 0 else rows).append(row)
+
+        sql = """
+            INSERT OR {} INTO writes
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        with self.pool.connection() as conn, conn:
+            conn.executemany(sql.format("IGNORE"), rows)
+            conn.executemany(sql.format("REPLACE"), special_rows)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None):
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
+
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """
+    Create the checkpointer chosen by configuration.
+    CHECKPOINTER: "sqlite" (default) to share durable state between worker processes, or "memory" for a single
+    process that forgets everything on restart.
+    CHECKPOINT_DB_PATH: location of the SQLite database.
+    CHECKPOINT_DB_POOL_SIZE: number of pooled connections to the SQLite database.
+    """
+    backend = os.getenv("CHECKPOINTER", DEFAULT_CHECKPOINTER)
+    if backend == "memory":
+        return MemorySaver()
+    if backend == "sqlite":
+        return SqliteCheckpointSaver(os.getenv("CHECKPOINT_DB_PATH", DEFAULT_CHECKPOINT_DB_PATH),
+                                     int(os.getenv("CHECKPOINT_DB_POOL_SIZE", DEFAULT_CHECKPOINT_POOL_SIZE)))
+    raise ValueError(f"Unknown checkpointer backend: {backend}")
+
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    """
+    Get the checkpointer shared by all agents in this process.
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                _checkpointer = create_checkpointer()
+    return _checkpointer
@@ -0,0 +1,186 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+DB_PATH = "study_material.db"
+DEFAULT_POOL_SIZE = 8
+# Statements are cached per connection, so reusing connections is what makes this cache effective
+CACHED_STATEMENTS = 256
+
+_pools: dict[tuple[str, bool], "ConnectionPool"] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_size() -> int:
+    """
+    Pool size comes from STUDY_MATERIAL_DB_POOL_SIZE. 0 disables pooling and opens a connection per call.
+    """
+    return int(os.getenv("STUDY_MATERIAL_DB_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def _enable_wal(db_path: str):
+    """
+    WAL lets readers keep reading while seed_db (or a checkpointer) writes. The journal mode is persisted in the
+    database file, so this only has to succeed once.
+    """
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Could not enable WAL mode for {db_path}: {e}")
+
+
+def connect(db_path: str = DB_PATH, read_only: bool = True) -> sqlite3.Connection:
+    """
+    Open a connection that can be shared between threads (one thread at a time).
+    Read only connections are opened with a mode=ro URI, so writes fail at the SQLite level.
+    """
+    if read_only:
+        uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    return sqlite3.connect(db_path, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of SQLite connections. Connections are opened lazily up to size and handed out one thread at a
+    time. When all connections are in use, callers wait for one to be returned.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = DEFAULT_POOL_SIZE, read_only: bool = True):
+        self.db_path = db_path
+        self.size = size
+        self.read_only = read_only
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        _enable_wal(db_path)
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                return connect(self.db_path, self.read_only)
+
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+
+
+def get_pool(db_path: str = DB_PATH, read_only: bool = True) -> "ConnectionPool | None":
+    """
+    Get the process wide pool for the database. Returns None when pooling is disabled.
+    """
+    size = _pool_size()
+    if size <= 0:
+        return None
+
+    key = (str(Path(db_path).resolve()), read_only)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_path, size, read_only)
+                _pools[key] = pool
+    return pool
+
+
+@contextmanager
+def read_connection(db_path: str = DB_PATH) -> Iterator[sqlite3.Connection]:
+    """
+    Borrow a read only connection to the database. All readers of study material should go through this.
+    """
+    pool = get_pool(db_path)
+    if pool is None:
+        conn = connect(db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    else:
+        with pool.connection() as conn:
+            yield conn
+
+
+@contextmanager
+def write_connection(db_path: str) -> Iterator[sqlite3.Connection]:
+    """
+    Borrow a writable connection to the database. The transaction is committed when the block exits cleanly.
+    """
+    pool = get_pool(db_path, read_only=False)
+    if pool is None:
+        conn = connect(db_path, read_only=False)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    else:
+        with pool.connection() as conn, conn:
+            yield conn
+
+
+def query(sql: str, params: tuple | list = (), db_path: str = DB_PATH) -> list[tuple]:
+    """
+    Run a read only query and return all rows.
+    """
+    with read_connection(db_path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+if __name__ == "__main__":
+    rows = query("SELECT subject, topic FROM topics")
+    assert len(rows) > 0, "Expected the study material database to have topics"
+
+    try:
+        query("DELETE FROM topics")
+        raise AssertionError("Expected writes to fail on a read only connection")
+    except sqlite3.OperationalError:
+        pass
+
+    # Many threads share a small pool
+    pool = ConnectionPool(DB_PATH, size=2)
+    results = []
+
+
+    def read():
+        with pool.connection() as conn:
+            results.append(conn.execute("SELECT count(*) FROM topics").fetchone()[0])
+
+
+    threads = [threading.Thread(target=read) for _ in range(50)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(results) == 50
+    assert pool._opened <= 2
+    print("OK")
@@ -0,0 +1,338 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+DEFAULT_EVENT_WORKERS = 8
+DEFAULT_EVENT_MAX_PENDING = 1000
+RETRY_BACKOFF_SECONDS = 0.5
+
+# A handler that puts part of its work off, e.g. into a batch, returns a Future that is done once that work ran
+EventHandler = Callable[[Any], Any]
+# Called with True once every handler succeeded, False when a handler still failed after its retries
+DoneCallback = Callable[[bool], Any]
+# Called once the handlers returned, before the work they put off is done
+HandledCallback = Callable[[], Any]
+# Events of a topic with the same coalesce key supersede each other while they wait to be handled
+CoalesceKey = Callable[[Any], Hashable]
+
+
+class _Queued:
+    """
+    An event waiting in a key's queue. A superseded event hands its done callbacks to the event that replaced it.
+    """
+
+    def __init__(self, handlers: list[EventHandler], event: Any, limited: bool, retries: int,
+                 on_handled: HandledCallback | None, on_done: DoneCallback | None, coalesce_key: Hashable | None):
+        self.handlers = handlers
+        self.event = event
+        self.retries = retries
+        self.coalesce_key = coalesce_key
+        # (limited, on_handled, on_done) of this event and of the events it superseded
+        self.dispatches: list[tuple[bool, HandledCallback | None, DoneCallback | None]] = [
+            (limited, on_handled, on_done)]
+
+
+class EventDispatcher:
+    """
+    Calls the handlers subscribed to a topic on a bounded pool of threads.
+    Events with the same key (the username) are handled one at a time in the order they were dispatched, events of
+    different keys are handled in parallel. Dispatching blocks once max_pending events are waiting, so a burst of
+    events can't pile up unbounded work. Events dispatched from a handler skip that limit, otherwise handlers that
+    publish could wait on each other forever.
+    Topics registered with coalesce only keep the latest of a key's waiting events with the same coalesce key: it
+    takes the place of the earlier ones at the end of the queue, and their on_done callbacks get its outcome.
+    A handler returning a Future has put part of the work off: the event's on_done callback waits for the Future, while
+    the key's next event doesn't.
+    """
+
+    def __init__(self, max_workers: int | None = None, max_pending: int | None = None, name: str = "events"):
+        max_workers = max_workers or int(os.getenv("EVENT_WORKERS", DEFAULT_EVENT_WORKERS))
+        self.max_pending = max_pending or int(os.getenv("EVENT_MAX_PENDING", DEFAULT_EVENT_MAX_PENDING))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._handlers: dict[str, list[EventHandler]] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # key -> events waiting to be handled, a key is in here while one of the workers is draining it
+        self._queues: dict[Hashable, deque[_Queued]] = {}
+        self._coalesce_keys: dict[str, CoalesceKey] = {}
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._in_handler = threading.local()
+        self._pending = 0
+        self.processed = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def subscribe(self, topic: str, handler: EventHandler):
+        with self._lock:
+            handlers = self._handlers.setdefault(topic, [])
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def coalesce(self, topic: str, coalesce_key: CoalesceKey):
+        """
+        Let later events of topic supersede the key's waiting events of the topic with the same coalesce key, for
+        events that replace the earlier ones, like a new progress summary of a topic.
+        Args:
+            topic: topic whose events are coalesced
+            coalesce_key: called with an event, events with equal results supersede each other
+        """
+        with self._lock:
+            self._coalesce_keys[topic] = coalesce_key
+
+    def dispatch(self, topic: str, key: Hashable, event: Any, timeout: float | None = None, retries: int = 0,
+                 on_done: DoneCallback | None = None, on_handled: HandledCallback | None = None) -> bool:
+        """
+        Queue an event for the handlers of its topic.
+        Args:
+            topic: topic the event was published to
+            key: events with the same key are handled in order
+            event: passed to every handler
+            timeout: how long to wait for room in the queue, None waits as long as needed
+            retries: a failing handler is retried this many times, with backoff, before the key's next event runs
+            on_done: called once the handlers finished with the event, including the work they put off
+            on_handled: called on the worker thread once the handlers returned
+        Returns:
+            False when the queue stayed full for timeout seconds and the event was not queued
+        """
+        with self._lock:
+            handlers = list(self._handlers.get(topic, []))
+            coalesce_key = self._coalesce_keys.get(topic)
+        if not handlers:
+            if on_handled:
+                on_handled()
+            if on_done:
+                on_done(True)
+            return True
+        return self._enqueue(f"{topic} event", key, handlers, event, timeout, retries, on_handled, on_done,
+                             (topic, coalesce_key(event)) if coalesce_key else None)
+
+    def call(self, key: Hashable, handler: EventHandler, event: Any, retries: int = 0,
+             on_done: DoneCallback | None = None) -> bool:
+        """
+        Queue a call of handler with event behind the events of key, e.g. work that a handler put off until later.
+        Args:
+            key: the call runs after the key's events that were dispatched before it
+            handler: called with event
+            event: passed to handler
+            retries: a failing handler is retried this many times, with backoff, before the key's next event runs
+            on_done: called on the worker thread once handler finished
+        """
+        return self._enqueue(getattr(handler, "__name__", "call"), key, [handler], event, None, retries, None,
+                             on_done)
+
+    def _enqueue(self, description: str, key: Hashable, handlers: list[EventHandler], event: Any,
+                 timeout: float | None, retries: int, on_handled: HandledCallback | None,
+                 on_done: DoneCallback | None, coalesce_key: Hashable | None = None) -> bool:
+        limited = not getattr(self._in_handler, "active", False)
+        if limited and not self._slots.acquire(timeout=timeout):
+            print(f"Event queue is full, dropping {description} for {key}")
+            return False
+
+        queued = _Queued(handlers, event, limited, retries, on_handled, on_done, coalesce_key)
+        superseded = None
+        with self._lock:
+            queue = self._queues.get(key)
+            start = queue is None
+            if start:
+                queue = self._queues[key] = deque()
+            elif coalesce_key is not None:
+                superseded = next((waiting for waiting in queue if waiting.coalesce_key == coalesce_key), None)
+            if superseded:
+                queue.remove(superseded)
+                queued.dispatches = [(False, *callbacks) for _, *callbacks in superseded.dispatches] + queued.dispatches
+                self.coalesced += 1
+            else:
+                self._pending += 1
+            queue.append(queued)
+
+        if superseded:
+            # The superseded events leave the queue, so they give back their room in it
+            for limited, *_ in superseded.dispatches:
+                if limited:
+                    self._slots.release()
+        if start:
+            self._executor.submit(self._drain, key)
+        return True
+
+    def _drain(self, key: Hashable):
+        self._in_handler.active = True
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                queued = queue.popleft()
+
+            failed = False
+            put_off = []
+            for handler in queued.handlers:
+                succeeded, result = self._call(handler, key, queued.event, queued.retries)
+                failed |= not succeeded
+                if isinstance(result, Future):
+                    put_off.append(result)
+            for limited, on_handled, _ in queued.dispatches:
+                if on_handled:
+                    self._callback(on_handled, key)
+                if limited:
+                    self._slots.release()
+            if put_off:
+                self._done_when(put_off, key, queued.dispatches, not failed)
+            else:
+                self._done(key, queued.dispatches, not failed)
+
+            with self._lock:
+                self._pending -= 1
+                self.processed += 1
+                self.failed += failed
+                if self._pending == 0:
+                    self._idle.notify_all()
+
+    @staticmethod
+    def _call(handler: EventHandler, key: Hashable, event: Any, retries: int) -> tuple[bool, Any]:
+        for attempt in range(retries + 1):
+            try:
+                return True, handler(event)
+            except Exception as e:
+                print(f"Event handler {getattr(handler, '__name__', handler)} failed for {key} "
+                      f"(attempt {attempt + 1} of {retries + 1}): {e}")
+                if attempt < retries:
+                    time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+        return False, None
+
+    @staticmethod
+    def _callback(callback: Callable, key: Hashable, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Event callback failed for {key}: {e}")
+
+    def _done(self, key: Hashable, dispatches: list[tuple], succeeded: bool):
+        for _, _, on_done in dispatches:
+            if on_done:
+                self._callback(on_done, key, succeeded)
+
+    def _done_when(self, futures: list[Future], key: Hashable, dispatches: list[tuple], succeeded: bool):
+        """
+        Call the done callbacks once the work the handlers put off is done, on the thread that finishes it.
+        """
+        lock = threading.Lock()
+        outcome = {"remaining": len(futures), "succeeded": succeeded}
+
+        def future_done(future: Future):
+            with lock:
+                outcome["remaining"] -= 1
+                outcome["succeeded"] &= not future.cancelled() and future.exception() is None
+                if outcome["remaining"]:
+                    return
+            self._done(key, dispatches, outcome["succeeded"])
+
+        for future in futures:
+            future.add_done_callback(future_done)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def join(self, timeout: float | None = None) -> bool:
+        """
+        Wait until every dispatched event was handled. Returns False on timeout.
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+
+if __name__ == "__main__":
+    handled: list[tuple[str, int]] = []
+    in_progress: set[str] = set()
+    concurrent_users = []
+
+
+    def slow_handler(event: tuple[str, int]):
+        username, number = event
+        assert username not in in_progress, "Events of the same user must not run concurrently"
+        in_progress.add(username)
+        concurrent_users.append(len(in_progress))
+        time.sleep(0.01)
+        handled.append(event)
+        in_progress.discard(username)
+
+
+    dispatcher = EventDispatcher(max_workers=4, max_pending=8)
+    dispatcher.subscribe("quiz_question", slow_handler)
+    dispatcher.subscribe("quiz_question", slow_handler)
+    for number in range(20):
+        for username in ["alice", "bob", "carol", "dave"]:
+            dispatcher.dispatch("quiz_question", username, (username, number))
+        # Backpressure keeps the queue bounded
+        assert dispatcher.pending <= 8
+    assert dispatcher.join(5)
+
+    assert len(handled) == 80, "Every event is handled once per handler, subscribing twice is a no-op"
+    for username in ["alice", "bob", "carol", "dave"]:
+        assert [number for name, number in handled if name == username] == list(range(20)), "Per user order"
+    assert max(concurrent_users) > 1, "Different users are handled in parallel"
+
+    # Handlers can publish without waiting for room in the queue
+    chained = []
+    dispatcher.subscribe("quiz_graded", lambda event: chained.append(event))
+    dispatcher.subscribe("quiz_answered", lambda event: dispatcher.dispatch("quiz_graded", event, event))
+    for i in range(50):
+        dispatcher.dispatch("quiz_answered", f"user-{i}", f"user-{i}")
+    assert dispatcher.join(5) and len(chained) == 50
+
+    # Failing handlers don't stop the user's later events
+    dispatcher.subscribe("failing", lambda event: 1 / event)
+    dispatcher.dispatch("failing", "alice", 0)
+    dispatcher.dispatch("failing", "alice", 1)
+    assert dispatcher.join(5) and dispatcher.failed == 1
+
+    # Retries run before the key's next event, on_done reports the outcome
+    RETRY_BACKOFF_SECONDS = 0
+    attempts, outcomes = [], []
+    flaky = lambda event: attempts.append(event) or (len(attempts) < 3 and 1 / 0)
+    dispatcher.subscribe("flaky", flaky)
+    dispatcher.dispatch("flaky", "alice", "first", retries=2, on_done=outcomes.append)
+    dispatcher.dispatch("flaky", "alice", "second", on_done=outcomes.append)
+    assert dispatcher.join(5)
+    assert attempts == ["first", "first", "first", "second"] and outcomes == [True, True], (attempts, outcomes)
+    assert dispatcher.dispatch("unknown", "alice", 1), "Topics without handlers are ignored"
+
+    # Calls run in order with the key's events and are retried the same way
+    attempts.clear()
+    outcomes.clear()
+    dispatcher.dispatch("flaky", "alice", "event")
+    dispatcher.call("alice", flaky, "call", retries=2, on_done=outcomes.append)
+    assert dispatcher.join(5)
+    assert attempts == ["event", "call", "call"] and outcomes == [True], (attempts, outcomes)
+
+    # Waiting events with the same coalesce key are replaced by the latest, other events keep their order
+    handled.clear()
+    outcomes.clear()
+    dispatcher.subscribe("progress", lambda event: (time.sleep(0.05), handled.append(event)))
+    dispatcher.subscribe("answer", handled.append)
+    dispatcher.coalesce("progress", lambda event: event[0])
+    dispatcher.dispatch("progress", "alice", ("Sorting", 1), on_done=outcomes.append)
+    time.sleep(0.01)
+    for update in range(2, 6):
+        dispatcher.dispatch("progress", "alice", ("Sorting", update), on_done=outcomes.append)
+        dispatcher.dispatch("progress", "alice", ("Heap", update), on_done=outcomes.append)
+    dispatcher.dispatch("answer", "alice", "answer")
+    assert dispatcher.join(5)
+    assert handled == [("Sorting", 1), ("Sorting", 5), ("Heap", 5), "answer"], handled
+    assert outcomes == [True] * 9 and dispatcher.coalesced == 6 and dispatcher.pending == 0
+
+    # Work put off by a handler doesn't hold up the key's next event, but the event is only done once it ran
+    put_off, order = Future(), []
+    dispatcher.subscribe("batched", lambda event: put_off)
+    dispatcher.dispatch("batched", "alice", 1, on_handled=lambda: order.append("handled"),
+                        on_done=lambda succeeded: order.append(("done", succeeded)))
+    dispatcher.dispatch("answer", "alice", "next")
+    assert dispatcher.join(5) and order == ["handled"] and handled[-1] == "next", (order, handled)
+    put_off.set_result(None)
+    assert order == ["handled", ("done", True)], order
+    print("OK")
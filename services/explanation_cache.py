@@ -0,0 +1,167 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import NamedTuple
+
+from services.study_guide_cache import cache_key
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# 0 disables similar question lookups, only normalized questions that are equal share an answer
+DEFAULT_SIMILARITY = 0.0
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _vector(query: str) -> Counter:
+    return Counter(normalize(query).split())
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[word] for word, count in a.items())
+    norms = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norms if norms else 0.0
+
+
+class _Entry(NamedTuple):
+    answer: str
+    expires_at: float
+    group: str
+    vector: Counter
+
+
+class ExplanationCache:
+    """
+    In-memory cache of answers to questions about selected study guide text, shared by all users. Answers are keyed
+    by a hash of the study guide, the normalized selection and the normalized question. With a similarity threshold,
+    a question about the same selection of the same study guide whose word vector is at least that cosine similar to
+    a cached question gets the cached answer too. Entries expire ttl_seconds after they were cached, and the least
+    recently used entries are evicted when there are more than max_entries.
+    Args:
+        max_entries: EXPLAIN_CACHE_MAX_ENTRIES by default, 0 disables the cache
+        ttl_seconds: EXPLAIN_CACHE_TTL_SECONDS by default
+        similarity: EXPLAIN_CACHE_SIMILARITY by default, 0 disables similar question lookups
+    """
+
+    def __init__(self, max_entries: int | None = None, ttl_seconds: float | None = None,
+                 similarity: float | None = None):
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.getenv("EXPLAIN_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv("EXPLAIN_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        self.similarity = similarity if similarity is not None else float(
+            os.getenv("EXPLAIN_CACHE_SIMILARITY", DEFAULT_SIMILARITY))
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # study guide and selection -> keys of the questions asked about it
+        self._groups: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(study_guide: str, selection: str, query: str) -> tuple[str, str]:
+        group = cache_key({"study_guide": hashlib.sha256(study_guide.encode("utf-8")).hexdigest(),
+                           "selection": normalize(selection)})
+        return group, cache_key({"group": group, "query": normalize(query)})
+
+    def get(self, study_guide: str, selection: str, query: str) -> str | None:
+        """
+        Get the cached answer to a question, None when there is none or it expired.
+        """
+        if self.max_entries <= 0:
+            return None
+        group, key = self._keys(study_guide, selection, query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            similar = False
+            if (entry is None or entry.expires_at <= now) and self.similarity > 0:
+                vector = _vector(query)
+                scored = [(_cosine(vector, self._entries[other].vector), other)
+                          for other in self._groups.get(group, ()) if self._entries[other].expires_at > now]
+                score, key = max(scored, default=(0.0, key))
+                entry = self._entries.get(key) if score >= self.similarity else None
+                similar = entry is not None
+            if entry is None or entry.expires_at <= now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.similar_hits += similar
+            return entry.answer
+
+    def put(self, study_guide: str, selection: str, query: str, answer: str):
+        """
+        Cache an answer, then evict expired and least recently used entries to stay within max_entries.
+        """
+        if self.max_entries <= 0:
+            return
+        group, key = self._keys(study_guide, selection, query)
+        now = time.time()
+        with self._lock:
+            self._entries[key] = _Entry(answer, now + self.ttl_seconds, group, _vector(query))
+            self._entries.move_to_end(key)
+            self._groups.setdefault(group, set()).add(key)
+            expired = [other for other, entry in self._entries.items() if entry.expires_at <= now]
+            for other in expired:
+                self._remove(other)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self.evictions += len(expired)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        keys = self._groups[entry.group]
+        keys.discard(key)
+        if not keys:
+            del self._groups[entry.group]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "similar_hits": self.similar_hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self._entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+if __name__ == "__main__":
+    guide = "# Heaps\nA binary heap is a complete binary tree."
+    selection = "A binary heap is a complete binary tree."
+
+    cache = ExplanationCache(max_entries=2, ttl_seconds=60)
+    assert cache.get(guide, selection, "What does this mean?") is None
+    cache.put(guide, selection, "What does this mean?", "Every level is full.")
+    assert cache.get(guide, " a binary heap is a complete\nbinary tree. ", "what does this mean") == \
+           "Every level is full.", "Selection and question are normalized"
+    assert cache.get(guide + "\nMore.", selection, "What does this mean?") is None, "A new study guide misses"
+    assert cache.get(guide, selection, "What does that mean?") is None, "Without similarity only equal questions hit"
+
+    # The least recently used entry is evicted
+    cache.put(guide, selection, "Why an array?", "Children are at 2i + 1 and 2i + 2.")
+    cache.get(guide, selection, "What does this mean?")
+    cache.put(guide, selection, "How fast is insert?", "O(log n).")
+    assert cache.get(guide, selection, "Why an array?") is None
+    assert cache.get(guide, selection, "What does this mean?") is not None and cache.evictions == 1
+
+    similar = ExplanationCache(max_entries=10, ttl_seconds=60, similarity=0.7)
+    similar.put(guide, selection, "What does this mean?", "Every level is full.")
+    assert similar.get(guide, selection, "what does that mean") == "Every level is full."
+    assert similar.get(guide, selection, "How fast is insert?") is None
+    assert similar.get(guide, "Another selection", "what does that mean") is None, "Only the same selection"
+    assert similar.stats()["similar_hits"] == 1
+
+    expiring = ExplanationCache(max_entries=10, ttl_seconds=0.05)
+    expiring.put(guide, selection, "What does this mean?", "Every level is full.")
+    time.sleep(0.1)
+    assert expiring.get(guide, selection, "What does this mean?") is None
+    assert ExplanationCache(max_entries=0).get(guide, selection, "What does this mean?") is None
+    print("OK")
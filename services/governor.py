@@ -0,0 +1,414 @@
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Literal, NamedTuple, TypeAlias
+
+import httpx
+
+# OpenAI's usage tier 2 limits of gpt-4o
+DEFAULT_REQUESTS_PER_MINUTE = 5000
+DEFAULT_TOKENS_PER_MINUTE = 450_000
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+# Completion tokens reserved for a call that doesn't say how many it wants
+DEFAULT_COMPLETION_TOKENS = 1000
+# Responses that the OpenAI clients would retry: timeouts, conflicts and rate limits, and any server error
+RETRIED_STATUS_CODES = frozenset({408, 409, 429})
+# Providers enforce per minute limits over shorter windows, so bursts are limited to a second's worth
+BURST_SECONDS = 1.0
+
+Priority: TypeAlias = Literal["interactive", "background"]
+# Waiting calls of a lower rank go first
+PRIORITY_RANKS: dict[str, int] = {"interactive": 0, "background": 1}
+
+_priority: ContextVar[str] = ContextVar("model_priority", default="interactive")
+
+
+@contextmanager
+def model_priority(priority: Priority):
+    """
+    Model calls made in the block, also by the graphs it runs, wait behind the model calls of higher priority.
+    Calls are interactive by default, work that no student is waiting for should run as background.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class ModelLimits(NamedTuple):
+    """
+    Limits of one model, 0 means unlimited.
+    """
+    requests_per_minute: float
+    tokens_per_minute: float
+    max_concurrency: int
+
+    @classmethod
+    def from_env(cls) -> "ModelLimits":
+        return cls(
+            requests_per_minute=float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+            tokens_per_minute=float(os.getenv("OPENAI_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)),
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+        )
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens and refills at rate_per_second. A call may take more than the bucket holds, then the
+    following calls wait until the debt is paid back. Not thread safe, the governor locks around it.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until amount tokens can be taken. Amounts above capacity only wait for a full bucket.
+        """
+        if self.rate_per_second <= 0:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+        self.updated = now
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate_per_second if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        if self.rate_per_second > 0:
+            self.tokens -= amount
+
+
+class _ModelState:
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_minute / 60,
+                                    max(1.0, limits.requests_per_minute / 60 * BURST_SECONDS))
+        self.tokens = TokenBucket(limits.tokens_per_minute / 60, limits.tokens_per_minute / 60 * BURST_SECONDS)
+        self.waiting: list[tuple[int, int, str]] = []
+        self.in_flight = 0
+        self.calls = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+
+class ModelGovernor:
+    """
+    Coordinates the outbound calls of all agents to every model: a call waits until the model's request and token
+    buckets allow it and fewer than max_concurrency calls to the model are in flight. Waiting calls go in priority
+    order, interactive before background, and first come first served within a priority. Calls that are rate limited
+    anyway, fail with a server error or don't reach the server are retried with jittered exponential backoff. The
+    governor is the only retry layer, the OpenAI clients don't retry themselves.
+    Args:
+        limits: model name -> limits, models that are not listed get default_limits
+        default_limits: ModelLimits.from_env() by default
+        retries: GOVERNOR_RETRIES by default, retries of a rate limited or failed call
+        backoff_seconds: backoff before the first retry, doubled for every retry and jittered
+    """
+
+    def __init__(self, limits: dict[str, ModelLimits] | None = None, default_limits: ModelLimits | None = None,
+                 retries: int | None = None, backoff_seconds: float = DEFAULT_BACKOFF_SECONDS):
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or ModelLimits.from_env()
+        self.retries = retries if retries is not None else int(os.getenv("GOVERNOR_RETRIES", DEFAULT_RETRIES))
+        self.backoff_seconds = backoff_seconds
+        self._models: dict[str, _ModelState] = {}
+        self._tickets = itertools.count()
+        self._changed = threading.Condition()
+
+    def acquire(self, model: str, tokens: float = 0, priority: Priority | None = None) -> Callable[[], None]:
+        """
+        Wait for the model's turn, then take a call slot.
+        Args:
+            model: name of the model, e.g. gpt-4o
+            tokens: estimated prompt and completion tokens of the call
+            priority: priority of the call, the priority of the current model_priority block by default
+        Returns:
+            release, to be called once when the call is done
+        """
+        priority = priority or _priority.get()
+        start = time.monotonic()
+        with self._changed:
+            state = self._state(model)
+            ticket = (PRIORITY_RANKS[priority], next(self._tickets), priority)
+            heapq.heappush(state.waiting, ticket)
+            while True:
+                timeout = None
+                if state.waiting[0] is ticket and (not state.limits.max_concurrency
+                                                   or state.in_flight < state.limits.max_concurrency):
+                    now = time.monotonic()
+                    timeout = max(state.requests.wait_time(1, now), state.tokens.wait_time(tokens, now))
+                    if timeout <= 0:
+                        break
+                self._changed.wait(timeout)
+            heapq.heappop(state.waiting)
+            state.requests.take(1)
+            state.tokens.take(tokens)
+            state.in_flight += 1
+            state.calls += 1
+            state.wait_seconds += time.monotonic() - start
+            # The next waiting call may go now too
+            self._changed.notify_all()
+
+        released = False
+
+        def release():
+            nonlocal released
+            with self._changed:
+                if released:
+                    return
+                released = True
+                state.in_flight -= 1
+                self._changed.notify_all()
+
+        return release
+
+    def backoff(self, model: str, attempt: int, retry_after: float | None = None, rate_limited: bool = True) -> float:
+        """
+        Record that a call was rate limited, or failed when rate_limited is False.
+        Returns:
+            how long to wait before retrying it: Retry-After when the server says so, or full jitter exponential
+        """
+        with self._changed:
+            state = self._state(model)
+            if rate_limited:
+                state.rate_limited += 1
+            else:
+                state.failed += 1
+            state.retries += attempt < self.retries
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(MAX_BACKOFF_SECONDS, self.backoff_seconds * 2 ** attempt))
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Live queue depth per priority, calls in flight and counters of every model.
+        """
+        with self._changed:
+            return {model: {"queued": {priority: sum(1 for ticket in state.waiting if ticket[2] == priority)
+                                       for priority in PRIORITY_RANKS},
+                            "in_flight": state.in_flight, "calls": state.calls, "rate_limited": state.rate_limited,
+                            "failed": state.failed, "retries": state.retries,
+                            "avg_wait_seconds": state.wait_seconds / state.calls if state.calls else 0.0}
+                    for model, state in self._models.items()}
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(self.limits.get(model, self.default_limits))
+        return state
+
+
+def _request_cost(request: httpx.Request) -> tuple[str | None, float]:
+    """
+    Model and estimated tokens of an OpenAI API request: about 4 characters per prompt token plus the completion
+    tokens it asks for.
+    """
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        return None, 0
+    if not isinstance(body, dict) or "model" not in body:
+        return None, 0
+    completion = body.get("max_completion_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return body["model"], len(request.content) / 4 + completion
+
+
+def _retried(response: httpx.Response) -> bool:
+    return response.status_code in RETRIED_STATUS_CODES or response.status_code >= 500
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """
+    Keeps the call slot until a streamed response was read and closed.
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+
+class GovernedTransport(httpx.BaseTransport):
+    """
+    HTTP transport of the OpenAI clients that sends every model call through the governor, so that chat models,
+    agents and speech calls share the limits without knowing about each other. Requests without a model are sent as is.
+    Args:
+        governor: governor of the calls
+        transport: transport that sends the requests
+    """
+
+    def __init__(self, governor: ModelGovernor, transport: httpx.BaseTransport):
+        self.governor = governor
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        model, tokens = _request_cost(request)
+        if model is None:
+            return self.transport.handle_request(request)
+
+        for attempt in range(self.governor.retries + 1):
+            release = self.governor.acquire(model, tokens)
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as error:
+                # Timeouts and connection errors
+                release()
+                if attempt == self.governor.retries:
+                    raise
+                delay = self.governor.backoff(model, attempt, rate_limited=False)
+                print(f"{model} call failed ({type(error).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                release()
+                raise
+            if not _retried(response) or attempt == self.governor.retries:
+                response.stream = _ReleasingStream(response.stream, release)
+                return response
+            response.close()
+            release()
+            rate_limited = response.status_code == 429
+            delay = self.governor.backoff(model, attempt, _retry_after(response), rate_limited)
+            if rate_limited:
+                print(f"{model} rate limited ({_priority.get()}), retrying in {delay:.2f}s")
+            else:
+                print(f"{model} call failed ({response.status_code}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def close(self):
+        self.transport.close()
+
+
+_governor: ModelGovernor | None = None
+_governor_lock = threading.Lock()
+
+
+def get_model_governor() -> ModelGovernor:
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = ModelGovernor()
+        return _governor
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Concurrency: at most 2 calls in flight
+    governor = ModelGovernor(default_limits=ModelLimits(0, 0, max_concurrency=2), retries=0)
+    in_flight, peak, lock = 0, 0, threading.Lock()
+
+
+    def call():
+        global in_flight, peak
+        release = governor.acquire("gpt-4o")
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight -= 1
+        release()
+
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: call(), range(40)))
+    assert peak == 2, peak
+
+    # Requests per minute: a burst of a second's worth, then one call per 1/100 s
+    governor = ModelGovernor(default_limits=ModelLimits(requests_per_minute=6000, tokens_per_minute=0,
+                                                        max_concurrency=0))
+    start = time.monotonic()
+    for _ in range(100 + 20):
+        governor.acquire("gpt-4o")()
+    assert 0.19 <= time.monotonic() - start < 0.5, time.monotonic() - start
+
+    # Tokens per minute: a call larger than the bucket goes once the bucket is full, the next one waits for the debt
+    governor = ModelGovernor(default_limits=ModelLimits(0, tokens_per_minute=6000, max_concurrency=0))
+    governor.acquire("gpt-4o", tokens=200)()
+    start = time.monotonic()
+    governor.acquire("gpt-4o", tokens=10)()
+    assert 1.0 <= time.monotonic() - start < 1.5, time.monotonic() - start
+    governor.acquire("gpt-4o-mini", tokens=200)()
+
+    # Interactive calls that queue up behind background calls go first
+    governor = ModelGovernor(default_limits=ModelLimits(0, 0, max_concurrency=1))
+    order = []
+    blocker = governor.acquire("gpt-4o")
+
+
+    def queued(priority: Priority, name: str):
+        with model_priority(priority):
+            release = governor.acquire("gpt-4o")
+        order.append(name)
+        release()
+
+
+    threads = [threading.Thread(target=queued, args=("background", f"background-{i}")) for i in range(3)]
+    threads += [threading.Thread(target=queued, args=("interactive", "interactive"))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    assert governor.stats()["gpt-4o"]["queued"] == {"interactive": 1, "background": 3}
+    blocker()
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "background-0", "background-1", "background-2"], order
+    assert governor.stats()["gpt-4o"]["queued"] == {"interactive": 0, "background": 0}
+
+    # Backoff honours Retry-After, otherwise it is jittered and grows
+    assert governor.backoff("gpt-4o", 0, retry_after=2.0) == 2.0
+    assert all(0 <= governor.backoff("gpt-4o", 3) <= DEFAULT_BACKOFF_SECONDS * 8 for _ in range(100))
+
+    # Server errors and connection errors are retried like rate limits, client errors are not
+    statuses = [httpx.ConnectError("Connection refused"), 503, 429, 200]
+
+
+    def flaky(request: httpx.Request) -> httpx.Response:
+        status = statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        # Streamed like the responses of a real transport
+        return httpx.Response(status, content=iter([b"{}"]))
+
+
+    governor = ModelGovernor(default_limits=ModelLimits(0, 0, 0), retries=3, backoff_seconds=0.001)
+    client = httpx.Client(transport=GovernedTransport(governor, httpx.MockTransport(flaky)))
+    assert client.post("https://api.openai.com/v1/chat/completions", json={"model": "gpt-4o"}).status_code == 200
+    stats = governor.stats()["gpt-4o"]
+    assert (stats["rate_limited"], stats["failed"], stats["retries"], stats["in_flight"]) == (1, 2, 3, 0), stats
+    statuses = [400, 200]
+    assert client.post("https://api.openai.com/v1/chat/completions", json={"model": "gpt-4o"}).status_code == 400
+    statuses = [500] * 4
+    assert client.post("https://api.openai.com/v1/chat/completions", json={"model": "gpt-4o"}).status_code == 500
+    assert statuses == [] and governor.stats()["gpt-4o"]["in_flight"] == 0
+    print("OK")
@@ -0,0 +1,173 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Iterator, Literal
+
+# Finished jobs are kept around so that clients can still read their status
+FINISHED_JOBS_KEPT = 1000
+
+JobStatus = Literal["pending", "running", "done", "failed"]
+
+
+class Job:
+    """
+    A unit of work running on a JobRunner. Clients poll it by id, or read its output while it runs.
+    """
+
+    def __init__(self, key: Hashable):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status: JobStatus = "pending"
+        self.result: Any = None
+        self.error: str | None = None
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        # Partial output written while the job runs, e.g. tokens of a study guide
+        self.output: list[str] = []
+        self._done = threading.Event()
+        self._changed = threading.Condition()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def write(self, chunk: str):
+        with self._changed:
+            self.output.append(chunk)
+            self._changed.notify_all()
+
+    def iter_output(self) -> Iterator[str]:
+        """
+        Yields the output written so far and then every new chunk as it is written, until the job finishes.
+        """
+        position = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(self.output) > position or self.finished)
+                chunks = self.output[position:]
+                finished = self.finished
+            position += len(chunks)
+            yield from chunks
+            if finished and not chunks:
+                return
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "status": self.status, "error": self.error}
+
+
+class JobRunner:
+    """
+    Runs slow work on a bounded pool of threads, so that it does not hold a web worker.
+    Jobs are deduplicated by key while they are in flight: submitting the same key again returns the running job.
+    """
+
+    def __init__(self, max_workers: int, name: str = "jobs"):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._in_flight: dict[Hashable, Job] = {}
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Job:
+        return self._submit(key, fn, args, kwargs, streaming=False)
+
+    def submit_streaming(self, key: Hashable, fn: Callable, *args, **kwargs) -> Job:
+        """
+        Like submit, fn is also called with on_token=job.write so that it can stream partial output to clients.
+        """
+        return self._submit(key, fn, args, kwargs, streaming=True)
+
+    def _submit(self, key: Hashable, fn: Callable, args: tuple, kwargs: dict, streaming: bool) -> Job:
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                return job
+            job = Job(key)
+            self._in_flight[key] = job
+            self._jobs[job.id] = job
+            self._prune()
+
+        if streaming:
+            kwargs = {**kwargs, "on_token": job.write}
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def in_flight(self, key: Hashable) -> Job | None:
+        with self._lock:
+            return self._in_flight.get(key)
+
+    def _run(self, job: Job, fn: Callable, args: tuple, kwargs: dict):
+        job.status = "running"
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            print(f"Job {job.key} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+            with job._changed:
+                job._changed.notify_all()
+            job._done.set()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+
+
+if __name__ == "__main__":
+    calls = []
+    release = threading.Event()
+
+
+    def slow_work(value: str):
+        calls.append(value)
+        release.wait()
+        return value.upper()
+
+
+    runner = JobRunner(max_workers=2)
+    first = runner.submit(("alice", "Sorting"), slow_work, "sorting")
+    second = runner.submit(("alice", "Sorting"), slow_work, "sorting")
+    other = runner.submit(("bob", "Sorting"), slow_work, "bob sorting")
+    assert first is second, "In flight jobs with the same key are deduplicated"
+    assert first is not other
+
+    release.set()
+    assert first.wait(5) and other.wait(5)
+    assert first.status == "done" and first.result == "SORTING"
+    assert calls == ["sorting", "bob sorting"], calls
+    assert runner.get(first.id) is first
+
+    # Once finished, the same key runs again
+    third = runner.submit(("alice", "Sorting"), slow_work, "sorting")
+    assert third is not first and third.wait(5)
+
+    # Output is streamed while the job runs
+    def write_tokens(on_token):
+        for token in ["Heaps ", "are ", "trees"]:
+            on_token(token)
+            time.sleep(0.05)
+        return "done"
+
+
+    streaming = runner.submit_streaming("tokens", write_tokens)
+    assert "".join(streaming.iter_output()) == "Heaps are trees" and streaming.result == "done"
+    assert list(streaming.iter_output()) == ["Heaps ", "are ", "trees"], "Finished jobs replay their output"
+
+    failed = runner.submit("boom", lambda: 1 / 0)
+    failed.wait(5)
+    assert failed.status == "failed" and "division" in failed.error
+    print("OK")
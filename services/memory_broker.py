@@ -0,0 +1,319 @@
+import threading
+import time
+from typing import Any, Callable, Iterator, NamedTuple
+
+from kafka.admin import NewTopic
+from kafka.errors import KafkaTimeoutError, TopicAlreadyExistsError
+from kafka.future import Future
+from kafka.partitioner.default import DefaultPartitioner
+from kafka.structs import TopicPartition, OffsetAndMetadata
+
+# Same partitioner as KafkaProducer, so records land on the partitions they would land on with a real broker
+_partitioner = DefaultPartitioner()
+
+
+class MemoryRecord(NamedTuple):
+    """
+    The fields of kafka.consumer.fetcher.ConsumerRecord that the agents use.
+    """
+    topic: str
+    partition: int
+    offset: int
+    key: Any
+    value: Any
+
+
+class MemoryBroker:
+    """
+    In-memory stand-in for a Kafka broker, used by tests and benchmarks. Every partition of a topic is an append only
+    log, records are assigned to partitions by key with Kafka's default partitioner. Topics are created with
+    default_partitions when they are first used. Consumer groups remember their committed offsets.
+    producer(), consumer() and admin() take the same arguments as KafkaProducer, KafkaConsumer and KafkaAdminClient.
+    Args:
+        latency_seconds: simulated network round trip, paid by every batch a producer sends
+        default_partitions: number of partitions of topics that were not created with admin().create_topics
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, default_partitions: int = 1):
+        self.latency_seconds = latency_seconds
+        self.default_partitions = default_partitions
+        # Set to False to simulate an outage, sends then fail like they time out on a real broker
+        self.available = True
+        self._partitions: dict[str, int] = {}
+        self._logs: dict[TopicPartition, list[tuple[bytes | None, bytes]]] = {}
+        self._committed: dict[tuple[str, TopicPartition], int] = {}
+        self._changed = threading.Condition()
+
+    def create_topic(self, topic: str, partitions: int | None = None) -> bool:
+        """
+        Returns False when the topic already exists.
+        """
+        with self._changed:
+            if topic in self._partitions:
+                return False
+            self._partitions[topic] = partitions or self.default_partitions
+            return True
+
+    def partitions_for_topic(self, topic: str) -> set[int]:
+        self.create_topic(topic)
+        with self._changed:
+            return set(range(self._partitions[topic]))
+
+    def append(self, topic: str, key: bytes | None, value: bytes) -> tuple[int, int]:
+        """
+        Returns the partition and offset of the record.
+        """
+        partitions = sorted(self.partitions_for_topic(topic))
+        partition = _partitioner(key, partitions, partitions)
+        with self._changed:
+            log = self._logs.setdefault(TopicPartition(topic, partition), [])
+            log.append((key, value))
+            self._changed.notify_all()
+            return partition, len(log) - 1
+
+    def read(self, partition: TopicPartition, offset: int) -> list[tuple[bytes | None, bytes]]:
+        with self._changed:
+            return self._logs.get(partition, [])[offset:]
+
+    def commit(self, group_id: str, partition: TopicPartition, offset: int):
+        with self._changed:
+            self._committed[(group_id, partition)] = offset
+
+    def committed(self, group_id: str, topic: str, partition: int | None = None) -> int:
+        """
+        The committed offset of a partition, or the sum over every partition of the topic when partition is None.
+        """
+        with self._changed:
+            if partition is not None:
+                return self._committed.get((group_id, TopicPartition(topic, partition)), 0)
+            return sum(offset for (group, committed_partition), offset in self._committed.items()
+                       if group == group_id and committed_partition.topic == topic)
+
+    def wait_for_records(self, positions: dict[TopicPartition, int], timeout: float | None) -> bool:
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: any(len(self._logs.get(partition, [])) > offset for partition, offset in positions.items()),
+                timeout)
+
+    def producer(self, **kwargs) -> "MemoryProducer":
+        return MemoryProducer(self, **kwargs)
+
+    def consumer(self, *topics: str, **kwargs) -> "MemoryConsumer":
+        return MemoryConsumer(self, *topics, **kwargs)
+
+    def admin(self, **_kafka_config) -> "MemoryAdmin":
+        return MemoryAdmin(self)
+
+
+class MemoryAdmin:
+    def __init__(self, broker: MemoryBroker):
+        self.broker = broker
+
+    def create_topics(self, new_topics: list[NewTopic], **_kwargs):
+        for new_topic in new_topics:
+            if not self.broker.create_topic(new_topic.name, new_topic.num_partitions):
+                raise TopicAlreadyExistsError(f"Topic {new_topic.name} already exists")
+
+    def close(self):
+        pass
+
+
+class MemoryProducer:
+    """
+    Like KafkaProducer, send() only buffers the record and returns a future. A background thread delivers the buffered
+    records in batches, waiting linger_ms for more records before paying the broker's round trip once per batch.
+    """
+
+    def __init__(self, broker: MemoryBroker, value_serializer: Callable[[Any], bytes] | None = None,
+                 key_serializer: Callable[[Any], bytes] | None = None, linger_ms: int = 0, **_kafka_config):
+        self.broker = broker
+        self.value_serializer = value_serializer or (lambda v: v)
+        self.key_serializer = key_serializer or (lambda k: k)
+        self.linger_ms = linger_ms
+        self.batches_sent = 0
+        self._buffer: list[tuple[str, bytes | None, bytes, Future]] = []
+        self._sending = False
+        self._closed = False
+        self._changed = threading.Condition()
+        threading.Thread(target=self._send_batches, daemon=True, name="memory_producer").start()
+
+    def send(self, topic: str, value: Any = None, key: Any = None) -> Future:
+        """
+        Returns a future that resolves to the record's (partition, offset), or fails when the broker is not
+        available.
+        """
+        future = Future()
+        record = (topic, self.key_serializer(key) if key is not None else None, self.value_serializer(value), future)
+        with self._changed:
+            self._buffer.append(record)
+            self._changed.notify_all()
+        return future
+
+    def _send_batches(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._buffer or self._closed)
+                if not self._buffer:
+                    return
+                self._sending = True
+            if self.linger_ms:
+                time.sleep(self.linger_ms / 1000)
+            with self._changed:
+                batch, self._buffer = self._buffer, []
+
+            if self.broker.latency_seconds:
+                time.sleep(self.broker.latency_seconds)
+            for topic, key, value, future in batch:
+                if self.broker.available:
+                    future.success(self.broker.append(topic, key, value))
+                else:
+                    future.failure(KafkaTimeoutError(f"Failed to send to {topic}, the broker is not available"))
+
+            with self._changed:
+                self.batches_sent += 1
+                self._sending = False
+                self._changed.notify_all()
+
+    def flush(self, timeout: float | None = None):
+        """
+        Wait until every buffered record was sent.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: not self._buffer and not self._sending, timeout)
+
+    def close(self, timeout: float | None = None):
+        self.flush(timeout)
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+
+class MemoryConsumer:
+    """
+    Reads the partitions it was assigned, or every partition of the topics it subscribed to, from the group's committed
+    offset. Consumers of a group don't rebalance, use assign() to split partitions between consumers.
+    Iterating blocks until there are new records.
+    """
+
+    def __init__(self, broker: MemoryBroker, *topics: str, group_id: str | None = None,
+                 value_deserializer: Callable[[bytes], Any] | None = None,
+                 key_deserializer: Callable[[bytes], Any] | None = None, enable_auto_commit: bool = True,
+                 **_kafka_config):
+        self.broker = broker
+        self.group_id = group_id
+        self.enable_auto_commit = enable_auto_commit
+        self.value_deserializer = value_deserializer or (lambda v: v)
+        self.key_deserializer = key_deserializer or (lambda k: k)
+        self._positions: dict[TopicPartition, int] = {}
+        self._closed = False
+        self.subscribe(topics)
+
+    def subscribe(self, topics):
+        self.assign([TopicPartition(topic, partition)
+                     for topic in topics for partition in sorted(self.broker.partitions_for_topic(topic))])
+
+    def assign(self, partitions: list[TopicPartition]):
+        for partition in partitions:
+            self._positions.setdefault(
+                partition, self.broker.committed(self.group_id, partition.topic, partition.partition)
+                if self.group_id else 0)
+
+    def assignment(self) -> set[TopicPartition]:
+        return set(self._positions)
+
+    def partitions_for_topic(self, topic: str) -> set[int]:
+        return self.broker.partitions_for_topic(topic)
+
+    def _fetch(self, max_records: int | None = None) -> list[MemoryRecord]:
+        records = []
+        for partition, offset in self._positions.items():
+            for key, value in self.broker.read(partition, offset)[:max_records and max_records - len(records)]:
+                records.append(MemoryRecord(partition.topic, partition.partition, offset,
+                                            self.key_deserializer(key) if key is not None else None,
+                                            self.value_deserializer(value)))
+                offset += 1
+            self._positions[partition] = offset
+        if self.group_id and self.enable_auto_commit:
+            self.commit()
+        return records
+
+    def poll(self, timeout_ms: int = 0, max_records: int | None = None) -> dict[TopicPartition, list[MemoryRecord]]:
+        self.broker.wait_for_records(self._positions, timeout=timeout_ms / 1000)
+        batch: dict[TopicPartition, list[MemoryRecord]] = {}
+        for record in self._fetch(max_records):
+            batch.setdefault(TopicPartition(record.topic, record.partition), []).append(record)
+        return batch
+
+    def commit(self, offsets: dict[TopicPartition, OffsetAndMetadata] | None = None):
+        """
+        Commit the given offsets, or the current position of every partition.
+        """
+        if offsets is None:
+            offsets = {partition: OffsetAndMetadata(offset, None, -1) for partition, offset in self._positions.items()}
+        for partition, offset in offsets.items():
+            self.broker.commit(self.group_id, partition, offset.offset)
+
+    def __iter__(self) -> Iterator[MemoryRecord]:
+        while not self._closed:
+            if self.broker.wait_for_records(self._positions, timeout=0.1):
+                yield from self._fetch()
+
+    def close(self):
+        self._closed = True
+
+
+if __name__ == "__main__":
+    import json
+
+    broker = MemoryBroker()
+    producer = broker.producer(value_serializer=lambda v: json.dumps(v).encode("utf-8"))
+    consumer = broker.consumer(value_deserializer=lambda m: json.loads(m.decode("utf-8")))
+    consumer.subscribe(["quiz_question"])
+
+    for i in range(3):
+        producer.send("quiz_question", {"number": i})
+    producer.send("other_topic", {"number": 99})
+    producer.flush()
+
+    received = []
+    for record in consumer:
+        received.append(record.value["number"])
+        if len(received) == 3:
+            consumer.close()
+    assert received == [0, 1, 2], received
+
+    # A group resumes from its committed offset
+    consumer = broker.consumer("quiz_question", group_id="progress", enable_auto_commit=False)
+    batch = consumer.poll(timeout_ms=100, max_records=2)
+    assert [record.offset for record in batch[TopicPartition("quiz_question", 0)]] == [0, 1]
+    consumer.commit({TopicPartition("quiz_question", 0): OffsetAndMetadata(1, None, -1)})
+    consumer = broker.consumer("quiz_question", group_id="progress", enable_auto_commit=False)
+    batch = consumer.poll(timeout_ms=100)
+    assert [record.offset for record in batch[TopicPartition("quiz_question", 0)]] == [1, 2]
+
+    # Records with the same key go to the same partition
+    broker = MemoryBroker(default_partitions=4)
+    producer = broker.producer(key_serializer=lambda k: k.encode("utf-8"))
+    futures = {username: [producer.send("quiz_question", b"answer", key=username) for _ in range(5)]
+               for username in ["alice", "bob", "carol", "dave", "erin", "frank"]}
+    producer.flush()
+    assert all(len({future.value[0] for future in user_futures}) == 1 for user_futures in futures.values())
+    assert len({user_futures[0].value[0] for user_futures in futures.values()}) > 1
+    consumer = broker.consumer(group_id="progress")
+    consumer.assign([TopicPartition("quiz_question", 0), TopicPartition("quiz_question", 1)])
+    batch = consumer.poll(timeout_ms=100)
+    assert set(batch) <= {TopicPartition("quiz_question", 0), TopicPartition("quiz_question", 1)}
+
+    # Records sent within linger_ms go out in one batch, failed deliveries call the errback
+    broker = MemoryBroker(latency_seconds=0.05)
+    producer = broker.producer(linger_ms=20)
+    futures = [producer.send("quiz_question", b"record") for _ in range(100)]
+    producer.flush()
+    assert [future.value for future in futures] == [(0, offset) for offset in range(100)]
+    assert producer.batches_sent == 1
+    broker.available = False
+    errors = []
+    producer.send("quiz_question", b"lost").add_errback(errors.append)
+    producer.close()
+    assert len(errors) == 1 and isinstance(errors[0], KafkaTimeoutError)
+    print("OK")
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from typing import Any
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_openai import ChatOpenAI
+from openai import OpenAI
+
+from services.governor import GovernedTransport, ModelGovernor, get_model_governor
+
+DEFAULT_OPENAI_MAX_CONNECTIONS = 20
+DEFAULT_OPENAI_TIMEOUT_SECONDS = 600
+
+# Named models of the agents, configured once and shared by every call
+MODELS: dict[str, dict[str, Any]] = {
+    "supervisor": {"model": "gpt-4o"},
+    "study_guide_builder": {"model": "gpt-4o", "temperature": 0},
+    "quiz_question_builder": {"model": "gpt-4o"},
+    "quiz_grader": {"model": "gpt-4o", "temperature": 0},
+    "general_chat_agent": {"model": "gpt-4o", "temperature": 0.2},
+    "study_progress": {"model": "gpt-4o"},
+}
+
+
+class ModelMetrics(BaseCallbackHandler):
+    """
+    Counts the calls, errors, latency and tokens of a model. Attached to the model as a callback, so it sees every
+    call, including structured output and streaming calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._started: dict[UUID, float] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        input_tokens, output_tokens = _token_usage(response)
+        with self._lock:
+            seconds = time.perf_counter() - self._started.pop(run_id, time.perf_counter())
+            self.calls += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._started.pop(run_id, None)
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors,
+                    "avg_seconds": self.total_seconds / self.calls if self.calls else 0.0,
+                    "max_seconds": self.max_seconds, "input_tokens": self.input_tokens,
+                    "output_tokens": self.output_tokens}
+
+
+def _token_usage(response: LLMResult) -> tuple[int, int]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class ModelRegistry:
+    """
+    Creates the named models of MODELS on first use and hands out the same instance afterwards, together with its
+    structured output wrappers. All OpenAI clients share one pooled HTTP client, so connections are kept alive and
+    reused across calls and threads instead of being opened by every new client. The HTTP client sends every model
+    call through the governor, which keeps all agents within the models' rate limits.
+    Args:
+        models: name -> ChatOpenAI arguments, MODELS by default
+        http_client: shared HTTP client, one with OPENAI_MAX_CONNECTIONS pooled connections by default
+        governor: governor of the default HTTP client's calls, the process wide governor by default
+        max_retries: retries of the OpenAI clients themselves, none by default as the governor retries rate limited
+            and failed calls
+    """
+
+    def __init__(self, models: dict[str, dict[str, Any]] | None = None, http_client: httpx.Client | None = None,
+                 governor: ModelGovernor | None = None, max_retries: int = 0):
+        self.models = dict(models or MODELS)
+        self.governor = governor or get_model_governor()
+        self.max_retries = max_retries
+        self.http_client = http_client or httpx.Client(
+            transport=GovernedTransport(self.governor, httpx.HTTPTransport(limits=httpx.Limits(
+                max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", DEFAULT_OPENAI_MAX_CONNECTIONS))))),
+            timeout=float(os.getenv("OPENAI_TIMEOUT_SECONDS", DEFAULT_OPENAI_TIMEOUT_SECONDS)))
+        self._instances: dict[str, Any] = {}
+        self._structured: dict[tuple[str, Any], Any] = {}
+        self._metrics: dict[str, ModelMetrics] = {}
+        self._openai_client = None
+        self._lock = threading.Lock()
+
+    def get(self, name: str, schema: Any = None):
+        """
+        Get a named model, or its structured output wrapper for schema.
+        """
+        with self._lock:
+            model = self._instances.get(name)
+            if model is None:
+                model = self._instances[name] = self._create(name)
+            if schema is None:
+                return model
+            structured = self._structured.get((name, schema))
+            if structured is None:
+                structured = self._structured[(name, schema)] = model.with_structured_output(schema)
+            return structured
+
+    def set(self, name: str, model):
+        """
+        Use model for a name, e.g. a local fake in tests and benchmarks.
+        """
+        with self._lock:
+            self._instances[name] = model
+            for key in [key for key in self._structured if key[0] == name]:
+                del self._structured[key]
+
+    def _create(self, name: str):
+        metrics = self._metrics.setdefault(name, ModelMetrics())
+        return ChatOpenAI(**self.models[name], http_client=self.http_client, callbacks=[metrics],
+                          max_retries=self.max_retries)
+
+    def openai_client(self):
+        """
+        OpenAI client for the APIs that are not chat models, e.g. speech.
+        """
+        with self._lock:
+            if self._openai_client is None:
+                self._openai_client = OpenAI(http_client=self.http_client, max_retries=self.max_retries)
+            return self._openai_client
+
+    def metrics(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: metrics.snapshot() for name, metrics in self._metrics.items()}
+
+
+_registry: ModelRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
+
+
+def get_model(name: str, schema: Any = None):
+    """
+    Get a named model of the process wide registry, see ModelRegistry.get.
+    """
+    return get_model_registry().get(name, schema)
@@ -0,0 +1,69 @@
+import os
+
+from services.db_pool import write_connection
+
+DEFAULT_ARCHIVE_DB_PATH = "checkpoints.db"
+
+
+def _db_path() -> str:
+    """
+    Archived quiz questions live next to the checkpoints they were taken out of.
+    """
+    return os.getenv("CHECKPOINT_DB_PATH", DEFAULT_ARCHIVE_DB_PATH)
+
+
+def _create_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS quiz_question_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        quiz_question TEXT NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS quiz_question_archive_topic ON quiz_question_archive (username, subject, topic)
+    """)
+
+
+def archive_quiz_questions(username: str, subject: str, topic: str, quiz_questions: list[str],
+                           db_path: str | None = None):
+    """
+    Store graded quiz questions that are no longer kept in agent state, oldest first.
+    """
+    if not quiz_questions:
+        return
+    with write_connection(db_path or _db_path()) as conn:
+        _create_table(conn)
+        conn.executemany("""
+            INSERT INTO quiz_question_archive (username, subject, topic, quiz_question) VALUES (?, ?, ?, ?)
+        """, [(username, subject, topic, quiz_question) for quiz_question in quiz_questions])
+
+
+def get_archived_quiz_questions(username: str, subject: str, topic: str, db_path: str | None = None) -> list[str]:
+    """
+    Get the archived quiz questions of a user's topic, oldest first.
+    """
+    with write_connection(db_path or _db_path()) as conn:
+        _create_table(conn)
+        rows = conn.execute("""
+            SELECT quiz_question FROM quiz_question_archive WHERE username = ? AND subject = ? AND topic = ?
+            ORDER BY id
+        """, (username, subject, topic)).fetchall()
+    return [quiz_question for (quiz_question,) in rows]
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = str(Path(tmp) / "checkpoints.db")
+        archive_quiz_questions("alice", "Algorithms", "Sorting", ["Q1", "Q2"], test_db)
+        archive_quiz_questions("alice", "Algorithms", "Sorting", ["Q3"], test_db)
+        archive_quiz_questions("bob", "Algorithms", "Sorting", ["Other"], test_db)
+        assert get_archived_quiz_questions("alice", "Algorithms", "Sorting", test_db) == ["Q1", "Q2", "Q3"]
+        assert get_archived_quiz_questions("alice", "Algorithms", "Searching", test_db) == []
+    print("OK")
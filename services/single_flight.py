@@ -0,0 +1,81 @@
+import threading
+from typing import Any, Callable, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller runs fn and the others wait for its
+    result (or its exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    llm_calls = []
+
+
+    def build_study_guide(topic: str) -> str:
+        llm_calls.append(topic)
+        time.sleep(0.2)
+        return f"Study guide for {topic}"
+
+
+    # 10 double clicks on the same topic make one LLM call
+    single_flight = SingleFlight()
+    with ThreadPoolExecutor(10) as executor:
+        results = list(executor.map(lambda _: single_flight.do(("thread-1", "Heap"), build_study_guide, "Heap"),
+                                    range(10)))
+    assert results == ["Study guide for Heap"] * 10
+    assert llm_calls == ["Heap"], llm_calls
+
+    # Errors are shared too
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("LLM unavailable")
+
+
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(single_flight.do, "failing", fail) for _ in range(3)]
+    assert all(isinstance(f.exception(), ValueError) for f in futures)
+    print("OK")
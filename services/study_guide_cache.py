@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any
+
+from services.db_pool import write_connection
+
+DEFAULT_CACHE_DB_PATH = "checkpoints.db"
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+
+
+def cache_key(inputs: dict[str, Any]) -> str:
+    """
+    Content address of a study guide: a hash of everything that went into generating it. Whitespace in strings is
+    normalized and the order of the inputs doesn't matter, so equivalent inputs share an entry.
+    Args:
+        inputs: JSON serializable inputs, e.g. subject, topic, style, level, model name and prompt
+    """
+
+    def normalize(value):
+        if isinstance(value, str):
+            return " ".join(value.split())
+        if isinstance(value, dict):
+            return {key: normalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(item) for item in value]
+        return value
+
+    return hashlib.sha256(json.dumps(normalize(inputs), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class StudyGuideCache:
+    """
+    Persistent cache of generated study guides shared by all users, keyed by cache_key of the generation inputs.
+    Entries expire ttl_seconds after they were created. When there are more than max_entries entries, or they take
+    more than max_bytes, the least recently used entries are evicted.
+    Args:
+        db_path: SQLite database of the cache, CHECKPOINT_DB_PATH by default
+        max_entries: STUDY_GUIDE_CACHE_MAX_ENTRIES by default, 0 disables the cache
+        max_bytes: STUDY_GUIDE_CACHE_MAX_BYTES by default
+        ttl_seconds: STUDY_GUIDE_CACHE_TTL_SECONDS by default
+    """
+
+    def __init__(self, db_path: str | None = None, max_entries: int | None = None, max_bytes: int | None = None,
+                 ttl_seconds: float | None = None):
+        self.db_path = db_path or os.getenv("CHECKPOINT_DB_PATH", DEFAULT_CACHE_DB_PATH)
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.getenv("STUDY_GUIDE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv("STUDY_GUIDE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv("STUDY_GUIDE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            with write_connection(self.db_path) as conn:
+                conn.execute("""
+                CREATE TABLE IF NOT EXISTS study_guide_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> dict | None:
+        """
+        Get a cached study guide, None when there is none or it expired.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with write_connection(self.db_path) as conn:
+            row = conn.execute("SELECT value FROM study_guide_cache WHERE key = ? AND created_at > ?",
+                               (key, now - self.ttl_seconds)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE study_guide_cache SET last_used_at = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, value: dict):
+        """
+        Cache a study guide, then evict expired and least recently used entries to stay within the limits.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        data = json.dumps(value)
+        with write_connection(self.db_path) as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO study_guide_cache (key, value, size, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, data, len(data.encode("utf-8")), now, now))
+            evicted = conn.execute("DELETE FROM study_guide_cache WHERE created_at <= ?",
+                                   (now - self.ttl_seconds,)).rowcount
+
+            entries, total_bytes, lru = 0, 0, []
+            for entry_key, size in conn.execute("SELECT key, size FROM study_guide_cache ORDER BY last_used_at DESC"):
+                entries += 1
+                total_bytes += size
+                if entries > self.max_entries or total_bytes > self.max_bytes:
+                    lru.append((entry_key,))
+            conn.executemany("DELETE FROM study_guide_cache WHERE key = ?", lru)
+
+        with self._lock:
+            self.evictions += evicted + len(lru)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = str(Path(tmp) / "cache.db")
+        inputs = {"subject": "Data Structures", "topic": "Heap", "style": "textbook", "level": 1, "model": "gpt-4o",
+                  "prompt": "Generate a study guide for {{ topic }}", "passages": "abc"}
+        assert cache_key(inputs) == cache_key({**inputs, "topic": " Heap\n"}), "Whitespace is normalized"
+        assert cache_key(inputs) == cache_key(dict(reversed(list(inputs.items())))), "Order doesn't matter"
+
+        cache = StudyGuideCache(test_db, max_entries=2, max_bytes=10_000, ttl_seconds=60)
+        assert cache.get(cache_key(inputs)) is None
+        cache.put(cache_key(inputs), {"study_guide_text": "Heaps are trees"})
+        assert cache.get(cache_key(inputs)) == {"study_guide_text": "Heaps are trees"}
+
+        # A change to the prompt template invalidates the cached entries
+        changed_prompt = {**inputs, "prompt": "Generate a study guide with examples for {{ topic }}"}
+        assert cache.get(cache_key(changed_prompt)) is None
+        for changed in [{"level": 2}, {"style": "podcast"}, {"model": "gpt-4o-mini"}, {"passages": "abd"}]:
+            assert cache.get(cache_key({**inputs, **changed})) is None, changed
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 6, cache.stats()
+
+        # The least recently used entry is evicted
+        cache.put(cache_key(changed_prompt), {"study_guide_text": "Heaps are trees, with examples"})
+        time.sleep(0.01)
+        assert cache.get(cache_key(inputs)) is not None
+        cache.put(cache_key({**inputs, "level": 2}), {"study_guide_text": "Heaps, level 2"})
+        assert cache.get(cache_key(changed_prompt)) is None and cache.get(cache_key(inputs)) is not None
+        assert cache.evictions == 1
+
+        # Entries over the size limit and expired entries are evicted
+        small = StudyGuideCache(test_db, max_entries=10, max_bytes=100, ttl_seconds=60)
+        small.put("big", {"study_guide_text": "x" * 200})
+        assert small.get("big") is None
+        expiring = StudyGuideCache(test_db, max_entries=10, max_bytes=10_000, ttl_seconds=0.05)
+        expiring.put("short", {"study_guide_text": "Heaps"})
+        assert expiring.get("short") is not None
+        time.sleep(0.1)
+        assert expiring.get("short") is None
+
+        assert StudyGuideCache(test_db, max_entries=0).get(cache_key(inputs)) is None, "max_entries=0 disables"
+    print("OK")
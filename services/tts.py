@@ -0,0 +1,226 @@
+import hashlib
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Protocol
+
+from services.models import get_model_registry
+
+DEFAULT_MODEL = "gpt-4o-mini-tts"
+DEFAULT_VOICE = "fable"
+DEFAULT_INSTRUCTIONS = "Speak in an engaging way but also stay calm to give the listener confidence."
+DEFAULT_CACHE_DIR = "audio/cache"
+DEFAULT_TTS_WORKERS = 4
+# The speech API accepts up to 4096 characters per request
+MAX_CHUNK_CHARS = 4000
+
+
+class SpeechClient(Protocol):
+    """
+    Turns text into mp3 bytes.
+    """
+
+    def __call__(self, text: str, voice: str, model: str, instructions: str) -> bytes: ...
+
+
+class OpenAISpeech:
+    """
+    SpeechClient of the OpenAI speech API.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    def __call__(self, text: str, voice: str, model: str, instructions: str) -> bytes:
+        # The registry's client shares its pooled connections with the chat models
+        client = self._client or get_model_registry().openai_client()
+        with client.audio.speech.with_streaming_response.create(
+                model=model, voice=voice, input=text, instructions=instructions) as response:
+            return b"".join(response.iter_bytes())
+
+
+class SynthesisResult(NamedTuple):
+    path: str
+    chunks: int
+    synthesized: int
+
+
+def split_paragraphs(text: str, max_chars: int = MAX_CHUNK_CHARS) -> list[str]:
+    """
+    Split text into the chunks that are synthesized one by one: its paragraphs, with paragraphs longer than max_chars
+    split between sentences. Editing a paragraph only changes that paragraph's chunks.
+    """
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            chunks.append(paragraph)
+    return chunks
+
+
+class AudioSynthesizer:
+    """
+    Creates the audio of a text paragraph by paragraph. The audio of every paragraph is cached by a hash of the
+    paragraph, voice, model and instructions, and paragraphs that are not cached yet are synthesized in parallel on a
+    bounded pool. The audio file of the text is the concatenation of its paragraphs' mp3s.
+    Args:
+        client: speech client, the OpenAI speech API by default
+        voice: voice of the speech
+        model: speech model
+        instructions: how to speak
+        cache_dir: where the audio of the paragraphs is cached
+        max_workers: concurrent speech requests, TTS_WORKERS by default
+    """
+
+    def __init__(self, client: SpeechClient | None = None, voice: str = DEFAULT_VOICE, model: str = DEFAULT_MODEL,
+                 instructions: str = DEFAULT_INSTRUCTIONS, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_workers: int | None = None):
+        self.client = client or OpenAISpeech()
+        self.voice = voice
+        self.model = model
+        self.instructions = instructions
+        self.cache_dir = Path(cache_dir)
+        max_workers = max_workers or int(os.getenv("TTS_WORKERS", DEFAULT_TTS_WORKERS))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+
+    def chunk_path(self, chunk: str) -> Path:
+        key = json.dumps({"text": chunk, "voice": self.voice, "model": self.model,
+                          "instructions": self.instructions}, sort_keys=True)
+        return self.cache_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.mp3"
+
+    def synthesize(self, text: str, path: str) -> SynthesisResult:
+        """
+        Write the audio of text to path.
+        Returns:
+            the path, the number of paragraph chunks and how many of them had to be synthesized
+        """
+        chunks = split_paragraphs(text)
+        chunk_paths = [self.chunk_path(chunk) for chunk in chunks]
+        missing = {chunk_path: chunk for chunk, chunk_path in zip(chunks, chunk_paths) if not chunk_path.exists()}
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Wait for every chunk before raising, so that finished chunks are cached for the next attempt. The chunks are
+        # synthesized in the caller's context, so that the governor sees the caller's model priority
+        futures = [self._executor.submit(contextvars.copy_context().run, self._synthesize_chunk, chunk, chunk_path)
+                   for chunk_path, chunk in missing.items()]
+        errors = [future.exception() for future in futures]
+        if any(errors):
+            raise next(error for error in errors if error)
+
+        with _atomic_write(Path(path)) as out:
+            for chunk_path in chunk_paths:
+                out.write(chunk_path.read_bytes())
+        print(f"Wrote audio to {path}: {len(missing)} of {len(chunks)} paragraphs synthesized")
+        return SynthesisResult(path, len(chunks), len(missing))
+
+    def _synthesize_chunk(self, chunk: str, chunk_path: Path):
+        audio = self.client(chunk, self.voice, self.model, self.instructions)
+        with _atomic_write(chunk_path) as out:
+            out.write(audio)
+
+
+@contextmanager
+def _atomic_write(path: Path) -> Iterator[BinaryIO]:
+    """
+    Write to a temporary file next to path that replaces path when the block exits cleanly, so readers never see a
+    partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            yield out
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+_synthesizer: AudioSynthesizer | None = None
+_synthesizer_lock = threading.Lock()
+
+
+def get_audio_synthesizer() -> AudioSynthesizer:
+    global _synthesizer
+    with _synthesizer_lock:
+        if _synthesizer is None:
+            _synthesizer = AudioSynthesizer()
+        return _synthesizer
+
+
+def set_audio_synthesizer(synthesizer: AudioSynthesizer):
+    """
+    Replace the process wide synthesizer, e.g. with one that uses a local fake speech client.
+    """
+    global _synthesizer
+    with _synthesizer_lock:
+        _synthesizer = synthesizer
+
+
+if __name__ == "__main__":
+    import time
+
+    calls = []
+
+
+    def fake_speech(text: str, voice: str, model: str, instructions: str) -> bytes:
+        calls.append(text)
+        time.sleep(0.05)
+        return f"[{voice}:{text}]".encode("utf-8")
+
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paragraphs = [f"Paragraph {i} about heaps." for i in range(8)]
+        synthesizer = AudioSynthesizer(fake_speech, cache_dir=f"{tmp}/cache", max_workers=4)
+
+        start = time.perf_counter()
+        result = synthesizer.synthesize("\n\n".join(paragraphs), f"{tmp}/guide.mp3")
+        assert result == SynthesisResult(f"{tmp}/guide.mp3", 8, 8)
+        assert time.perf_counter() - start < 8 * 0.05, "Paragraphs are synthesized in parallel"
+        assert Path(f"{tmp}/guide.mp3").read_bytes() == "".join(f"[fable:{p}]" for p in paragraphs).encode("utf-8")
+
+        # Only changed paragraphs are synthesized again
+        calls.clear()
+        paragraphs[3] = "Focus Area: sifting down."
+        assert synthesizer.synthesize("\n\n".join(paragraphs), f"{tmp}/guide.mp3").synthesized == 1
+        assert calls == ["Focus Area: sifting down."]
+        assert synthesizer.synthesize("\n\n".join(paragraphs), f"{tmp}/other.mp3").synthesized == 0
+
+        # Another voice is another cache entry
+        other_voice = AudioSynthesizer(fake_speech, voice="alloy", cache_dir=f"{tmp}/cache")
+        assert other_voice.synthesize(paragraphs[0], f"{tmp}/alloy.mp3").synthesized == 1
+
+        long_paragraph = "A heap is a tree. " * 500
+        assert all(len(chunk) <= MAX_CHUNK_CHARS for chunk in split_paragraphs(long_paragraph))
+        assert " ".join(split_paragraphs(long_paragraph)) == long_paragraph.strip()
+
+        # Chunks are synthesized with the caller's model priority
+        from services.governor import _priority, model_priority
+
+        priorities = []
+        prioritized = AudioSynthesizer(lambda *args: priorities.append(_priority.get()) or b"",
+                                       cache_dir=f"{tmp}/priority_cache", max_workers=2)
+        with model_priority("background"):
+            prioritized.synthesize("\n\n".join(paragraphs), f"{tmp}/background.mp3")
+        assert priorities == ["background"] * len(paragraphs), priorities
+
+        # Failures don't leave a partial file behind
+        failing = AudioSynthesizer(lambda *args: 1 / 0, cache_dir=f"{tmp}/cache")
+        try:
+            failing.synthesize("New paragraph", f"{tmp}/failed.mp3")
+            raise AssertionError("Expected the failure to be raised")
+        except ZeroDivisionError:
+            pass
+        assert not Path(f"{tmp}/failed.mp3").exists() and not list(Path(f"{tmp}/cache").glob("*.tmp"))
+    print("OK")
@@ -0,0 +1,130 @@
+import os
+import threading
+
+from services.db_pool import write_connection
+
+DEFAULT_REGISTRY_DB_PATH = "checkpoints.db"
+
+
+class UserRegistry:
+    """
+    Maps users to the thread ids of their agent state. Thread ids are allocated by SQLite, so concurrent first logins
+    get different thread ids, also when they happen in different processes, and the mapping survives restarts.
+    Known users are cached in memory in both directions.
+    Args:
+        db_path: SQLite database of the registry, CHECKPOINT_DB_PATH by default so it lives next to the checkpoints
+    """
+
+    def __init__(self, db_path: str | None = None):
+        self.db_path = db_path or os.getenv("CHECKPOINT_DB_PATH", DEFAULT_REGISTRY_DB_PATH)
+        self._thread_ids: dict[str, int] = {}
+        self._user_ids: dict[int, str] = {}
+        self._lock = threading.Lock()
+        with write_connection(self.db_path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                thread_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+
+    def get_thread_id(self, user_id: str) -> int:
+        """
+        Get the thread id of a user, allocating one on the user's first login.
+        """
+        if not user_id:
+            raise ValueError("Only users who logged in have a thread id")
+        thread_id = self._thread_ids.get(user_id)
+        if thread_id is not None:
+            return thread_id
+
+        with write_connection(self.db_path) as conn:
+            # Another thread or process may register the user at the same time, the unique user_id picks one winner
+            conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            (thread_id,) = conn.execute("SELECT thread_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        self._remember(user_id, thread_id)
+        return thread_id
+
+    def get_user_id(self, thread_id: int) -> str | None:
+        user_id = self._user_ids.get(thread_id)
+        if user_id is not None:
+            return user_id
+
+        with write_connection(self.db_path) as conn:
+            row = conn.execute("SELECT user_id FROM users WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return None
+        self._remember(row[0], thread_id)
+        return row[0]
+
+    def users(self) -> list[tuple[str, int]]:
+        """
+        Every registered user and their thread id, in the order they registered.
+        """
+        with write_connection(self.db_path) as conn:
+            return conn.execute("SELECT user_id, thread_id FROM users ORDER BY thread_id").fetchall()
+
+    def _remember(self, user_id: str, thread_id: int):
+        with self._lock:
+            self._thread_ids[user_id] = thread_id
+            self._user_ids[thread_id] = user_id
+
+
+_registry: UserRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_user_registry() -> UserRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = UserRegistry()
+        return _registry
+
+
+def _register_users(db_path: str, user_ids: list[str]) -> dict[str, int]:
+    registry = UserRegistry(db_path)
+    return {user_id: registry.get_thread_id(user_id) for user_id in user_ids}
+
+
+if __name__ == "__main__":
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from pathlib import Path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = str(Path(tmp) / "checkpoints.db")
+        registry = UserRegistry(test_db)
+
+        # 10,000 concurrent registrations, every user logs in twice at the same time
+        users = [f"user-{i}" for i in range(5000)]
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            thread_ids = list(executor.map(registry.get_thread_id, users + users))
+        assert thread_ids[:5000] == thread_ids[5000:], "Concurrent logins of a user get the same thread id"
+        assert len(set(thread_ids)) == 5000, "No two users share a thread id"
+        assert all(registry.get_user_id(thread_id) == user for user, thread_id in zip(users, thread_ids))
+
+        # Another process, or a restart, sees the same ids and allocates new ones without collisions
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            new_users = [[f"new-user-{i}" for i in range(j, 2000, 4)] for j in range(4)]
+            results = list(executor.map(_register_users, [test_db] * 5, new_users + [users[:100]]))
+        assert results[-1] == dict(zip(users[:100], thread_ids[:100]))
+        new_thread_ids = [thread_id for result in results[:-1] for thread_id in result.values()]
+        assert len(set(new_thread_ids) | set(thread_ids)) == 7000
+
+        restarted = UserRegistry(test_db)
+        assert restarted.get_user_id(thread_ids[42]) == users[42]
+        assert restarted.get_thread_id(users[42]) == thread_ids[42]
+        assert restarted.get_user_id(10 ** 9) is None
+        assert len(restarted.users()) == 7000 and (users[0], thread_ids[0]) in restarted.users()
+
+        # Anonymous visitors have no thread, nothing is registered for them
+        for anonymous in (None, ""):
+            try:
+                restarted.get_thread_id(anonymous)
+                raise AssertionError("Expected anonymous visitors to be refused")
+            except ValueError:
+                pass
+        assert len(restarted.users()) == 7000
+    print("OK")